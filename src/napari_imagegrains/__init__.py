@@ -4,12 +4,23 @@ try:
 except ImportError:
     __version__ = "unknown"
 
-from .imgr_proc_widget import ImageGrainProcWidget
-from .imgr_stats_widget import ImageGrainStatsWidget
-from .imgr_demodata_widget import ImageGrainDemoWidget
-
 __all__ = (
     "ImageGrainProcWidget",
     "ImageGrainStatsWidget",
     "ImageGrainDemoWidget",
 )
+
+
+def __getattr__(name):
+    # widgets are imported lazily so that the headless batch module can be
+    # used without Qt and napari
+    if name == "ImageGrainProcWidget":
+        from .imgr_proc_widget import ImageGrainProcWidget
+        return ImageGrainProcWidget
+    if name == "ImageGrainStatsWidget":
+        from .imgr_stats_widget import ImageGrainStatsWidget
+        return ImageGrainStatsWidget
+    if name == "ImageGrainDemoWidget":
+        from .imgr_demodata_widget import ImageGrainDemoWidget
+        return ImageGrainDemoWidget
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
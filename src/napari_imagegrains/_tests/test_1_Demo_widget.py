@@ -52,6 +52,7 @@ def test_1_Demo_widget(make_napari_viewer):
 
 
     self._on_click_download_demodata()
+    self.wait_for_download()
     napari.utils.NotebookScreenshot(viewer)
 
 
@@ -40,6 +40,7 @@ def test_2_1_Processing_widget_segmentation_tab(make_napari_viewer):
     viewer = make_napari_viewer()
     demo_widget = ImageGrainDemoWidget(viewer=viewer)
     demo_widget._on_click_download_demodata()
+    demo_widget.wait_for_download()
 
     self = demo_widget.widget
 
@@ -183,6 +184,7 @@ def test_2_1_Processing_widget_segmentation_tab(make_napari_viewer):
     self.check_change_diameter.setChecked(False)
     self.check_save_mask.setChecked(True)
     self._on_click_segment_image_folder()
+    self.wait_for_folder_segmentation()
 
 
     # In[18]:
@@ -222,6 +224,7 @@ def test_2_1_Processing_widget_segmentation_tab(make_napari_viewer):
     self.repo_model_path_display.setText("https://zenodo.org/records/15309324/files/IG2baseline.260424?download=1")
     self.local_directory_model_path_display.set_value(Path.home().joinpath("imagegrains/models"))
     self._on_click_download_model()
+    self.wait_for_model_download()
 
 
     # In[22]:
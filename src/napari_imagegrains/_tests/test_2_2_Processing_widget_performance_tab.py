@@ -40,6 +40,7 @@ def test_2_2_Processing_widget_performance_tab(make_napari_viewer):
     viewer = make_napari_viewer()
     demo_widget = ImageGrainDemoWidget(viewer=viewer)
     demo_widget._on_click_download_demodata()
+    demo_widget.wait_for_download()
 
     self = demo_widget.widget
     
@@ -144,6 +145,7 @@ def test_2_2_Processing_widget_performance_tab(make_napari_viewer):
     self.viewer.layers.clear()
     self.check_save_mask.setChecked(True)
     self._on_click_segment_image_folder()
+    self.wait_for_folder_segmentation()
 
 
     # In[16]:
@@ -42,6 +42,7 @@ def test_3_1_Stats_widget_properties_tab(make_napari_viewer):
     viewer = make_napari_viewer()
     demo_widget = ImageGrainDemoWidget(viewer=viewer)
     demo_widget._on_click_download_demodata()
+    demo_widget.wait_for_download()
 
     self = demo_widget.widget
 
@@ -92,6 +93,7 @@ def test_3_1_Stats_widget_properties_tab(make_napari_viewer):
 
     self.check_save_mask.setChecked(True)
     self._on_click_segment_image_folder()
+    self.wait_for_folder_segmentation()
 
 
     # In[11]:
@@ -0,0 +1,186 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from cellpose import version
+from skimage import io
+
+from napari_imagegrains.access_single_image_widget import predict_images
+from napari_imagegrains.utils import group_images_by_size
+
+
+class StackModel:
+    """Stands in for a Cellpose 4 model evaluating a stack of images."""
+
+    def __init__(self):
+        self.calls = []
+
+    def eval(self, x, **kwargs):
+        self.calls.append((x.shape if isinstance(x, np.ndarray) else len(x), kwargs))
+        if isinstance(x, list):
+            # images of a list are evaluated one by one
+            results = [self.eval(img[np.newaxis], **kwargs) for img in x]
+            return ([r[0][0] for r in results], [[f[0][0], f[1][:, 0], f[2][0]] for _, f, _ in results],
+                    [r[2][0] for r in results])
+        nimg, height, width = x.shape[:3]
+        masks = np.stack([np.full((height, width), ind + 1, dtype=np.uint16) for ind in range(nimg)])
+        dP = np.zeros((2, nimg, height, width), dtype=np.float32)
+        cellprob = np.zeros((nimg, height, width), dtype=np.float32)
+        circ = np.zeros((nimg, height, width, 3), dtype=np.uint8)
+        styles = np.zeros((nimg, 256), dtype=np.float32)
+        return masks, [circ, dP, cellprob], styles
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    shapes = [(20, 30), (20, 30), (10, 10), (20, 30), (20, 30), (20, 30)]
+    paths = []
+    for ind, shape in enumerate(shapes):
+        path = tmp_path.joinpath(f'img{ind}.png')
+        io.imsave(path, np.zeros(shape, dtype=np.uint8), check_contrast=False)
+        paths.append(path)
+    return paths
+
+
+def test_group_images_by_size_keeps_order(image_paths):
+    batches = group_images_by_size(image_paths, memory_budget=20 * 30 * 4 * 2)
+
+    assert [path for batch in batches for path in batch] == image_paths
+    assert [len(batch) for batch in batches] == [2, 1, 2, 1]
+
+
+def test_group_images_by_size_unreadable(image_paths, tmp_path):
+    broken = tmp_path.joinpath('broken.png')
+    broken.write_bytes(b'not an image')
+
+    batches = group_images_by_size(image_paths[:2] + [broken] + image_paths[3:5], memory_budget=10 ** 9)
+
+    assert batches == [image_paths[:2], [broken], image_paths[3:5]]
+
+
+@pytest.mark.skipif(int(str(version).split('.')[0]) < 4, reason='stacked evaluation requires Cellpose 4')
+def test_predict_images_stacks_same_size(tmp_path):
+    model = StackModel()
+    imgs = [np.zeros((20, 30), dtype=np.uint8) for _ in range(3)]
+
+    masks, flows, styles = predict_images(imgs, ['a', 'b', 'c'], model, save_masks=True,
+                                          tar_dir=tmp_path, model_id='m', batch_size=16)
+
+    assert len(model.calls) == 1
+    assert model.calls[0][0] == (3, 20, 30, 1)
+    assert model.calls[0][1]['batch_size'] == 16
+    assert [mask[0, 0] for mask in masks] == [1, 2, 3]
+    assert [flow[1].shape for flow in flows] == [(2, 20, 30)] * 3
+    assert [style.shape for style in styles] == [(256,)] * 3
+    assert io.imread(tmp_path.joinpath('b_m_pred.tif')).shape == (20, 30)
+
+
+def test_segment_in_process_returns_mask_only(image_paths, tmp_path, monkeypatch):
+    from napari_imagegrains import batch
+
+    monkeypatch.setattr(batch, '_process_model', StackModel())
+
+    result = batch._segment_in_process(image_paths[0], save_masks=True, tar_dir=tmp_path.joinpath('preds'),
+                                       model_id='m', diameter=None)
+
+    assert len(result) == 2
+    mask, georef_ok = result
+    assert mask.shape == (20, 30)
+    assert georef_ok
+    assert tmp_path.joinpath('preds', 'img0_m_pred.tif').exists()
+
+
+def test_cli_arguments():
+    from napari_imagegrains.batch import build_parser
+
+    args = build_parser().parse_args(['images', '--model', 'model'])
+    assert args.image_folder.name == 'images'
+    assert args.model.name == 'model'
+    assert args.extensions == ['.jpg', '.jpeg']
+    assert args.batch_size == 8
+    assert args.tile_overlap == 256
+    assert not (args.skip_segmented or args.hash_images or args.zarr or args.gpu)
+
+    args = build_parser().parse_args([
+        'images', '--model', 'model', '--diameter', '25.5', '--extensions', '.png', '.tif',
+        '--batch-memory', '512', '--batch-size', '4', '--skip-segmented', '--hash-images',
+        '--processes', '2'])
+    assert args.diameter == 25.5
+    assert args.extensions == ['.png', '.tif']
+    assert (args.batch_memory, args.batch_size, args.processes) == (512, 4, 2)
+    assert args.skip_segmented and args.hash_images
+
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(['images'])
+
+
+def test_cli_segments_folder(image_paths, tmp_path, monkeypatch, capsys):
+    from napari_imagegrains import batch
+
+    model = StackModel()
+    monkeypatch.setattr(batch.model_cache, 'get', lambda model_path, gpu=False: model)
+    model_path = tmp_path.joinpath('model')
+    model_path.write_bytes(b'weights')
+    argv = [str(tmp_path), '--model', str(model_path), '--extensions', '.png', '--skip-segmented']
+
+    assert batch.main(argv) == 0
+    predictions = sorted(x.name for x in tmp_path.joinpath('predictions').glob('*_pred.tif'))
+    assert predictions == [f'img{ind}_model_pred.tif' for ind in range(6)]
+    assert tmp_path.joinpath('predictions', 'segmentation_manifest.jsonl').exists()
+
+    # the second run skips all images of the manifest
+    num_calls = len(model.calls)
+    assert batch.main(argv) == 0
+    assert len(model.calls) == num_calls
+    assert '6 up-to-date images skipped' in capsys.readouterr().out
+
+
+def test_cli_missing_folder(tmp_path, capsys):
+    from napari_imagegrains.batch import main
+
+    assert main([str(tmp_path.joinpath('missing')), '--model', str(tmp_path.joinpath('model'))]) == 1
+    assert 'not found' in capsys.readouterr().err
+
+
+def test_cli_georef_requires_gdal(image_paths, tmp_path, monkeypatch, capsys):
+    from napari_imagegrains.batch import main
+
+    monkeypatch.setitem(sys.modules, 'osgeo', None)
+    argv = [str(tmp_path), '--model', str(tmp_path.joinpath('model')), '--georef']
+    assert main(argv) == 1
+    assert 'GDAL not installed' in capsys.readouterr().err
+
+
+def test_cli_interrupted_run_saves_manifest(image_paths, tmp_path, monkeypatch, capsys):
+    from napari_imagegrains import batch
+
+    class InterruptedModel:
+        num_images = 0
+
+        def eval(self, x, **kwargs):
+            self.num_images += len(x)
+            if self.num_images > 2:
+                raise KeyboardInterrupt
+            return StackModel().eval(x, **kwargs)
+
+    monkeypatch.setattr(batch.model_cache, 'get', lambda model_path, gpu=False: InterruptedModel())
+    model_path = tmp_path.joinpath('model')
+    model_path.write_bytes(b'weights')
+    argv = [str(tmp_path), '--model', str(model_path), '--extensions', '.png', '--skip-segmented']
+
+    with pytest.raises(KeyboardInterrupt):
+        batch.main(argv)
+
+    # the predictions written before the interruption are in the manifest
+    monkeypatch.setattr(batch.model_cache, 'get', lambda model_path, gpu=False: StackModel())
+    assert batch.main(argv) == 0
+    assert '2 up-to-date images skipped' in capsys.readouterr().out
+
+
+def test_batch_does_not_import_napari():
+    # run in a new interpreter as the test session already imported napari
+    code = "import sys, napari_imagegrains.batch; assert 'napari' not in sys.modules"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, '-c', code], check=True, env=env)
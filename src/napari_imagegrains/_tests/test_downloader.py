@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from napari_imagegrains.downloader import (
+    DownloadCache,
+    DownloadError,
+    DownloadManager,
+    demo_data_files,
+    download_file,
+)
+
+CONTENT = bytes(range(256)) * 4096
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT with support for range requests and counts requests."""
+
+    requests_served = []
+
+    def do_GET(self):
+        self.requests_served.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.requests_served = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/model.bin'
+    httpd.shutdown()
+
+
+def test_download_resume_and_cache(server, tmp_path):
+
+    md5 = hashlib.md5(CONTENT).hexdigest()
+    cache = DownloadCache(tmp_path.joinpath('cache'))
+
+    # simulate an interrupted download
+    cache.partial_path(server).write_bytes(CONTENT[:1000])
+    progress = []
+    target = download_file(server, tmp_path.joinpath('models', 'model.bin'), md5=md5,
+                           cache=cache, progress=lambda done, total: progress.append((done, total)))
+    assert target.read_bytes() == CONTENT
+    assert RangeHandler.requests_served == ['bytes=1000-']
+    assert progress[-1] == (len(CONTENT), len(CONTENT))
+
+    # second download of the same url is served from the cache
+    download_file(server, tmp_path.joinpath('other', 'model.bin'), cache=cache)
+    assert tmp_path.joinpath('other', 'model.bin').read_bytes() == CONTENT
+    assert len(RangeHandler.requests_served) == 1
+
+
+def test_download_checksum_mismatch(server, tmp_path):
+
+    cache = DownloadCache(tmp_path.joinpath('cache'))
+    with pytest.raises(DownloadError):
+        download_file(server, tmp_path.joinpath('model.bin'), md5='0' * 32, cache=cache)
+    assert not tmp_path.joinpath('model.bin').exists()
+    assert not cache.partial_path(server).exists()
+
+
+def test_download_manager(server, tmp_path):
+
+    md5 = hashlib.md5(CONTENT).hexdigest()
+    manager = DownloadManager(max_workers=3, cache=DownloadCache(tmp_path.joinpath('cache')))
+    files = [(f'{server}?file={ind}', tmp_path.joinpath(f'file_{ind}.bin'), md5) for ind in range(4)]
+    files.append((f'{server}?file=bad', tmp_path.joinpath('bad.bin'), '0' * 32))
+
+    progress = list(manager.iter_download_all(files))
+    assert progress[-1].files_done == progress[-1].files_total == 5
+    assert all(tmp_path.joinpath(f'file_{ind}.bin').read_bytes() == CONTENT for ind in range(4))
+
+    # verified files are not downloaded again
+    num_requests = len(RangeHandler.requests_served)
+    failed = manager.download_all(files)
+    assert [url for url, _ in failed] == [f'{server}?file=bad']
+    assert len(RangeHandler.requests_served) == num_requests + 1
+
+
+@pytest.mark.parametrize('cp_version', [3, 4])
+def test_demo_data_files_match_imagegrains(tmp_path, monkeypatch, cp_version):
+    """The demo files are those downloaded by imagegrains.data_loader.download_files."""
+
+    from imagegrains import data_loader
+
+    downloaded = []
+
+    class Response:
+        content = b''
+
+    def record(url, target):
+        downloaded.append((url.replace('main//', 'main/'), Path(target)))
+
+    monkeypatch.setattr(data_loader.urllib.request, 'urlretrieve', record)
+    monkeypatch.setattr(data_loader, 'download_url_to_file', record)
+    # models of older cellpose versions are fetched with requests into models/
+    monkeypatch.setattr(data_loader.requests, 'get', lambda url: record(
+        url, tmp_path.joinpath('models', url.split('/')[-1])) or Response())
+    data_loader.download_files(tmp_path, cp_version=cp_version)
+
+    files = demo_data_files(tmp_path, cp_version=cp_version)
+    assert sorted(downloaded) == sorted((url, target) for url, target, _ in files)
@@ -0,0 +1,109 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+from skimage import io
+
+from napari_imagegrains import evaluation_cache as evaluation_module
+from napari_imagegrains.evaluation_cache import (
+    EvaluationCache,
+    save_evaluation,
+)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    imgs, lbls, preds = [], [], []
+    for ind in range(3):
+        mask = np.zeros((16, 16), dtype=np.uint8)
+        mask[2:8, 2:8] = 1
+        for name, data, paths in [(f'img{ind}.png', mask * 100, imgs),
+                                  (f'img{ind}_mask.tif', mask, lbls),
+                                  (f'img{ind}_m_pred.tif', mask, preds)]:
+            io.imsave(tmp_path.joinpath(name), data, check_contrast=False)
+            paths.append(tmp_path.joinpath(name))
+    return imgs, lbls, preds
+
+
+@pytest.fixture
+def eval_calls(monkeypatch):
+    """Replaces eval_set and records the labels evaluated by each call."""
+
+    calls = []
+
+    def fake_eval_set(imgs, lbls, preds, **kwargs):
+        calls.append([str(x) for x in lbls])
+        return {idx: {'id': str(x), 'img': None, 'ap': [1.0], 'iout': [1.0], 'tp': [1], 'fp': [0], 'fn': [0]}
+                for idx, x in enumerate(imgs)}
+
+    monkeypatch.setattr(evaluation_module, 'eval_set', fake_eval_set)
+    return calls
+
+
+def test_evaluate_reuses_results(dataset, eval_calls):
+    imgs, lbls, preds = dataset
+    cache = EvaluationCache()
+
+    results = cache.evaluate(imgs[:2], lbls[:2], preds[:2])
+    assert list(results) == [0, 1]
+    assert results[1]['id'] == 'img1'
+    assert 'img' not in results[1]
+
+    results = cache.evaluate(imgs, lbls, preds)
+    assert list(results) == [0, 1, 2]
+    assert eval_calls == [[str(x) for x in lbls[:2]], [str(lbls[2])]]
+
+
+def test_evaluate_again_after_prediction_changes(dataset, eval_calls):
+    imgs, lbls, preds = dataset
+    cache = EvaluationCache()
+    cache.evaluate(imgs, lbls, preds)
+
+    mtime = preds[1].stat().st_mtime_ns + 10 ** 9
+    os.utime(preds[1], ns=(mtime, mtime))
+    cache.evaluate(imgs, lbls, preds)
+
+    assert eval_calls[-1] == [str(lbls[1])]
+
+
+def test_make_key_depends_on_parameters(dataset):
+    _, lbls, preds = dataset
+
+    assert EvaluationCache.make_key(lbls[0], preds[0]) == EvaluationCache.make_key(lbls[0], preds[0])
+    assert EvaluationCache.make_key(lbls[0], preds[0]) != EvaluationCache.make_key(lbls[0], preds[1])
+    assert (EvaluationCache.make_key(lbls[0], preds[0])
+            != EvaluationCache.make_key(lbls[0], preds[0], thresholds=[0.5]))
+
+
+def test_eviction(dataset, eval_calls):
+    imgs, lbls, preds = dataset
+    cache = EvaluationCache(max_size=2)
+    cache.evaluate(imgs, lbls, preds)
+    assert len(cache) == 2
+
+    # the least recently used result (first image) was evicted
+    cache.evaluate(imgs[1:], lbls[1:], preds[1:])
+    cache.evaluate(imgs[:1], lbls[:1], preds[:1])
+    assert eval_calls[-1] == [str(lbls[0])]
+
+
+def test_save_evaluation_only_when_inputs_change(dataset, eval_calls, tmp_path, monkeypatch):
+    imgs, lbls, preds = dataset
+    results = EvaluationCache().evaluate(imgs, lbls, preds)
+    reads = []
+    imread = evaluation_module.io.imread
+    monkeypatch.setattr(evaluation_module.io, 'imread', lambda path: reads.append(path) or imread(path))
+
+    save_evaluation(results, imgs, lbls, preds, tar_dir=tmp_path.joinpath('perf'), data_id='test')
+    with open(tmp_path.joinpath('perf', 'test_eval_res.pkl'), 'rb') as f:
+        export = pickle.load(f)
+    assert export[2]['id'] == 'img2'
+    assert export[2]['img'].shape == (16, 16)
+    assert len(reads) == 3
+
+    save_evaluation(results, imgs, lbls, preds, tar_dir=tmp_path.joinpath('perf'), data_id='test')
+    assert len(reads) == 3
+
+    save_evaluation(results, imgs, lbls, preds, tar_dir=tmp_path.joinpath('perf'), data_id='other')
+    assert len(reads) == 6
@@ -0,0 +1,71 @@
+from threading import Event
+
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from skimage import io
+
+from napari_imagegrains.imgr_proc_widget import (
+    ImageGrainProcWidget,
+    _iter_until_stopped,
+)
+from napari_imagegrains.utils import save_mask
+
+
+@pytest.fixture
+def widget(qapp, tmp_path):
+    widget = ImageGrainProcWidget(ViewerModel())
+    widget.folder_tar_dir = tmp_path.joinpath('predictions')
+    widget.folder_tar_dir.mkdir()
+    widget.folder_model_id = 'm'
+    widget.folder_lazy_entries = []
+    return widget
+
+
+def add_segmented_image(widget, tmp_path, name, shape):
+    image = np.zeros(shape, dtype=np.uint8)
+    image_path = tmp_path.joinpath(f'{name}.png')
+    io.imsave(image_path, image, check_contrast=False)
+    mask = np.zeros(shape, dtype=np.int32)
+    mask[:2, :2] = 1
+    save_mask(widget.folder_tar_dir.joinpath(f'{name}_m_pred.tif'), mask)
+    widget._update_lazy_stack(image_path, image, mask)
+
+
+def test_lazy_stack_uses_saved_mask_type(widget, tmp_path):
+    add_segmented_image(widget, tmp_path, 'img1', (10, 12))
+    add_segmented_image(widget, tmp_path, 'img2', (10, 12))
+
+    predictions = widget.viewer.layers['folder predictions'].data
+    assert predictions.shape == (2, 10, 12)
+    assert predictions.dtype == np.uint8
+    assert np.asarray(predictions[1]).dtype == np.uint8
+    assert widget.viewer.layers['folder images'].data.shape == (2, 10, 12)
+
+
+def test_lazy_stack_warns_on_different_shape(widget, tmp_path):
+    add_segmented_image(widget, tmp_path, 'img1', (10, 12))
+
+    with pytest.warns(UserWarning, match='img2.png'):
+        add_segmented_image(widget, tmp_path, 'img2', (12, 10))
+
+    assert len(widget.folder_lazy_entries) == 1
+
+
+def test_iter_until_stopped_closes_results():
+    closed = []
+
+    def results():
+        try:
+            yield from range(5)
+        finally:
+            closed.append(True)
+
+    stop_event = Event()
+    received = []
+    for result in _iter_until_stopped(results(), stop_event):
+        received.append(result)
+        stop_event.set()
+
+    assert received == [0]
+    assert closed == [True]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from napari_imagegrains.folder_index import FolderIndex, FolderIndexCache
+from napari_imagegrains.utils import find_match_in_folder
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for name in ['img10_m_pred.tif', 'img1_m_pred.tif', 'img1_m_flows.npy', 'img2_m_pred.tif',
+                 '.img1_m_pred.tif', 'other.tif']:
+        tmp_path.joinpath(name).write_bytes(b'')
+    tmp_path.joinpath('img1_dir').mkdir()
+    return tmp_path
+
+
+def test_find(folder):
+    index = FolderIndex(folder)
+
+    assert len(index) == 5
+    assert index.find('img1') == ['img1_m_flows.npy', 'img1_m_pred.tif', 'img10_m_pred.tif']
+    assert index.find('img1', 'img1*pred*.tif') == ['img1_m_pred.tif', 'img10_m_pred.tif']
+    assert index.find('img3') == []
+
+
+def test_index_is_rebuilt_when_folder_changes(folder):
+    cache = FolderIndexCache()
+    index = cache.get(folder)
+    assert cache.get(folder) is index
+
+    folder.joinpath('img3_m_pred.tif').write_bytes(b'')
+    # make the change visible whatever the time resolution of the file system
+    mtime = index.mtime + 10 ** 9
+    os.utime(folder, ns=(mtime, mtime))
+
+    assert not index.is_current()
+    assert cache.get(folder).find('img3') == ['img3_m_pred.tif']
+
+    index = cache.get(folder)
+    cache.invalidate(folder)
+    assert cache.get(folder) is not index
+
+
+def test_find_match_in_folder_uses_natural_order(folder):
+    with pytest.warns(UserWarning, match='Multiple masks'):
+        match = find_match_in_folder(folder, 'img1.jpg', model_str='m', data_str='pred', data_format='tif')
+    assert match == f'{folder}/img1_m_pred.tif'
+
+    with pytest.warns(UserWarning, match='No mask'):
+        assert find_match_in_folder(folder, 'img3.jpg', model_str='', data_str='pred', data_format='tif') is None
+    with pytest.warns(UserWarning, match='No mask'):
+        assert find_match_in_folder(folder.joinpath('missing'), 'img1.jpg', '', 'pred', 'tif') is None
@@ -0,0 +1,103 @@
+import shutil
+
+import pytest
+from qtpy.QtCore import QEventLoop
+from qtpy.QtWidgets import QApplication
+
+from napari_imagegrains.folder_list_widget import FolderList, scan_folder
+
+
+@pytest.fixture
+def large_folder(tmp_path):
+    folder = tmp_path.joinpath('large')
+    folder.mkdir()
+    for ind in range(3000):
+        folder.joinpath(f'img{ind}.png').write_bytes(b'')
+    for ind in range(50):
+        folder.joinpath(f'notes{ind}.txt').write_bytes(b'')
+    # directories are not listed even with a matching extension
+    folder.joinpath('dir.png').mkdir()
+    return folder
+
+
+def wait_for_refresh(folder_list):
+    while folder_list.refresh_worker is not None:
+        QApplication.processEvents(QEventLoop.AllEvents, 50)
+
+
+def test_refresh_applies_changes(qapp, tmp_path):
+    for name in ['img1.png', 'img10.png', 'notes.txt']:
+        tmp_path.joinpath(name).write_bytes(b'')
+    folder_list = FolderList(None, file_extensions=['.png'])
+    folder_list.update_from_path(tmp_path)
+    folder_list.wait_for_scan()
+    assert folder_list.file_names() == ['img1.png', 'img10.png']
+
+    tmp_path.joinpath('img2.png').write_bytes(b'')
+    tmp_path.joinpath('img10.png').unlink()
+    folder_list.refresh()
+    wait_for_refresh(folder_list)
+
+    assert folder_list.file_names() == ['img1.png', 'img2.png']
+
+
+def test_refresh_of_deleted_folder_clears_list(qapp, tmp_path):
+    folder = tmp_path.joinpath('images')
+    folder.mkdir()
+    folder.joinpath('img1.png').write_bytes(b'')
+    folder_list = FolderList(None, file_extensions=['.png'])
+    folder_list.update_from_path(folder)
+    folder_list.wait_for_scan()
+    folder_list.setCurrentRow(0)
+    assert folder_list.currentItem().text() == 'img1.png'
+
+    shutil.rmtree(folder)
+    folder_list.refresh()
+    wait_for_refresh(folder_list)
+
+    assert folder_list.count() == 0
+    assert folder_list.currentItem() is None
+
+
+def test_scan_folder_batches(large_folder):
+    batches = list(scan_folder(large_folder, ['.png'], batch_size=1000))
+
+    assert [len(batch) for batch in batches] == [1000, 2000]
+    for batch in batches:
+        assert batch == sorted(batch)
+    names = {name for batch in batches for _, name in batch}
+    assert names == {f'img{ind}.png' for ind in range(3000)}
+
+
+def test_large_folder_is_listed_incrementally(qapp, large_folder):
+    folder_list = FolderList(None, file_extensions=['.png'])
+    # only the first batch is listed before the scan moves to the background
+    folder_list.sync_scan_time = 0
+    counts = []
+    folder_list.list_model.rowsInserted.connect(lambda *args: counts.append(folder_list.count()))
+
+    folder_list.update_from_path(large_folder)
+    assert folder_list.count() == 1000
+    assert folder_list.scan_worker is not None
+    folder_list.wait_for_scan()
+
+    assert counts == [1000, 3000]
+    assert folder_list.file_names() == [f'img{ind}.png' for ind in range(3000)]
+
+
+def test_scan_stops_when_folder_changes(qapp, large_folder, tmp_path):
+    small_folder = tmp_path.joinpath('small')
+    small_folder.mkdir()
+    for name in ['img2.png', 'img1.png']:
+        small_folder.joinpath(name).write_bytes(b'')
+    folder_list = FolderList(None, file_extensions=['.png'])
+    folder_list.sync_scan_time = 0
+
+    folder_list.update_from_path(large_folder)
+    folder_list.update_from_path(small_folder)
+    folder_list.wait_for_scan()
+    # batches of the first scan still queued are not added
+    for _ in range(10):
+        QApplication.processEvents(QEventLoop.AllEvents, 50)
+
+    assert folder_list.file_names() == ['img1.png', 'img2.png']
@@ -0,0 +1,131 @@
+import time
+from threading import Semaphore
+
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from qtpy.QtWidgets import QApplication
+from skimage import io
+
+from napari_imagegrains.folder_index import folder_index_cache
+from napari_imagegrains.imgr_proc_widget import ImageGrainProcWidget
+
+
+class GatedModel:
+    """Stands in for a Cellpose model that only segments an image once the
+    test has released it."""
+
+    def __init__(self):
+        self.gate = Semaphore(0)
+        self.calls = 0
+
+    def eval(self, imgs, **kwargs):
+        for _ in imgs:
+            self.gate.acquire()
+        self.calls += 1
+        masks = [np.ones(img.shape[:2], dtype=np.uint16) for img in imgs]
+        flows = [[np.zeros(img.shape[:2] + (3,), dtype=np.uint8),
+                  np.zeros((2,) + img.shape[:2], dtype=np.float32),
+                  np.zeros(img.shape[:2], dtype=np.float32)] for img in imgs]
+        styles = [np.zeros(256, dtype=np.float32) for _ in imgs]
+        return masks, flows, styles
+
+
+@pytest.fixture
+def widget(qapp, tmp_path, monkeypatch):
+    for ind in range(4):
+        io.imsave(tmp_path.joinpath(f'img{ind}.png'), np.zeros((16, 16), dtype=np.uint8),
+                  check_contrast=False)
+    model_path = tmp_path.joinpath('model')
+    model_path.write_bytes(b'weights')
+
+    widget = ImageGrainProcWidget(ViewerModel())
+    widget.image_folder = tmp_path
+    widget.model_path = model_path
+    widget.model_name = model_path.name
+    widget.radio_segment_pngs.setChecked(True)
+    widget.check_save_mask.setChecked(False)
+    widget.check_batch_images.setChecked(False)
+    widget.check_multiprocess.setChecked(False)
+
+    model = GatedModel()
+    monkeypatch.setattr(widget, 'initialize_model', lambda: model)
+    monkeypatch.setattr(widget, 'notify_user', lambda title, message: pytest.fail(message))
+    yield widget, model
+    # stop a worker left running by a failed test
+    widget._on_click_cancel_folder_segmentation()
+    model.gate.release(10)
+    widget.wait_for_folder_segmentation()
+
+
+def wait_until(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        QApplication.processEvents()
+        time.sleep(0.01)
+
+
+def test_pause_and_resume(widget):
+    widget, model = widget
+    worker = widget._on_click_segment_image_folder()
+    model.gate.release(1)
+    wait_until(lambda: model.calls == 1)
+
+    # the worker pauses once the image being segmented is done
+    widget._on_click_pause_folder_segmentation()
+    assert widget.btn_pause_folder_segmentation.text() == "Resume"
+    model.gate.release(10)
+    wait_until(lambda: worker.is_paused)
+    time.sleep(0.1)
+    assert model.calls == 2
+
+    widget._on_click_pause_folder_segmentation()
+    assert widget.btn_pause_folder_segmentation.text() == "Pause"
+    widget.wait_for_folder_segmentation()
+
+    assert model.calls == 4
+    assert widget.progress_bar.value() == 100
+    assert widget.btn_run_segmentation_on_folder.isEnabled()
+
+
+def test_finished_segmentation_invalidates_folder_index(widget, monkeypatch):
+    widget, model = widget
+    invalidated = []
+    monkeypatch.setattr(folder_index_cache, 'invalidate', invalidated.append)
+    widget.check_save_mask.setChecked(True)
+
+    widget._on_click_segment_image_folder()
+    model.gate.release(10)
+    widget.wait_for_folder_segmentation()
+
+    assert invalidated == [widget.image_folder.joinpath('predictions')]
+    assert len(list(widget.image_folder.joinpath('predictions').glob('*_pred.tif'))) == 4
+
+
+def test_cancel(widget):
+    widget, model = widget
+    widget._on_click_segment_image_folder()
+
+    widget._on_click_cancel_folder_segmentation()
+    model.gate.release(10)
+    widget.wait_for_folder_segmentation()
+
+    assert model.calls == 1
+    assert widget.progress_bar.value() == 25
+    assert widget.btn_run_segmentation_on_folder.isEnabled()
+    assert not widget.btn_cancel_folder_segmentation.isEnabled()
+
+
+def test_cancel_paused_segmentation(widget):
+    widget, model = widget
+    worker = widget._on_click_segment_image_folder()
+
+    widget._on_click_pause_folder_segmentation()
+    model.gate.release(10)
+    wait_until(lambda: worker.is_paused)
+    widget._on_click_cancel_folder_segmentation()
+    widget.wait_for_folder_segmentation()
+
+    assert model.calls <= 1
+    assert widget.btn_pause_folder_segmentation.text() == "Pause"
@@ -0,0 +1,105 @@
+import sys
+
+import numpy as np
+import pytest
+import tifffile
+from skimage import io
+
+from napari_imagegrains.batch import save_georeferenced_prediction
+from napari_imagegrains.georeference import copy_world_file, read_georeference
+
+GEOTRANSFORM = (2600000.0, 0.5, 0.0, 1200000.0, 0.0, -0.5)
+
+
+@pytest.fixture
+def mask():
+    mask = np.zeros((20, 30), dtype=np.int32)
+    mask[2:8, 3:9] = 5
+    mask[10:15, 20:25] = 300
+    return mask
+
+
+def write_geotiff(path, gdal, osr):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(2056)
+    dataset = gdal.GetDriverByName('GTiff').Create(str(path), 30, 20, 1, gdal.GDT_Byte)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.SetGeoTransform(GEOTRANSFORM)
+    dataset.GetRasterBand(1).WriteArray(np.zeros((20, 30), dtype=np.uint8))
+    dataset = None
+    return srs.ExportToWkt()
+
+
+def test_georeferenced_prediction_keeps_crs(tmp_path, mask):
+    pytest.importorskip('osgeo')
+    from osgeo import gdal, osr
+    gdal.UseExceptions()
+
+    image_path = tmp_path.joinpath('img.tif')
+    projection = write_geotiff(image_path, gdal, osr)
+    georef = read_georeference(image_path)
+    assert georef == (projection, GEOTRANSFORM)
+
+    assert save_georeferenced_prediction(image_path, mask, georef, tmp_path.joinpath('pred'), 'm')
+
+    dataset = gdal.Open(str(tmp_path.joinpath('pred', 'img_m_pred.tif')))
+    assert osr.SpatialReference(dataset.GetProjection()).IsSame(osr.SpatialReference(projection))
+    assert dataset.GetGeoTransform() == GEOTRANSFORM
+    saved = dataset.GetRasterBand(1).ReadAsArray()
+    # predictions are relabeled sequentially with the smallest type
+    assert saved.dtype == np.uint8
+    np.testing.assert_array_equal(saved > 0, mask > 0)
+
+
+def test_image_without_projection_falls_back_to_plain_mask(tmp_path, mask):
+    pytest.importorskip('osgeo')
+
+    image_path = tmp_path.joinpath('img.tif')
+    io.imsave(image_path, np.zeros((20, 30), dtype=np.uint8), check_contrast=False)
+    georef = read_georeference(image_path)
+    assert georef is None
+
+    assert not save_georeferenced_prediction(image_path, mask, georef, tmp_path.joinpath('pred'), 'm')
+    saved = tifffile.imread(tmp_path.joinpath('pred', 'img_m_pred.tif'))
+    np.testing.assert_array_equal(saved > 0, mask > 0)
+
+
+def test_world_file_is_copied(tmp_path, mask):
+    pytest.importorskip('osgeo')
+    from osgeo import gdal, osr
+    gdal.UseExceptions()
+
+    image_path = tmp_path.joinpath('img.tif')
+    write_geotiff(image_path, gdal, osr)
+    image_path.with_suffix('.tfw').write_text('0.5\n0\n0\n-0.5\n2600000\n1200000\n')
+
+    save_georeferenced_prediction(
+        image_path, mask, read_georeference(image_path), tmp_path.joinpath('pred'), 'm')
+
+    assert tmp_path.joinpath('pred', 'img_m_pred.tfw').read_text() == image_path.with_suffix('.tfw').read_text()
+
+
+def test_copy_world_file(tmp_path):
+    image_path = tmp_path.joinpath('img.tif')
+    output_path = tmp_path.joinpath('img_m_pred.tif')
+
+    # nothing to copy without a world file
+    copy_world_file(image_path, output_path)
+    assert not output_path.with_suffix('.tfw').exists()
+
+    image_path.with_suffix('.tfw').write_text('0.5\n0\n0\n-0.5\n2600000\n1200000\n')
+    copy_world_file(image_path, output_path)
+    assert output_path.with_suffix('.tfw').read_text() == image_path.with_suffix('.tfw').read_text()
+
+
+def test_missing_gdal(tmp_path, mask, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'osgeo', None)
+    image_path = tmp_path.joinpath('img.tif')
+    io.imsave(image_path, np.zeros((20, 30), dtype=np.uint8), check_contrast=False)
+
+    with pytest.raises(ModuleNotFoundError):
+        read_georeference(image_path)
+
+    # without a georeference the prediction is saved without GDAL
+    assert not save_georeferenced_prediction(image_path, mask, None, tmp_path.joinpath('pred'), 'm')
+    assert tmp_path.joinpath('pred', 'img_m_pred.tif').exists()
@@ -0,0 +1,159 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from napari_imagegrains.grain_store import GrainTableStore, open_grain_store
+
+
+def make_grains(num, offset=0):
+    return pd.DataFrame({'label': range(1, num + 1),
+                         'area': [10.0 * (x + offset) for x in range(1, num + 1)]})
+
+
+@pytest.fixture
+def grain_store(tmp_path):
+    grain_store = GrainTableStore(tmp_path)
+    grain_store.write_grains('img10_pred_grains', make_grains(2, offset=10))
+    grain_store.write_grains('img1_pred_grains', make_grains(3))
+    grain_store.write_grains('img2_a/b_pred_grains', make_grains(1, offset=20))
+    return grain_store
+
+
+def test_file_ids(grain_store):
+    assert grain_store.file_ids() == ['img1_pred_grains', 'img2_a/b_pred_grains', 'img10_pred_grains']
+
+
+def test_read_round_trip(grain_store):
+    grains = grain_store.read(file_ids=['img1_pred_grains', 'img10_pred_grains'])
+
+    assert list(grains.columns) == ['label', 'area', 'file_id']
+    assert list(grains['file_id']) == ['img1_pred_grains'] * 3 + ['img10_pred_grains'] * 2
+    assert list(grains.index) == [0, 1, 2, 0, 1]
+    pd.testing.assert_frame_equal(
+        grains[grains['file_id'] == 'img1_pred_grains'].drop(columns='file_id'), make_grains(3))
+
+
+def test_read_columns_and_filters(grain_store):
+    grains = grain_store.read(columns=['area'], filters=[('area', '>', 100)])
+
+    assert list(grains.columns) == ['area', 'file_id']
+    assert sorted(grains['area']) == [110.0, 120.0, 210.0]
+
+
+def test_write_replaces_and_remove(grain_store):
+    grain_store.write_grains('img1_pred_grains', make_grains(1).assign(file_id='x'))
+    assert len(grain_store.read(file_ids=['img1_pred_grains'])) == 1
+
+    grain_store.remove('img1_pred_grains')
+    assert 'img1_pred_grains' not in grain_store.file_ids()
+
+
+def test_is_current(grain_store, tmp_path):
+    grain_file = tmp_path.joinpath('img1_pred_grains.csv')
+    make_grains(3).to_csv(grain_file)
+    part_mtime = grain_store._part_path('img1_pred_grains').stat().st_mtime_ns
+    os.utime(grain_file, ns=(part_mtime - 10 ** 9, part_mtime - 10 ** 9))
+    assert grain_store.is_current('img1_pred_grains', grain_file)
+
+    # grain file regenerated after the table was written
+    os.utime(grain_file, ns=(part_mtime + 10 ** 9, part_mtime + 10 ** 9))
+    assert not grain_store.is_current('img1_pred_grains', grain_file)
+    assert not grain_store.is_current('img3_pred_grains', grain_file)
+
+
+def test_open_grain_store(grain_store, tmp_path):
+    assert open_grain_store(tmp_path).path == grain_store.path
+    assert open_grain_store(tmp_path, scaled=True) is None
+    assert open_grain_store(None) is None
+
+
+@pytest.fixture
+def stats_widget(qapp, tmp_path):
+    from napari.components import ViewerModel
+
+    from napari_imagegrains.imgr_stats_widget import ImageGrainStatsWidget
+
+    widget = ImageGrainStatsWidget(ViewerModel())
+    widget.mask_folder = tmp_path
+    grain_store = GrainTableStore(tmp_path)
+    for ind in [1, 2]:
+        make_grains(ind).to_csv(tmp_path.joinpath(f'img{ind}_pred_grains.csv'))
+        grain_store.write_grains(f'img{ind}_pred_grains', make_grains(ind))
+    return widget
+
+
+def test_store_and_grain_files_give_same_dataset(stats_widget):
+    grain_files = stats_widget.get_grain_files()
+    _, file_ids = stats_widget.get_grain_store_ids(grain_files)
+    assert file_ids == ['img1_pred_grains', 'img2_pred_grains']
+
+    stats_widget._on_load_grainsize_dataset()
+    from_store = stats_widget.props_df_dataset
+    stats_widget.mask_folder.joinpath('grains.parquet', 'file_id=img1_pred_grains', 'grains.parquet').unlink()
+    stats_widget._on_load_grainsize_dataset()
+    from_files = stats_widget.props_df_dataset
+
+    assert list(from_store['file_id']) == list(from_files['file_id'])
+    assert list(from_store.columns) == list(from_files.columns)
+
+
+def test_stale_store_is_not_used(stats_widget):
+    grain_file = stats_widget.mask_folder.joinpath('img2_pred_grains.csv')
+    make_grains(4).to_csv(grain_file)
+    mtime = grain_file.stat().st_mtime_ns + 10 ** 9
+    os.utime(grain_file, ns=(mtime, mtime))
+
+    _, file_ids = stats_widget.get_grain_store_ids(stats_widget.get_grain_files())
+    assert file_ids == []
+
+    stats_widget._on_load_grainsize_dataset()
+    assert (stats_widget.props_df_dataset['file_id'] == 'img2_pred_grains').sum() == 4
+
+
+@pytest.fixture
+def mask_folder(tmp_path):
+    import numpy as np
+    from skimage import io
+
+    folder = tmp_path.joinpath('masks')
+    folder.mkdir()
+    for ind in [1, 2, 3]:
+        mask = np.zeros((40, 40), dtype=np.uint16)
+        mask[5:15, 5:20] = 1
+        mask[20:35, 10:30] = 2
+        io.imsave(folder.joinpath(f'img{ind}_m_pred.tif'), mask, check_contrast=False)
+    return folder
+
+
+def test_grain_tables_are_stored_per_image(qapp, mask_folder, monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_imagegrains import imgr_stats_widget
+    from napari_imagegrains.imgr_stats_widget import ImageGrainStatsWidget
+
+    widget = ImageGrainStatsWidget(ViewerModel())
+    widget.mask_folder = mask_folder
+    widget.qtext_model_str.setText('m')
+    widget.qtext_mask_str.setText('_pred')
+
+    grains_in_dataset = imgr_stats_widget.grainsizing.grains_in_dataset
+
+    def interrupted(inp_list, **kwargs):
+        if 'img3' in str(inp_list[0]):
+            raise KeyboardInterrupt
+        return grains_in_dataset(inp_list=inp_list, **kwargs)
+
+    monkeypatch.setattr(imgr_stats_widget.grainsizing, 'grains_in_dataset', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        widget._on_run_grainsize_on_folder()
+    # the tables of the images measured before the interruption are kept
+    assert GrainTableStore(mask_folder).file_ids() == ['img1_m_pred_grains', 'img2_m_pred_grains']
+
+    monkeypatch.setattr(imgr_stats_widget.grainsizing, 'grains_in_dataset', grains_in_dataset)
+    widget._on_run_grainsize_on_folder()
+    assert GrainTableStore(mask_folder).file_ids() == [f'img{ind}_m_pred_grains' for ind in [1, 2, 3]]
+    assert widget.file_ids == [f'img{ind}_m_pred' for ind in [1, 2, 3]]
+    assert list(widget.props_df_dataset['file_id'].unique()) == widget.file_ids
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from skimage import io
+
+from napari_imagegrains.image_cache import ImageCache, read_layer_data
+from napari_imagegrains.utils import (
+    clear_other_layers,
+    show_in_layer,
+    show_layer_data,
+)
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for ind in range(3):
+        path = tmp_path.joinpath(f'img{ind}.png')
+        io.imsave(path, np.full((10, 10), ind, dtype=np.uint8), check_contrast=False)
+        paths.append(path)
+    return paths
+
+
+def test_get_is_cached_and_read_only(image_paths):
+    cache = ImageCache()
+    image = cache.get(image_paths[0])
+
+    assert cache.get(image_paths[0]) is image
+    assert not image.flags.writeable
+    assert image_paths[0] in cache
+    assert cache.nbytes == 100
+
+
+def test_eviction(image_paths):
+    cache = ImageCache(max_bytes=250)
+    for path in image_paths:
+        cache.get(path)
+
+    assert len(cache) == 2
+    assert image_paths[0] not in cache
+
+    cache.set_max_bytes(100)
+    assert len(cache) == 1
+    assert image_paths[2] in cache
+
+
+def test_read_layer_data_matches_napari_reader(image_paths):
+    from napari.plugins import _initialize_plugins
+    from napari.plugins.io import read_data_with_plugins
+
+    _initialize_plugins()
+    layer_data = read_layer_data(image_paths[1])
+    reference, _ = read_data_with_plugins([str(image_paths[1])], stack=False)
+
+    assert len(layer_data) == len(reference)
+    data, kwargs, layer_type = layer_data[0]
+    np.testing.assert_array_equal(data, reference[0][0])
+    assert layer_type == 'image'
+    assert isinstance(kwargs, dict)
+    assert not data.flags.writeable
+
+
+def test_read_layer_data_falls_back_to_skimage(tmp_path, monkeypatch):
+    import napari.plugins.io
+
+    def no_reader(paths, stack):
+        raise ValueError('No compatible readers')
+
+    monkeypatch.setattr(napari.plugins.io, 'read_data_with_plugins', no_reader)
+    path = tmp_path.joinpath('img.tif')
+    io.imsave(path, np.ones((6, 8), dtype=np.uint16), check_contrast=False)
+
+    [(data, kwargs, layer_type)] = read_layer_data(path)
+    assert data.shape == (6, 8)
+    assert kwargs == {}
+    assert layer_type == 'image'
+
+
+def test_get_layer_data_is_cached_separately(image_paths):
+    cache = ImageCache()
+    layer_data = cache.get_layer_data(image_paths[0])
+
+    assert cache.get_layer_data(image_paths[0]) is layer_data
+    assert cache.get(image_paths[0]) is not layer_data
+    assert len(cache) == 2
+    assert cache.nbytes == 200
+
+
+def test_show_in_layer_applies_reader_kwargs(qapp):
+    viewer = ViewerModel()
+    image = np.zeros((10, 10), dtype=np.uint8)
+    layer = show_in_layer(viewer, None, image, 'img0', layer_kwargs={'scale': (2, 2)})
+    assert tuple(layer.scale) == (2, 2)
+
+    # the layer is reused and its scale reset for an image without scale
+    reused = show_layer_data(viewer, layer, [(image, {}, 'image')], 'img1')
+    assert reused is layer
+    assert layer.name == 'img1'
+    assert tuple(layer.scale) == (1, 1)
+
+    # reader kwargs that cannot be set on an existing layer create a new layer
+    new = show_layer_data(viewer, layer, [(image, {'colormap': 'red'}, 'image')], 'img2')
+    assert new is not layer
+    assert list(viewer.layers) == [new]
+    assert new.colormap.name == 'red'
+
+
+def test_show_layer_data_adds_all_layers(qapp):
+    viewer = ViewerModel()
+    layer = viewer.add_image(np.zeros((10, 10)), name='old')
+    layer_data = [(np.zeros((10, 10)), {'name': 'a'}, 'image'),
+                  (np.zeros((10, 10), dtype=np.uint8), {}, 'labels')]
+
+    first = show_layer_data(viewer, layer, layer_data, 'img')
+
+    assert [x.name for x in viewer.layers] == ['a', 'img']
+    assert first is viewer.layers['a']
+
+
+def test_clear_other_layers(qapp):
+    viewer = ViewerModel()
+    image = viewer.add_image(np.zeros((10, 10)))
+    viewer.add_image(np.zeros((10, 10)))
+
+    clear_other_layers(viewer, keep=[image, None])
+
+    assert list(viewer.layers) == [image]
@@ -0,0 +1,38 @@
+from napari_imagegrains.lru_cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('b') is None
+
+    cache.set_max_size(1)
+    assert 'a' not in cache
+    assert cache.pop('c') == 3
+    assert len(cache) == 0
+
+
+def test_sized_entries():
+    cache = LRUCache(max_size=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    # replacing an entry updates the total size
+    cache.put('a', 'xx')
+    assert cache.size == 6
+
+    cache.put('c', 'xxxxxx')
+    assert 'b' not in cache
+    assert cache.size == 8
+
+    cache.remove_if(lambda key: key == 'a')
+    assert cache.size == 6
+
+    # entries larger than the cache are not kept
+    cache.put('d', 'x' * 11)
+    assert 'd' not in cache
+    assert cache.size == 6
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from napari_imagegrains import model_cache as model_cache_module
+from napari_imagegrains.model_cache import ModelCache
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Replaces loading Cellpose models and records the loaded weights."""
+
+    loads = []
+
+    def fake_model(gpu, pretrained_model):
+        loads.append((pretrained_model, gpu))
+        return object()
+
+    monkeypatch.setattr(model_cache_module.models, 'CellposeModel', fake_model)
+    return loads
+
+
+@pytest.fixture
+def model_paths(tmp_path):
+    paths = []
+    for ind in range(3):
+        path = tmp_path.joinpath(f'model{ind}')
+        path.write_bytes(b'weights')
+        paths.append(path)
+    return paths
+
+
+def test_models_are_reused(loads, model_paths):
+    cache = ModelCache()
+    model = cache.get(model_paths[0])
+
+    assert cache.get(model_paths[0]) is model
+    assert cache.get(model_paths[0], gpu=True) is not model
+    assert len(loads) == 2
+    assert ModelCache.make_key(model_paths[0]) in cache
+
+
+def test_overwritten_weights_are_loaded_again(loads, model_paths):
+    cache = ModelCache()
+    model = cache.get(model_paths[0])
+    key = ModelCache.make_key(model_paths[0])
+
+    mtime = model_paths[0].stat().st_mtime_ns + 10 ** 9
+    os.utime(model_paths[0], ns=(mtime, mtime))
+
+    assert ModelCache.make_key(model_paths[0]) != key
+    assert cache.get(model_paths[0]) is not model
+
+
+def test_eviction(loads, model_paths):
+    cache = ModelCache(max_size=2)
+    for path in model_paths:
+        cache.get(path)
+    assert len(cache) == 2
+    assert ModelCache.make_key(model_paths[0]) not in cache
+
+    # the least recently used model is evicted first
+    cache.get(model_paths[1])
+    cache.set_max_size(1)
+    assert ModelCache.make_key(model_paths[1]) in cache
+
+    cache.evict(model_paths[1])
+    assert len(cache) == 0
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('zarr')
+
+from napari_imagegrains.prediction_store import (
+    PredictionStore,
+    open_prediction_store,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PredictionStore(tmp_path)
+    for pred_id in ['img10_model_pred', 'img1_model_pred', 'img2_model_pred']:
+        store.write_prediction(pred_id, np.full((8, 6), int(pred_id[3:].split('_')[0]), dtype=np.uint16))
+    store.consolidate()
+    return store
+
+
+def test_find_natural_order(store):
+    assert store.find('img1.jpg') == 'img1_model_pred'
+    assert store.find('img10.jpg') == 'img10_model_pred'
+    assert store.find('img3.jpg') is None
+
+
+def test_read_after_consolidate(store, tmp_path):
+    reader = open_prediction_store(tmp_path)
+    assert set(reader.pred_ids()) == {'img1_model_pred', 'img2_model_pred', 'img10_model_pred'}
+    assert reader.find('img1.png') == 'img1_model_pred'
+    np.testing.assert_array_equal(reader.read_mask('img10_model_pred'), 10)
+    np.testing.assert_array_equal(reader.read_mask('img2_model_pred', (slice(0, 2), slice(0, 3))),
+                                  np.full((2, 3), 2))
+
+
+def test_index_written_on_consolidate(tmp_path):
+    store = PredictionStore(tmp_path)
+    store.write_prediction('img1_model_pred', np.ones((4, 4), dtype=np.uint8))
+    assert 'index' not in PredictionStore(tmp_path, mode='r').root.attrs
+
+    store.consolidate()
+    assert PredictionStore(tmp_path, mode='r').pred_ids() == ['img1_model_pred']
+
+
+def test_open_prediction_store_reuses_store(store, tmp_path):
+    reader = open_prediction_store(tmp_path)
+    assert open_prediction_store(tmp_path) is reader
+
+    writer = PredictionStore(tmp_path)
+    writer.write_prediction('img3_model_pred', np.ones((4, 4), dtype=np.uint8))
+    writer.consolidate()
+    reader = open_prediction_store(tmp_path)
+    assert 'img3_model_pred' in reader.pred_ids()
+
+
+def test_grains_round_trip(store):
+    grains = pd.DataFrame({'label': [1, 2], 'area': [10.5, 3.0]})
+    store.write_grains('img1_model_pred', grains)
+    pd.testing.assert_frame_equal(store.read_grains('img1_model_pred'), grains)
+    pd.testing.assert_frame_equal(store.read_grains('img1_model_pred', columns=['area']), grains[['area']])
+
+
+def test_open_prediction_store_missing(tmp_path):
+    assert open_prediction_store(tmp_path) is None
+    assert open_prediction_store(None) is None
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from napari_imagegrains.run_manifest import RunManifest, model_identity
+
+PARAMS = {'diameter': 30, 'min_size': 15}
+
+
+@pytest.fixture
+def folder(tmp_path):
+    tmp_path.joinpath('img1.jpg').write_bytes(b'image 1')
+    tmp_path.joinpath('img2.jpg').write_bytes(b'image 2')
+    tmp_path.joinpath('model').write_bytes(b'weights')
+    preds = tmp_path.joinpath('predictions')
+    preds.mkdir()
+    for name in ['img1_m_pred.tif', 'img2_m_pred.tif']:
+        preds.joinpath(name).write_bytes(b'mask')
+    return tmp_path
+
+
+def record(manifest, folder, name):
+    manifest.record(folder.joinpath(f'{name}.jpg'), f'{name}_m_pred.tif',
+                    model=model_identity(folder.joinpath('model')), params=PARAMS)
+
+
+def test_records_are_appended(folder):
+    manifest = RunManifest(folder.joinpath('predictions'))
+    record(manifest, folder, 'img1')
+    record(manifest, folder, 'img2')
+    record(manifest, folder, 'img1')
+
+    assert len(manifest.path.read_text().splitlines()) == 3
+    reloaded = RunManifest(manifest.folder)
+    model = model_identity(folder.joinpath('model'))
+    assert reloaded.is_current(folder.joinpath('img1.jpg'), model, PARAMS)
+    assert reloaded.is_current(folder.joinpath('img2.jpg'), model, PARAMS)
+    assert not reloaded.is_current(folder.joinpath('img2.jpg'), model, {'diameter': 40, 'min_size': 15})
+
+    manifest.save()
+    assert len(manifest.path.read_text().splitlines()) == 2
+
+
+def test_interrupted_line_is_ignored(folder):
+    manifest = RunManifest(folder.joinpath('predictions'))
+    record(manifest, folder, 'img1')
+    with open(manifest.path, 'a') as f:
+        f.write('{"image": "img2.jpg", "si')
+
+    reloaded = RunManifest(manifest.folder)
+    assert list(reloaded.entries) == ['img1.jpg']
+
+
+def test_modified_images_are_not_current(folder):
+    model = model_identity(folder.joinpath('model'))
+    manifest = RunManifest(folder.joinpath('predictions'))
+    record(manifest, folder, 'img1')
+    record(manifest, folder, 'img2')
+
+    folder.joinpath('img1.jpg').write_bytes(b'image 1 modified')
+    os.remove(folder.joinpath('predictions', 'img2_m_pred.tif'))
+
+    assert not manifest.is_current(folder.joinpath('img1.jpg'), model, PARAMS)
+    assert not manifest.is_current(folder.joinpath('img2.jpg'), model, PARAMS)
+
+
+def test_touched_images_need_content_hash(folder):
+    model = model_identity(folder.joinpath('model'))
+    image_path = folder.joinpath('img1.jpg')
+    manifest = RunManifest(folder.joinpath('predictions'))
+    hashed_manifest = RunManifest(folder.joinpath('hashed'), hash_content=True)
+    for x in [manifest, hashed_manifest]:
+        x.folder.mkdir(exist_ok=True)
+        x.folder.joinpath('img1_m_pred.tif').write_bytes(b'mask')
+        record(x, folder, 'img1')
+    assert manifest.entries['img1.jpg']['hash'] is None
+
+    mtime = image_path.stat().st_mtime_ns + 10 ** 9
+    os.utime(image_path, ns=(mtime, mtime))
+
+    assert not manifest.is_current(image_path, model, PARAMS)
+    assert hashed_manifest.is_current(image_path, model, PARAMS)
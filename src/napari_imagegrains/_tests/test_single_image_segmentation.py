@@ -0,0 +1,138 @@
+import dask.array as da
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from qtpy.QtCore import QEventLoop
+from qtpy.QtWidgets import QApplication
+from skimage import io
+
+from napari_imagegrains.flow_cache import flow_cache
+from napari_imagegrains.imgr_proc_widget import ImageGrainProcWidget
+
+
+class FakeModel:
+    """Stands in for a Cellpose model and records the arguments of eval."""
+
+    def __init__(self):
+        self.calls = []
+
+    def eval(self, imgs, **kwargs):
+        self.calls.append(kwargs)
+        masks = [np.ones(img.shape[:2], dtype=np.uint16) for img in imgs]
+        flows = [[np.zeros(img.shape[:2] + (3,), dtype=np.uint8),
+                  np.zeros((2,) + img.shape[:2], dtype=np.float32),
+                  np.zeros(img.shape[:2], dtype=np.float32)] for img in imgs]
+        styles = [np.zeros(256, dtype=np.float32) for _ in imgs]
+        return masks, flows, styles
+
+
+@pytest.fixture
+def widget(qapp, tmp_path, monkeypatch):
+    image_path = tmp_path.joinpath('img1.png')
+    io.imsave(image_path, np.zeros((32, 40), dtype=np.uint8), check_contrast=False)
+    model_path = tmp_path.joinpath('model')
+    model_path.write_bytes(b'weights')
+
+    widget = ImageGrainProcWidget(ViewerModel())
+    widget.image_path = image_path
+    widget.image_name = image_path.name
+    widget.model_path = model_path
+    widget.model_name = model_path.name
+    widget.check_save_mask.setChecked(False)
+
+    model = FakeModel()
+    monkeypatch.setattr(widget, 'initialize_model', lambda notify_cpu=True: model)
+    flow_cache.clear()
+    yield widget, model
+    flow_cache.clear()
+
+
+def test_segment_single_image_passes_thresholds(widget):
+    widget, model = widget
+    widget.spinbox_cellprob_threshold.setValue(-1.0)
+    widget.spinbox_flow_threshold.setValue(0.8)
+
+    widget._on_click_segment_single_image()
+
+    assert len(model.calls) == 1
+    assert model.calls[0]['cellprob_threshold'] == -1.0
+    assert model.calls[0]['flow_threshold'] == 0.8
+    assert 'img1_model_pred' in widget.viewer.layers
+    assert widget.viewer.layers['img1_model_pred'].data.shape == (32, 40)
+
+
+def test_segment_single_image_reuses_flows(widget):
+    widget, model = widget
+
+    widget._on_click_segment_single_image()
+    widget._on_click_segment_single_image()
+
+    assert len(model.calls) == 1
+
+
+def test_preview_region_uses_canvas_size(widget):
+    widget, _ = widget
+    widget.viewer.add_image(np.zeros((1000, 2000), dtype=np.uint8))
+    widget.combobox_preview_region.value = 'viewport'
+    widget.viewer.camera.center = (500, 1000)
+    widget.viewer.camera.zoom = 1
+    widget.viewer.canvas.size = (200, 400)
+
+    image, offset = widget._get_preview_region()
+
+    assert offset == (400, 800)
+    assert image.shape == (201, 401)
+
+
+def test_preview_region_reads_current_plane_only(widget):
+    widget, _ = widget
+    stack = da.stack([da.full((100, 200), ind, dtype=np.uint8) for ind in range(3)])
+    widget.viewer.add_image(stack)
+    widget.viewer.dims.set_current_step(0, 1)
+
+    image, offset = widget._get_preview_region()
+
+    assert offset == (0, 0)
+    assert image.shape == (100, 200)
+    assert (np.asarray(image) == 1).all()
+
+
+def test_preview_uses_initialize_model(widget, monkeypatch):
+    widget, _ = widget
+
+    class PreviewModel:
+        def eval(self, img, **kwargs):
+            return np.ones(img.shape[:2], dtype=np.uint16), None, None
+
+    requests = []
+
+    def initialize_model(notify_cpu=True):
+        requests.append(notify_cpu)
+        return PreviewModel()
+
+    monkeypatch.setattr(widget, 'initialize_model', initialize_model)
+    widget.viewer.add_image(np.zeros((320, 400), dtype=np.uint8))
+    widget.spinbox_preview_size.setValue(128)
+    widget.check_preview_diameter.setChecked(True)
+    widget.preview_timer.stop()
+
+    widget._run_preview_segmentation()
+    while widget.preview_worker is not None:
+        QApplication.processEvents(QEventLoop.AllEvents, 50)
+
+    # the preview does not notify the user of every run on the cpu
+    assert requests == [False]
+    assert tuple(widget.preview_layer.scale) == (4, 4)
+    assert widget.preview_layer.data.shape == (80, 100)
+
+
+def test_preview_error_is_reported(widget, monkeypatch):
+    widget, _ = widget
+    messages = []
+    monkeypatch.setattr(widget, 'notify_user', lambda title, message: messages.append(message))
+    widget.check_preview_diameter.setChecked(True)
+
+    widget._on_preview_errored(RuntimeError('model failed'))
+
+    assert not widget.check_preview_diameter.isChecked()
+    assert 'model failed' in messages[0]
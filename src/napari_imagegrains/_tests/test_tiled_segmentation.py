@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from skimage.measure import label
+
+from napari_imagegrains.tiled_segmentation import iter_tiles, labels_in_core
+
+
+def test_iter_tiles_covers_raster():
+    tiles = list(iter_tiles(width=250, height=120, tile_size=100, overlap=10))
+
+    assert [core for core, _ in tiles] == [
+        (0, 0, 100, 100), (100, 0, 200, 100), (200, 0, 250, 100),
+        (0, 100, 100, 120), (100, 100, 200, 120), (200, 100, 250, 120)]
+    # windows are expanded by the overlap and clipped to the raster
+    assert tiles[0][1] == (0, 0, 110, 110)
+    assert tiles[1][1] == (90, 0, 210, 110)
+    assert tiles[5][1] == (190, 90, 250, 120)
+
+    covered = np.zeros((120, 250), dtype=int)
+    for (x0, y0, x1, y1), _ in tiles:
+        covered[y0:y1, x0:x1] += 1
+    assert np.all(covered == 1)
+
+
+def test_grain_on_seam_is_kept_once():
+    raster = np.zeros((60, 120), dtype=np.uint8)
+    raster[20:30, 52:62] = 1   # on the seam at x=60, centroid at x=56.5
+    raster[40:50, 100:110] = 1
+
+    kept = []
+    for core, window in iter_tiles(120, 60, tile_size=60, overlap=20):
+        x0, y0, x1, y1 = window
+        masks = label(raster[y0:y1, x0:x1])
+        for region_label in labels_in_core(masks, core, window):
+            ys, xs = np.nonzero(masks == region_label)
+            kept.append((core, int(xs.min()) + x0))
+
+    assert kept == [((0, 0, 60, 60), 52), ((60, 0, 120, 60), 100)]
+
+
+class LabelModel:
+    """Stands in for a Cellpose model and labels connected foreground."""
+
+    def eval(self, tile, **kwargs):
+        return label(tile > 0), None, None
+
+
+def test_segment_geotiff_tiled(tmp_path):
+    gdal = pytest.importorskip('osgeo.gdal')
+    from napari_imagegrains.tiled_segmentation import segment_geotiff_tiled
+
+    raster = np.zeros((60, 120), dtype=np.uint8)
+    raster[20:30, 52:62] = 255
+    raster[40:50, 100:110] = 255
+    image_path = tmp_path.joinpath('ortho.tif')
+    src = gdal.GetDriverByName('GTiff').Create(str(image_path), 120, 60, 1, gdal.GDT_Byte)
+    src.GetRasterBand(1).WriteArray(raster)
+    src = None
+
+    num_labels = segment_geotiff_tiled(image_path, LabelModel(), tmp_path.joinpath('labels.tif'),
+                                       tile_size=60, overlap=20)
+
+    labels = gdal.Open(str(tmp_path.joinpath('labels.tif'))).ReadAsArray()
+    assert num_labels == 2
+    assert sorted(np.unique(labels)) == [0, 1, 2]
+    np.testing.assert_array_equal(labels > 0, raster > 0)
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from napari_imagegrains import utils
+from napari_imagegrains.utils import (
+    DataNameIndex,
+    compact_mask,
+    find_matching_data_index,
+    prefetch_images,
+    read_complete_grain_files,
+    read_grain_dataset,
+)
+
+
+@pytest.fixture(params=['pyarrow', 'pandas'])
+def grain_files(request, tmp_path, monkeypatch):
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(utils, '_pyarrow_csv', lambda: None)
+    grain_files = []
+    for ind in [1, 2]:
+        grain_file = tmp_path.joinpath(f'img{ind}_pred_grains.csv')
+        pd.DataFrame({'label': range(1, ind + 1), 'area': [10.0] * ind}).to_csv(grain_file)
+        grain_files.append(grain_file)
+    return grain_files
+
+
+def test_grain_files_index_column_is_dropped(grain_files):
+    grains = read_complete_grain_files(grain_files)
+    assert [list(x.columns) for x in grains] == [['label', 'area'], ['label', 'area']]
+
+    dataset = read_grain_dataset(grain_files)
+    assert list(dataset.columns) == ['label', 'area', 'file_id']
+    assert list(dataset['file_id']) == ['img1_pred_grains'] + ['img2_pred_grains'] * 2
+
+
+class CountingReader:
+    """Records the paths it reads and fails on paths named 'broken'."""
+
+    def __init__(self):
+        self.read = []
+
+    def __call__(self, path):
+        self.read.append(path)
+        if path == 'broken':
+            raise OSError('cannot read broken')
+        return path.upper()
+
+
+def test_prefetch_images_order_and_read_ahead():
+    batches = [['a', 'b'], ['c'], ['d', 'e'], ['f'], ['g']]
+    reader = CountingReader()
+
+    results = []
+    for batch, images in prefetch_images(batches, reader, read_ahead=2, io_threads=3):
+        # the current batch, the next read_ahead batches and none after
+        assert len(reader.read) <= sum(len(x) for x in batches[:len(results) + 3])
+        results.append((batch, images))
+
+    assert results == [(batch, [x.upper() for x in batch]) for batch in batches]
+    assert sorted(reader.read) == sorted(x for batch in batches for x in batch)
+
+
+def test_prefetch_images_raises_read_error():
+    batches = [['a'], ['broken'], ['c']]
+    results = prefetch_images(batches, CountingReader(), read_ahead=1)
+
+    assert next(results) == (['a'], ['A'])
+    with pytest.raises(OSError, match='broken'):
+        next(results)
+
+
+def test_compact_mask():
+    mask = np.zeros((4, 4), dtype=np.int64)
+    mask[0, 0] = 7
+    mask[1, 1] = 300
+
+    compacted = compact_mask(mask)
+    assert compacted.dtype == np.uint8
+    assert sorted(np.unique(compacted)) == [0, 1, 2]
+    assert compact_mask(np.arange(300).reshape(15, 20)).dtype == np.uint16
+
+
+def test_compact_empty_mask():
+    compacted = compact_mask(np.zeros((0, 5), dtype=np.int32))
+    assert compacted.shape == (0, 5)
+    assert compacted.dtype == np.uint8
+
+
+def test_data_name_index_matches_list_scan():
+    names = ['img1_pred_grains', 'img10_pred_grains', 'img1_pred_grains_re_scaled',
+             'IMG1_pred_grains', 'img2_m_pred_grains', 'ab', 'img1']
+    index = DataNameIndex(names)
+
+    for reference, key_string in [('img1', None), ('img1', 're_scaled'), ('img10', None),
+                                  ('img2', 'm_'), ('ab', None), ('a', None), ('', None),
+                                  ('img3', None), ('img1', 'x')]:
+        assert (find_matching_data_index(f'{reference}.jpg', index, key_string)
+                == find_matching_data_index(f'{reference}.jpg', names, key_string))
+    assert index.find('img1', key_string='re_scaled') == [2]
+
+
+def test_unreadable_grain_file_is_skipped(grain_files, tmp_path):
+    with pytest.warns(UserWarning, match='missing'):
+        grains = read_complete_grain_files([grain_files[0], tmp_path.joinpath('missing.csv')])
+    assert len(grains) == 1
@@ -1,85 +1,127 @@
 import os
 from pathlib import Path
+
+import numpy as np
 #from tqdm import tqdm
 #from glob import glob
 #from natsort import natsorted
 #from skimage.measure import label, regionprops_table
 
-from cellpose import io, version
+from cellpose import version
+from .utils import save_mask
 #from imagegrains import __cp_version__
 
-def predict_single_image(image_path, model,channels=[0,0], diameter=None,
-                         min_size=15, rescale=None, config=None, return_results=False,
-                         mute=False, save_masks=True,tar_dir='',model_id=''):
+def predict_images(imgs, img_ids, model, channels=(0, 0), diameter=None,
+                   min_size=15, rescale=None, save_masks=True, tar_dir='',
+                   parent_folder='', model_id='', cellprob_threshold=0.0,
+                   flow_threshold=0.4, batch_size=8):
     """
-    Segment one or multiple images with a trained model.
+    Segment one or multiple already decoded images with a trained model. Images
+    are passed as arrays so that the caller can decode them ahead of time and
+    reuse them e.g. for display.
+    With Cellpose 4, images of identical shape are stacked into a single array
+    so that the tiles of several images are run through the network together,
+    `batch_size` tiles at a time. Cellpose evaluates a list of images one by one.
 
     Parameters:
     ------------
-    image_path (str, Path) - Input image(s)
-    model (obj) - Trained model from 'models.CellposeModel' class. 
-        Use either `models.CellposeModel(model_type='')` for built-in cellpose models or 
-        `models.CellposeModel(pretrained_model='') for custom models.
-        See https://cellpose.readthedocs.io/en/latest/models.html for more details
-    channels (list (optional, default [0,0])) - channels to use for segmentation
+    imgs (list) - Input images as arrays
+    img_ids (list) - Image names (without extension) used for the output file names
+    model (obj) - Trained model from 'models.CellposeModel' class.
+    channels (list (optional, default (0, 0))) - channels to use for segmentation with Cellpose <= 3
     diameter (float (optional, default None)) - diameter of the objects to segment
     min_size (int (optional, default 15)) - minimum size of the objects to segment
     rescale (float (optional, default None)) - rescale factor for the image
-    config (dict (optional, default None)) - dictionary of advanced parameters to be handed down to `CellposeModel.eval()` where keys are parameters and values are parameter values.
-    return_results (bool (optional, default False)) - flag for returning predicted masks, flows and styles
-    mute (bool (optional, default=False)) - flag for muting console output
     save_masks (bool (optional, default True)) - flag for saving predicted mask as `.tif` files in `tar_dir`
     tar_dir (str (optional, default '')) - The directory to save the predicted masks to.
+    parent_folder (str, Path (optional, default '')) - Folder of the input images. If no `tar_dir`
+        is given, masks are saved in a `predictions` subfolder of it.
     model_id (str (optional, default = '')) - optional model name that will be written into output file names
+    cellprob_threshold (float (optional, default 0.0)) - threshold on the cell probability
+    flow_threshold (float (optional, default 0.4)) - maximum allowed flow error per mask
+    batch_size (int (optional, default 8)) - number of tiles run through the network at once
+
+    Returns:
+    ------------
+    masks, flows, styles - predicted masks, flows and styles
     """
 
-    if not isinstance(image_path, list):
-        image_path = [str(Path(image_path).as_posix())]
-    else:
-        image_path = [str(Path(x).as_posix()) for x in image_path]
     if int(str(version).split(".")[0]) >3: #replace later with __cp_version__
-            channels = None
-    try:
-        img = [io.imread(str(x)) for x in image_path]
-        img_id = [Path(x).stem for x in image_path]
-        if config:
-            try:
-                eval_str = ''
-                for key,val in config.items():
-                    if not eval_str:
-                        i_str=f'{key}={val}'
-                    else:
-                        i_str=f',{key}={val}'
-                    eval_str+=i_str
-                exec(f'masks, flows, styles = model.eval(img, diameter=diameter,rescale=rescale,min_size=min_size,channels=channels, {eval_str})')
-            except AttributeError:
-                print('Config file is not formatted correctly. Please check the documentation for more information.')
-            except SyntaxError:
-                print('Diameter,rescale,min_size,channels are not allowed to be overwritten.')
-        else:
-            masks, flows, styles = model.eval(img, diameter=diameter, rescale=rescale, min_size=min_size, channels=channels); 
-        
-        # save masks
-        if save_masks == False and return_results == False:
-            print('Saving and returning of results were switched of - therefore mask saving was turned on!')
-            save_masks = True
-        if save_masks == True:
-            if tar_dir:
-                os.makedirs(Path(tar_dir), exist_ok=True)
-                parent_folder = Path(tar_dir)
-            else:
-                parent_folder = Path(image_path[0]).parent.joinpath('predictions')
-                os.makedirs(parent_folder, exist_ok=True)
-            
-            for ind, id in enumerate(img_id):
-                io.imsave(parent_folder.joinpath(f'{id}_{model_id}_pred.tif'),masks[ind])
-
-        if mute== False:
-            print('Sucessfully created predictions for one image(s).')
-    except KeyboardInterrupt:
-        print('Aborted.')
-    
-    if return_results == True:
-        return masks, flows, styles
+        channels = None
+        if len(imgs) > 1 and len({img.shape for img in imgs}) == 1:
+            return _predict_stacked_images(
+                imgs, img_ids, model, diameter=diameter, min_size=min_size, rescale=rescale,
+                save_masks=save_masks, tar_dir=tar_dir, parent_folder=parent_folder,
+                model_id=model_id, cellprob_threshold=cellprob_threshold,
+                flow_threshold=flow_threshold, batch_size=batch_size)
     else:
-        return None
\ No newline at end of file
+        channels = list(channels)
+    masks, flows, styles = model.eval(imgs, diameter=diameter, rescale=rescale, min_size=min_size, channels=channels,
+                                      cellprob_threshold=cellprob_threshold, flow_threshold=flow_threshold,
+                                      batch_size=batch_size)
+
+    if save_masks:
+        if tar_dir:
+            os.makedirs(Path(tar_dir), exist_ok=True)
+            target_folder = Path(tar_dir)
+        else:
+            target_folder = Path(parent_folder).joinpath('predictions')
+            os.makedirs(target_folder, exist_ok=True)
+
+        for ind, img_id in enumerate(img_ids):
+            save_mask(target_folder.joinpath(f'{img_id}_{model_id}_pred.tif'), masks[ind])
+
+    return masks, flows, styles
+
+
+def _predict_stacked_images(imgs, img_ids, model, diameter, min_size, rescale, save_masks,
+                            tar_dir, parent_folder, model_id, cellprob_threshold,
+                            flow_threshold, batch_size):
+    """Segments images of identical shape as one (N, Y, X, C) array with
+    Cellpose 4 and splits the results per image like predict_images."""
+
+    stack = np.stack(imgs)
+    if stack.ndim == 3:
+        stack = stack[..., np.newaxis]
+    masks, flows, styles = model.eval(stack, channel_axis=3, diameter=diameter, rescale=rescale,
+                                      min_size=min_size, cellprob_threshold=cellprob_threshold,
+                                      flow_threshold=flow_threshold, batch_size=batch_size)
+    masks = list(masks)
+    flows = [[flows[0][ind], flows[1][:, ind], flows[2][ind]] for ind in range(len(imgs))]
+    styles = list(styles)
+
+    if save_masks:
+        target_folder = Path(tar_dir) if tar_dir else Path(parent_folder).joinpath('predictions')
+        os.makedirs(target_folder, exist_ok=True)
+        for ind, img_id in enumerate(img_ids):
+            save_mask(target_folder.joinpath(f'{img_id}_{model_id}_pred.tif'), masks[ind])
+
+    return masks, flows, styles
+
+
+def predict_preview(img, model, diameter=None, step=1, min_size=15):
+    """
+    Segment a subsampled copy of an image for a quick preview, e.g. while
+    the expected diameter is being adjusted.
+
+    Parameters:
+    ------------
+    img (array) - Input image as array (Y, X) or (Y, X, C)
+    model (obj) - Trained model from 'models.CellposeModel' class.
+    diameter (float (optional, default None)) - diameter of the objects in the full resolution image
+    step (int (optional, default 1)) - subsampling step along both image axes
+    min_size (int (optional, default 15)) - minimum size of the objects in the full resolution image
+
+    Returns:
+    ------------
+    mask - predicted mask of the subsampled image
+    """
+
+    channels = [0,0]
+    if int(str(version).split(".")[0]) >3: #replace later with __cp_version__
+        channels = None
+    img = img[::step, ::step]
+    if diameter:
+        diameter = diameter / step
+    masks, _, _ = model.eval(img, diameter=diameter, min_size=max(1, min_size // step ** 2), channels=channels)
+    return masks
@@ -0,0 +1,455 @@
+"""
+Headless folder segmentation. This module does not depend on Qt or napari so
+that large folders can be segmented on machines without display, either from
+Python with `segment_folder` or from the command line with
+`napari-imagegrains-segment`.
+"""
+
+import os
+
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+
+import argparse
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+from multiprocessing import get_context
+from pathlib import Path
+
+from cellpose import io, models
+
+from .access_single_image_widget import predict_images
+from .georeference import (
+    copy_world_file,
+    read_georeference,
+    write_georeferenced_mask,
+)
+from .model_cache import model_cache
+from .prediction_store import PredictionStore
+from .run_manifest import RunManifest, model_identity
+from .tiled_segmentation import segment_geotiff_tiled
+from .utils import group_images_by_size, prefetch_images, save_mask
+
+SegmentationResult = namedtuple(
+    'SegmentationResult',
+    ['idx', 'image_path', 'image', 'masks', 'flows', 'styles', 'georef_ok', 'error'])
+SegmentationResult.__doc__ = """Result of the segmentation of one image of a folder.
+image, masks, flows and styles are None for tiled segmentation and if the
+segmentation failed, in which case error contains the exception. Flows and
+styles are also None for segmentation in processes, and so is the image
+unless it is read again (see segment_folder_multiprocess)."""
+
+
+def _record_prediction(manifest, image_path, model_id, model_info, eval_params):
+    """Records the saved prediction of image_path in the manifest, if any."""
+
+    if manifest is not None:
+        manifest.record(image_path, f"{image_path.stem}_{model_id}_pred.tif",
+                        model=model_info, params=eval_params)
+
+
+def is_processed_image(image_name):
+    """Returns True if the file name indicates an output of a previous processing
+    (masks, predictions, flows or composites)."""
+
+    return any(x in image_name for x in ["mask", "pred", "flow", "composite"])
+
+
+def list_images(image_folder, extensions):
+    """Returns the names of the files in image_folder ending with one of the
+    extensions."""
+
+    img_list = []
+    for image_in_folder in os.listdir(image_folder):
+        for img_ext in extensions:
+            if image_in_folder.endswith(img_ext):
+                img_list.append(image_in_folder)
+    return img_list
+
+
+def segment_folder(model, image_folder, img_list, save_masks, tar_dir,
+                   model_id, diameter, use_georef=False, memory_budget=None,
+                   read_ahead=2, io_threads=2, tile_size=None, tile_overlap=256,
+                   manifest=None, model_info=None, eval_params=None,
+                   skip_errors=False, store=None, batch_size=8):
+    """
+    Segments a list of images of a folder and yields a SegmentationResult per
+    image so that results can be used while the next image is being processed.
+    The next read_ahead batches are decoded on io_threads threads while the
+    model runs on the current one.
+    If a memory_budget (bytes) is given, consecutive images of identical size
+    are grouped into batches that are segmented as one stacked array, so that
+    the tiles of several images share the forward passes of the network
+    (batch_size tiles at a time). This mostly speeds up folders of small
+    images. Results of a batch are yielded once the whole batch is segmented.
+    If a tile_size is given, images are segmented tile by tile directly from
+    disk and written as georeferenced label rasters. In that case no image and
+    masks are returned as they typically do not fit in memory.
+    If a RunManifest is given, every saved prediction is recorded in it together
+    with model_info and eval_params so that later runs can skip the image. The
+    caller should save the manifest once the run is over.
+    If skip_errors is True, a failing image is reported in the error field of
+    its result instead of stopping the run.
+    If a PredictionStore is given, masks and flows are also written to it
+    (except for tiled segmentation). The caller should consolidate the store
+    once the run is over.
+    """
+
+    image_folder = Path(image_folder)
+
+    def record(image_path):
+        _record_prediction(manifest, image_path, model_id, model_info, eval_params)
+
+    image_paths = [image_folder.joinpath(img) for img in img_list]
+
+    if tile_size:
+        if tar_dir:
+            target_folder = Path(tar_dir)
+        else:
+            target_folder = image_folder.joinpath('predictions')
+        for idx, image_path in enumerate(image_paths):
+            try:
+                segment_geotiff_tiled(
+                    image_path=image_path,
+                    model=model,
+                    output_path=target_folder.joinpath(f"{image_path.stem}_{model_id}_pred.tif"),
+                    tile_size=tile_size,
+                    overlap=tile_overlap,
+                    diameter=diameter)
+            except Exception as e:
+                if not skip_errors:
+                    raise
+                yield SegmentationResult(idx, image_path, None, None, None, None, False, e)
+                continue
+            record(image_path)
+            yield SegmentationResult(idx, image_path, None, None, None, None, True, None)
+        return
+
+    if memory_budget:
+        batches = group_images_by_size(image_paths, memory_budget)
+    else:
+        batches = [[image_path] for image_path in image_paths]
+
+    # georeferenced predictions are written in a single pass by this function
+    write_georef = use_georef and save_masks
+    target_folder = Path(tar_dir) if tar_dir else image_folder.joinpath('predictions')
+
+    def read_image(image_path):
+        # read errors are returned instead of raised to be handled per batch
+        try:
+            img = io.imread(image_path)
+            georef = read_georeference(image_path) if write_georef else None
+            return img, georef
+        except (OSError, ValueError, RuntimeError) as e:
+            return e, None
+
+    idx = 0
+    for batch, items in prefetch_images(batches, reader=read_image,
+                                        read_ahead=read_ahead, io_threads=io_threads):
+        imgs = [x[0] for x in items]
+        georefs = [x[1] for x in items]
+        try:
+            for img in imgs:
+                if isinstance(img, Exception):
+                    raise img
+            mask_l, flow_l, styles_l = predict_images(
+                imgs=imgs,
+                img_ids=[image_path.stem for image_path in batch],
+                model=model,
+                save_masks=save_masks and not write_georef,
+                tar_dir=tar_dir,
+                parent_folder=image_folder,
+                model_id=model_id,
+                diameter=diameter,
+                batch_size=batch_size)
+        except Exception as e:
+            if not skip_errors:
+                raise
+            for image_path in batch:
+                yield SegmentationResult(idx, image_path, None, None, None, None, False, e)
+                idx += 1
+            continue
+
+        for ind, image_path in enumerate(batch):
+            georef_ok = True
+            if write_georef:
+                georef_ok = save_georeferenced_prediction(
+                    image_path, mask_l[ind], georefs[ind], target_folder, model_id)
+            if store is not None:
+                store.write_prediction(f"{image_path.stem}_{model_id}_pred", mask_l[ind], flow_l[ind])
+            if save_masks:
+                record(image_path)
+
+            yield SegmentationResult(
+                idx, image_path, imgs[ind], [mask_l[ind]], [flow_l[ind]],
+                [styles_l[ind]], georef_ok, None)
+            idx += 1
+
+
+# model loaded once by each process of segment_folder_multiprocess
+_process_model = None
+
+
+def _init_segmentation_process(model_path, torch_threads):
+    """Initializer of the segmentation processes: limits the number of torch
+    threads and loads the model once."""
+
+    global _process_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    _process_model = models.CellposeModel(gpu=False, pretrained_model=str(model_path))
+
+
+def _segment_in_process(image_path, save_masks, tar_dir, model_id, diameter,
+                        use_georef=False):
+    """Segments one image with the model of the current process. Only the mask
+    is sent back, the image, flows and styles are not to keep inter-process
+    transfers small."""
+
+    write_georef = use_georef and save_masks
+    img = io.imread(str(image_path))
+    georef = read_georeference(image_path) if write_georef else None
+    mask_l, _, _ = predict_images(
+        imgs=[img],
+        img_ids=[image_path.stem],
+        model=_process_model,
+        save_masks=save_masks and not write_georef,
+        tar_dir=tar_dir,
+        parent_folder=image_path.parent,
+        model_id=model_id,
+        diameter=diameter)
+    georef_ok = True
+    if write_georef:
+        target_folder = Path(tar_dir) if tar_dir else image_path.parent.joinpath('predictions')
+        georef_ok = save_georeferenced_prediction(
+            image_path, mask_l[0], georef, target_folder, model_id)
+    return mask_l[0], georef_ok
+
+
+def segment_folder_multiprocess(model_path, image_folder, img_list, save_masks,
+                                tar_dir, model_id, diameter, use_georef=False,
+                                num_processes=2, torch_threads=1, manifest=None,
+                                model_info=None, eval_params=None, skip_errors=False,
+                                store=None, read_images=False):
+    """
+    Segments a list of images of a folder on the CPU with a pool of processes.
+    Each process loads the model from model_path once and uses torch_threads
+    intra-op threads. Processes pull images from the shared task queue of the
+    pool, and a SegmentationResult is yielded per image in input order, so
+    that progress and outputs are deterministic. Flows and styles of the
+    results are None. Images are only sent back as masks; if read_images is
+    True, e.g. for display, the image of each result is read again by the
+    calling process, otherwise it is None. See segment_folder for the other
+    parameters.
+    """
+
+    image_folder = Path(image_folder)
+    image_paths = [image_folder.joinpath(img) for img in img_list]
+
+    executor = ProcessPoolExecutor(
+        max_workers=num_processes, mp_context=get_context('spawn'),
+        initializer=_init_segmentation_process, initargs=(str(model_path), torch_threads))
+    try:
+        # keep a bounded number of tasks in flight so that finished results
+        # do not pile up in memory
+        pending = deque()
+        path_iter = iter(image_paths)
+
+        def submit_next():
+            image_path = next(path_iter, None)
+            if image_path is not None:
+                pending.append((image_path, executor.submit(
+                    _segment_in_process, image_path, save_masks, tar_dir, model_id,
+                    diameter, use_georef)))
+
+        for _ in range(2 * num_processes):
+            submit_next()
+
+        idx = 0
+        while pending:
+            image_path, future = pending.popleft()
+            submit_next()
+            try:
+                mask, georef_ok = future.result()
+            except Exception as e:
+                if not skip_errors:
+                    raise
+                yield SegmentationResult(idx, image_path, None, None, None, None, False, e)
+                idx += 1
+                continue
+
+            if store is not None:
+                store.write_prediction(f"{image_path.stem}_{model_id}_pred", mask)
+            if save_masks:
+                _record_prediction(manifest, image_path, model_id, model_info, eval_params)
+
+            img = io.imread(str(image_path)) if read_images else None
+            yield SegmentationResult(idx, image_path, img, [mask], None, None, georef_ok, None)
+            idx += 1
+    finally:
+        # images still being segmented when the generator is closed early
+        # are not waited for, their processes exit once they are done
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def save_georeferenced_prediction(image_path, mask, georef, target_folder, model_id):
+    """Writes the prediction of image_path with the georeference read from it.
+    If the georeference is missing or cannot be written, the mask is saved
+    without it and False is returned."""
+
+    os.makedirs(target_folder, exist_ok=True)
+    output_path = Path(target_folder).joinpath(f"{Path(image_path).stem}_{model_id}_pred.tif")
+    if georef is not None:
+        try:
+            write_georeferenced_mask(output_path, mask, georef)
+            copy_world_file(image_path, output_path)
+            return True
+        except (RuntimeError, OSError):
+            pass
+    save_mask(output_path, mask)
+    return False
+
+
+def build_parser():
+    """Returns the argument parser of the command line entry point."""
+
+    parser = argparse.ArgumentParser(
+        prog='napari-imagegrains-segment',
+        description='Segment all images of a folder without napari.')
+    parser.add_argument('image_folder', type=Path, help='Folder containing the images')
+    parser.add_argument('--model', type=Path, required=True, help='Path to the model weights')
+    parser.add_argument('--diameter', type=float, default=None, help='Expected median grain diameter (px)')
+    parser.add_argument('--output-dir', type=Path, default=None,
+                        help="Folder for the predictions. Default: 'predictions' in the image folder")
+    parser.add_argument('--extensions', nargs='+', default=['.jpg', '.jpeg'],
+                        help='Extensions of the images to segment. Default: .jpg .jpeg')
+    parser.add_argument('--georef', action='store_true', help='Write predictions of GeoTIFFs with their georeference (requires GDAL)')
+    parser.add_argument('--gpu', action='store_true', help='Run on GPU')
+    parser.add_argument('--batch-memory', type=int, default=None,
+                        help='Batch consecutive images of identical size up to this memory (MB)')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='Number of image tiles run through the network at once. Default: 8')
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='Segment large GeoTIFFs in tiles of this size (px, requires GDAL)')
+    parser.add_argument('--tile-overlap', type=int, default=256, help='Overlap between tiles (px)')
+    parser.add_argument('--skip-segmented', action='store_true',
+                        help='Skip images with up-to-date predictions in the output folder')
+    parser.add_argument('--hash-images', action='store_true',
+                        help='Identify images by the hash of their content in the manifest, so that '
+                             'touched but unmodified images are skipped (reads every image)')
+    parser.add_argument('--zarr', action='store_true',
+                        help='Also write masks and flows to a Zarr store in the output folder (requires zarr)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Segment on the CPU with this number of processes')
+    parser.add_argument('--torch-threads', type=int, default=1,
+                        help='Number of torch threads per process (with --processes)')
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point for headless folder segmentation. Returns 0 if
+    all images were segmented, 1 otherwise."""
+
+    args = build_parser().parse_args(argv)
+
+    if not args.image_folder.is_dir():
+        print(f'Image folder {args.image_folder} not found.', file=sys.stderr)
+        return 1
+    # checked upfront as georeferences are read along with the images
+    if (args.georef or args.tile_size) and find_spec('osgeo') is None:
+        print('GDAL not installed. Please install GDAL to use --georef or --tile-size.',
+              file=sys.stderr)
+        return 1
+    use_processes = args.processes and not args.gpu and not args.tile_size
+    # with processes the model is loaded by each of them
+    if not use_processes:
+        try:
+            model = model_cache.get(args.model, gpu=args.gpu)
+        except (OSError, RuntimeError, ValueError, KeyError) as e:
+            print(f'Could not load model {args.model}: {e}', file=sys.stderr)
+            return 1
+    elif not args.model.is_file():
+        print(f'Model {args.model} not found.', file=sys.stderr)
+        return 1
+
+    model_id = args.model.stem
+    tar_dir = args.output_dir if args.output_dir else args.image_folder.joinpath('predictions')
+
+    img_list = []
+    for img in list_images(args.image_folder, args.extensions):
+        if is_processed_image(img):
+            print(f'Skipping processed image {img}', file=sys.stderr)
+        else:
+            img_list.append(img)
+
+    model_info = model_identity(args.model)
+    eval_params = {'diameter': args.diameter, 'min_size': 15,
+                   'tile_size': args.tile_size, 'tile_overlap': args.tile_overlap if args.tile_size else None}
+    manifest = RunManifest(tar_dir, hash_content=args.hash_images)
+    if args.skip_segmented:
+        num_images = len(img_list)
+        img_list = [img for img in img_list if not manifest.is_current(
+            args.image_folder.joinpath(img), model_info, eval_params)]
+        print(f'{num_images - len(img_list)} up-to-date images skipped')
+
+    memory_budget = args.batch_memory * 1024 ** 2 if args.batch_memory else None
+
+    store = None
+    if args.zarr and not args.tile_size:
+        try:
+            store = PredictionStore(tar_dir)
+        except ModuleNotFoundError as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    if use_processes:
+        results = segment_folder_multiprocess(
+            model_path=args.model, image_folder=args.image_folder, img_list=img_list,
+            save_masks=True, tar_dir=tar_dir, model_id=model_id,
+            diameter=args.diameter, use_georef=args.georef,
+            num_processes=args.processes, torch_threads=args.torch_threads,
+            manifest=manifest, model_info=model_info, eval_params=eval_params,
+            skip_errors=True, store=store)
+    else:
+        results = segment_folder(
+            model=model, image_folder=args.image_folder, img_list=img_list,
+            save_masks=True, tar_dir=tar_dir, model_id=model_id,
+            diameter=args.diameter, use_georef=args.georef and not args.tile_size,
+            memory_budget=memory_budget, tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap, manifest=manifest,
+            model_info=model_info, eval_params=eval_params, skip_errors=True,
+            store=store, batch_size=args.batch_size)
+
+    failed = []
+    georef_failed = []
+    t_start = time.perf_counter()
+    t_last = t_start
+    try:
+        for result in results:
+            t_now = time.perf_counter()
+            # images segmented together (batches, processes) share the elapsed time
+            if result.error is not None:
+                failed.append(result.image_path)
+                print(f'[{result.idx + 1}/{len(img_list)}] {result.image_path.name} failed: {result.error}',
+                      file=sys.stderr)
+            else:
+                print(f'[{result.idx + 1}/{len(img_list)}] {result.image_path.name} {t_now - t_last:.2f} s')
+                if not result.georef_ok:
+                    georef_failed.append(result.image_path)
+                    print(f'Georeference of {result.image_path.name} incomplete.', file=sys.stderr)
+            t_last = t_now
+    finally:
+        # predictions written before an interruption are kept for the next run
+        manifest.save()
+        if store is not None:
+            store.consolidate()
+
+    print(f'Segmented {len(img_list) - len(failed)}/{len(img_list)} images in '
+          f'{time.perf_counter() - t_start:.1f} s')
+    return 1 if (failed or georef_failed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,520 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 ** 2
+GITHUB_DEMO_URL = "https://raw.githubusercontent.com/dmair1989/imagegrains/main"
+ZENODO_MODEL_RECORD = "15728186"
+
+# aggregate progress of a DownloadManager
+DownloadProgress = namedtuple('DownloadProgress', ['done', 'total', 'files_done', 'files_total'])
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded or fails verification."""
+
+
+def file_md5(path, chunk_size=CHUNK_SIZE):
+    """Returns the md5 hex digest of a file read in chunks."""
+
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def zenodo_file_info(url, session=None, timeout=30):
+    """
+    Resolve a Zenodo file url of the form
+    https://zenodo.org/records/{record}/files/{name}?download=1
+    into its download url and md5 checksum using the Zenodo API.
+
+    Parameters
+    ----------
+    url : str
+        Zenodo file url.
+    session : requests.Session, optional
+        Session used for the request.
+    timeout : float
+        Timeout of the request in seconds.
+
+    Returns
+    -------
+    url : str
+        Download url.
+    md5 : str or None
+        md5 checksum, None if the record could not be queried.
+    """
+
+    match = re.search(r'zenodo\.org/records?/(\d+)/files/([^?]+)', url)
+    if match is None:
+        return url, None
+    record_id, name = match.groups()
+    session = session or requests
+    try:
+        response = session.get(f'https://zenodo.org/api/records/{record_id}', timeout=timeout)
+        response.raise_for_status()
+        files = response.json().get('files', [])
+    except (requests.exceptions.RequestException, ValueError):
+        return url, None
+    for file in files:
+        if file.get('key') == requests.utils.unquote(name):
+            checksum = file.get('checksum', '')
+            md5 = checksum.split(':', 1)[1] if checksum.startswith('md5:') else None
+            return file.get('links', {}).get('self', url), md5
+    return url, None
+
+
+class DownloadCache:
+    """Content-addressed store of downloaded files.
+
+    Files are kept under their md5 checksum, and the checksum of each
+    downloaded url is recorded in an index, so that a file that was
+    downloaded once (from any url if its checksum is known) is copied from
+    the cache instead of being fetched again. Partial downloads are kept
+    next to the cache to be resumed.
+
+    Layout::
+
+        cache_dir/
+            blobs/{md5}          verified files
+            partial/{url_hash}   interrupted downloads
+            index.json           url -> md5
+
+    Parameters
+    ----------
+    cache_dir: str or Path
+        Folder of the cache. By default ~/.cache/napari-imagegrains.
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('NAPARI_IMAGEGRAINS_CACHE',
+                                       Path.home().joinpath('.cache', 'napari-imagegrains'))
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir.joinpath('blobs')
+        self.partial_dir = self.cache_dir.joinpath('partial')
+        self.index_path = self.cache_dir.joinpath('index.json')
+        self._lock = Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.index = {}
+        if self.index_path.exists():
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+
+    def lookup(self, url, md5=None):
+        """Returns the path of the cached file for md5, or for url if md5 is
+        not known, or None."""
+
+        md5 = md5 or self.index.get(url)
+        if md5 is None:
+            return None
+        blob = self.blob_dir.joinpath(md5)
+        return blob if blob.exists() else None
+
+    def partial_path(self, url):
+        """Returns the path used to store the partial download of url."""
+
+        return self.partial_dir.joinpath(hashlib.sha1(url.encode()).hexdigest() + '.part')
+
+    def add(self, url, path, md5):
+        """Moves a verified download into the cache and records url."""
+
+        blob = self.blob_dir.joinpath(md5)
+        os.replace(path, blob)
+        with self._lock:
+            self.index[url] = md5
+            tmp_path = self.index_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=1)
+            os.replace(tmp_path, self.index_path)
+        return blob
+
+
+def _copy_to_target(source, target_path):
+    """Copies source to target_path without ever leaving a partial file at
+    target_path."""
+
+    tmp_path = Path(str(target_path) + '.tmp')
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target_path)
+
+
+def _stream_to_file(session, url, part_path, chunk_size=CHUNK_SIZE, timeout=60):
+    """
+    Stream url into part_path, resuming from the size of an existing partial
+    file with an HTTP range request. Yields (downloaded bytes, total bytes)
+    after each chunk, total is None if unknown.
+    """
+
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as response:
+        if response.status_code == 416:
+            # the partial file is already complete
+            yield offset, offset
+            return
+        response.raise_for_status()
+        if response.status_code != 206:
+            # server ignored the range, start again
+            offset = 0
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length is not None else None
+
+        done = offset
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                done += len(chunk)
+                yield done, total
+    if total is not None and done < total:
+        raise DownloadError(f'Connection closed after {done} of {total} bytes of {url}')
+
+
+def iter_download(url, target_path, md5=None, cache=None, session=None,
+                  chunk_size=CHUNK_SIZE, timeout=60):
+    """
+    Download url to target_path, yielding progress as (downloaded bytes,
+    total bytes). The file is streamed in chunks to a partial file that is
+    resumed if an earlier download was interrupted, verified against md5 if
+    given, and stored in the download cache. Files already present at
+    target_path with the correct checksum, or present in the cache, are not
+    downloaded again.
+
+    Parameters
+    ----------
+    url : str
+        Url of the file.
+    target_path : str or Path
+        Path of the downloaded file.
+    md5 : str, optional
+        Expected md5 checksum of the file.
+    cache : DownloadCache, optional
+        Cache to use, by default the cache in the user's home.
+    session : requests.Session, optional
+        Session used for the download, allows to reuse connections.
+    chunk_size : int
+        Size of the chunks written to disk.
+    timeout : float
+        Timeout in seconds to connect and between received chunks.
+
+    Raises
+    ------
+    DownloadError
+        If the checksum of the downloaded file does not match md5.
+    """
+
+    target_path = Path(target_path)
+    cache = cache or DownloadCache()
+    # without checksum, a file is verified against an earlier download of url
+    known_md5 = md5 or cache.index.get(url)
+    if known_md5 is not None and target_path.exists() and file_md5(target_path) == known_md5:
+        size = target_path.stat().st_size
+        yield size, size
+        return
+
+    cached = cache.lookup(url, md5)
+    if cached is None:
+        part_path = cache.partial_path(url)
+        yield from _stream_to_file(session or requests.Session(), url, part_path,
+                                   chunk_size=chunk_size, timeout=timeout)
+        downloaded_md5 = file_md5(part_path)
+        if md5 is not None and downloaded_md5 != md5:
+            os.remove(part_path)
+            raise DownloadError(f'Checksum mismatch for {url}: expected {md5}, got {downloaded_md5}')
+        cached = cache.add(url, part_path, downloaded_md5)
+    else:
+        size = cached.stat().st_size
+        yield size, size
+
+    os.makedirs(target_path.parent, exist_ok=True)
+    _copy_to_target(cached, target_path)
+
+
+def download_file(url, target_path, md5=None, cache=None, session=None,
+                  progress=None, chunk_size=CHUNK_SIZE, timeout=60):
+    """
+    Download url to target_path, see iter_download. progress is an optional
+    callable receiving (downloaded bytes, total bytes).
+
+    Returns
+    -------
+    target_path : Path
+        Path of the downloaded file.
+    """
+
+    for done, total in iter_download(url, target_path, md5=md5, cache=cache, session=session,
+                                     chunk_size=chunk_size, timeout=timeout):
+        if progress is not None:
+            progress(done, total)
+    return Path(target_path)
+
+
+def zenodo_record_files(record_id, session=None, extension=None, timeout=30):
+    """
+    List the files of a Zenodo record.
+
+    Parameters
+    ----------
+    record_id : str
+        Id of the record, e.g. '15728186'.
+    session : requests.Session, optional
+        Session used for the request.
+    extension : str, optional
+        Only keep files whose name ends with extension.
+    timeout : float
+        Timeout of the request in seconds.
+
+    Returns
+    -------
+    files : list of tuple
+        (download url, file name, md5) for each file.
+    """
+
+    session = session or requests
+    response = session.get(f'https://zenodo.org/api/records/{record_id}', timeout=timeout)
+    response.raise_for_status()
+    files = []
+    for file in response.json().get('files', []):
+        name = file['key']
+        if extension is not None and not name.lower().endswith(extension.lower()):
+            continue
+        checksum = file.get('checksum', '')
+        md5 = checksum.split(':', 1)[1] if checksum.startswith('md5:') else None
+        files.append((file['links']['self'], name, md5))
+    return files
+
+
+def pooled_session(max_connections=4):
+    """Returns a requests session keeping up to max_connections connections
+    per host open, to be shared by download threads."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class DownloadManager:
+    """Downloads several files concurrently.
+
+    Files are fetched by a pool of threads sharing one HTTP session, each
+    file with iter_download so that files already present and verified or
+    in the cache are skipped. Progress of all files is aggregated.
+
+    Parameters
+    ----------
+    max_workers: int
+        Maximum number of files downloaded at the same time.
+    cache: DownloadCache, optional
+        Cache to use, by default the cache in the user's home.
+    """
+
+    def __init__(self, max_workers=4, cache=None):
+        self.max_workers = max_workers
+        self.cache = cache or DownloadCache()
+        self.session = pooled_session(max_workers)
+
+    def iter_download_all(self, files):
+        """
+        Download files given as list of (url, target path, md5 or None),
+        yielding a DownloadProgress whenever a chunk was received or a file
+        finished. Files that fail are skipped.
+
+        Returns
+        -------
+        failed : list of tuple
+            (url, error) of the files that could not be downloaded.
+        """
+
+        files = list(files)
+        updates = queue.Queue()
+        stop = Event()
+
+        def download(ind, url, target_path, md5):
+            downloader = iter_download(url, target_path, md5=md5, cache=self.cache, session=self.session)
+            try:
+                for done, total in downloader:
+                    if stop.is_set():
+                        # partial file is kept and resumed by the next download
+                        downloader.close()
+                        return
+                    updates.put((ind, done, total, None))
+            except Exception as e:  # noqa: BLE001 the file is reported as failed
+                updates.put((ind, None, None, e))
+                return
+            updates.put((ind, None, None, False))
+
+        progress = {}
+        failed = []
+        files_done = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for ind, (url, target_path, md5) in enumerate(files):
+                executor.submit(download, ind, url, target_path, md5)
+            while files_done < len(files):
+                ind, done, total, error = updates.get()
+                if error is None:
+                    progress[ind] = (done, total)
+                else:
+                    files_done += 1
+                    if error is not False:
+                        failed.append((files[ind][0], error))
+                yield DownloadProgress(
+                    done=sum(x[0] for x in progress.values()),
+                    total=sum(x[1] or 0 for x in progress.values()),
+                    files_done=files_done, files_total=len(files))
+        finally:
+            # also reached when the consumer stops iterating
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        return failed
+
+    def download_all(self, files):
+        """Download files, see iter_download_all. Returns the failed files."""
+
+        downloader = self.iter_download_all(files)
+        while True:
+            try:
+                next(downloader)
+            except StopIteration as e:
+                return e.value
+
+
+def demo_data_files(tar_path, cp_version=4):
+    """
+    Returns the files of the ImageGrains demo dataset (notebooks, demo images
+    and models) as (url, target path, md5) to be downloaded into tar_path, as
+    done by imagegrains.data_loader.download_files. The lists are copied from
+    imagegrains, test_demo_data_files_match_imagegrains checks that they are
+    still the same.
+    """
+
+    tar_path = Path(tar_path)
+    nb_list = ['1_image_segmentation.ipynb',
+               '2_grain_sizes.ipynb',
+               '3_gsd_analysis.ipynb',
+               '4_train_cellpose_model.ipynb',
+               'complete_imagegrains_analysis.ipynb']
+    fh_test_list = ['4_P1060348_3.jpg', '4_P1060348_3_mask.tif']
+    fh_train_list = [f'{x}{y}' for x in ['1_P1060330_1', '2_P1060338_0', '3_P1060343_3',
+                                         '5_P1060351_2', '6_P1060355_0', '7_P1060359_3']
+                     for y in ['.jpg', '_mask.tif']]
+    dem_dat_list = ['FH_resolutions.csv', 'OM_err.csv', 'SI_err.csv', 'K1/K1_C2_385.jpg',
+                    'K1/K1_C3_0449.jpg', 'K1_field_measurement.csv', 'res_tSNE.pkl']
+
+    files = [(f'{GITHUB_DEMO_URL}/notebooks/{x}', tar_path.joinpath('notebooks', x), None) for x in nb_list]
+    files += [(f'{GITHUB_DEMO_URL}/demo_data/FH/test/{x}', tar_path.joinpath('demo_data', 'FH', 'test', x), None)
+              for x in fh_test_list]
+    files += [(f'{GITHUB_DEMO_URL}/demo_data/FH/train/{x}', tar_path.joinpath('demo_data', 'FH', 'train', x), None)
+              for x in fh_train_list]
+    files += [(f'{GITHUB_DEMO_URL}/demo_data/{x}', tar_path.joinpath('demo_data', x), None) for x in dem_dat_list]
+
+    # only models working with the installed cellpose version
+    if cp_version > 3:
+        model_list = ['IG2_full_set_cp_SAM']
+    else:
+        model_list = ['IG2_full_set.200525', 'IG2_coarse_grains.220425', 'IG2_baseline.260424', 'IG1_old_set.170223']
+    files += [(f'https://zenodo.org/records/{ZENODO_MODEL_RECORD}/files/{x}', tar_path.joinpath('models', x), None)
+              for x in model_list]
+    return files
+
+
+def iter_demo_data_download(tar_path, cp_version=4, max_workers=4, cache=None):
+    """
+    Download the demo dataset into tar_path concurrently, yielding a
+    DownloadProgress. Model checksums are taken from the Zenodo record.
+
+    Returns
+    -------
+    failed : list of tuple
+        (url, error) of the files that could not be downloaded.
+    """
+
+    manager = DownloadManager(max_workers=max_workers, cache=cache)
+    try:
+        checksums = {name: (url, md5) for url, name, md5 in
+                     zenodo_record_files(ZENODO_MODEL_RECORD, session=manager.session)}
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        checksums = {}
+    files = []
+    for url, target, md5 in demo_data_files(tar_path, cp_version=cp_version):
+        if target.parent.name == 'models' and target.name in checksums:
+            url, md5 = checksums[target.name]
+        files.append((url, target, md5))
+    failed = yield from manager.iter_download_all(files)
+    return failed
+
+
+def model_download_url(url):
+    """
+    Returns the url from which a model given by its Github or Zenodo page url
+    is downloaded and the name of the model file. For a Zenodo record url,
+    e.g. https://zenodo.org/records/15728186, the name is None as all files
+    of the record are downloaded.
+
+    Raises
+    ------
+    ValueError
+        If the url is neither on Github nor on Zenodo.
+    """
+
+    if "github.com" in url:
+        url = url.replace("github.com", "raw.githubusercontent.com").replace("blob/", "")
+        return url, url.split("/")[-1]
+    elif "zenodo.org" in url:
+        if "/files/" not in url:
+            return url, None
+        return url, url.split("/")[-1].split("?")[0]
+    raise ValueError("So far, model to be downloaded needs to be on Zenodo or on Github.")
+
+
+def iter_model_download(url, model_dir, cache=None, session=None, max_workers=4):
+    """
+    Download a model given by its Github or Zenodo url into model_dir,
+    yielding progress as (downloaded bytes, total bytes, ...). Zenodo files
+    are verified against the md5 checksum of the record. For a Zenodo
+    record url all files of the record are downloaded concurrently.
+
+    Returns
+    -------
+    failed : list of tuple
+        (url, error) of the files that could not be downloaded.
+    """
+
+    download_url, model_name = model_download_url(url)
+    if model_name is None:
+        record_id = re.search(r'records?/(\d+)', download_url)
+        if record_id is None:
+            raise ValueError(f"No Zenodo record found in {url}")
+        manager = DownloadManager(max_workers=max_workers, cache=cache)
+        files = zenodo_record_files(record_id.group(1), session=manager.session)
+        failed = yield from manager.iter_download_all(
+            [(file_url, Path(model_dir).joinpath(name), md5) for file_url, name, md5 in files])
+        return failed
+
+    session = session or requests.Session()
+    md5 = None
+    if "zenodo.org" in download_url:
+        download_url, md5 = zenodo_file_info(download_url, session=session)
+    yield from iter_download(download_url, Path(model_dir).joinpath(model_name), md5=md5,
+                             cache=cache, session=session)
+    return []
@@ -0,0 +1,126 @@
+import os
+import pickle
+from pathlib import Path
+
+from imagegrains.segmentation_helper import eval_set
+from skimage import io
+
+from .lru_cache import LRUCache
+
+THRESHOLDS = [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9]
+FILTERS = {'edge': [False, .05], 'px_cutoff': [False, 10]}
+FILTER_PROPS = ['label', 'area', 'centroid', 'major_axis_length', 'minor_axis_length']
+
+
+class EvaluationCache:
+    """LRU cache of the evaluation of predictions against labels.
+
+    Results (AP, IoU, TP, FP, FN) are cached per image and identified by the
+    label and prediction files (resolved path, modification time and size)
+    and the evaluation parameters, so that the same images are not evaluated
+    again e.g. for the performance plot of a folder, the export of the
+    average precision and the performance of a single image. Decoded images
+    are not kept.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of images for which results are kept.
+    """
+
+    def __init__(self, max_size=10000):
+        self._results = LRUCache(max_size)
+
+    @staticmethod
+    def make_key(lbl, pred, thresholds=THRESHOLDS, filters=FILTERS, filter_props=FILTER_PROPS):
+        """Returns the cache key of the evaluation of prediction pred against
+        label lbl."""
+
+        key = []
+        for path in [lbl, pred]:
+            path = Path(path).resolve()
+            stat = path.stat()
+            key += [str(path), stat.st_mtime_ns, stat.st_size]
+        return tuple(key) + (tuple(thresholds), repr(filters), tuple(filter_props))
+
+    def evaluate(self, imgs, lbls, preds, thresholds=THRESHOLDS, filters=FILTERS,
+                 filter_props=FILTER_PROPS):
+        """
+        Evaluate predictions against labels as eval_set, only for images
+        without cached results.
+
+        Parameters
+        ----------
+        imgs, lbls, preds : list
+            Paths of images, labels and predictions, matched by position.
+        thresholds, filters, filter_props
+            Evaluation parameters, see imagegrains.segmentation_helper.eval_set.
+
+        Returns
+        -------
+        eval_results : dict
+            Results by image index as returned by eval_set, without the
+            decoded images ('img'). Images with empty labels are left out.
+        """
+
+        keys = [self.make_key(lbl, pred, thresholds, filters, filter_props)
+                for lbl, pred in zip(lbls, preds)]
+        missing = [idx for idx, key in enumerate(keys) if key not in self._results]
+
+        if len(missing) > 0:
+            results = eval_set(
+                imgs=[imgs[idx] for idx in missing], lbls=[lbls[idx] for idx in missing],
+                preds=[preds[idx] for idx in missing], thresholds=thresholds,
+                filters=filters, filter_props=filter_props, save_results=False)
+            for sub_idx, idx in enumerate(missing):
+                # images with empty labels are cached as None
+                result = results.get(sub_idx)
+                if result is not None:
+                    result = {k: v for k, v in result.items() if k not in ('id', 'img')}
+                self._results.put(keys[idx], result)
+
+        eval_results = {}
+        for idx, key in enumerate(keys):
+            result = self._results.get(key)
+            if result is not None:
+                eval_results[idx] = {'id': Path(imgs[idx]).stem, **result}
+        return eval_results
+
+    def clear(self):
+        self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+# inputs of the results last written to each pkl file, with the modification
+# time of the written file
+_saved_evaluations = {}
+
+
+def save_evaluation(eval_results, imgs, lbls, preds, tar_dir, data_id=''):
+    """Saves evaluation results with their images to a pkl file as eval_set
+    does with save_results=True. The file is not written again if it already
+    holds the results of the same images, labels and predictions. Images are
+    decoded for the export only, without going through the image cache."""
+
+    path = Path(tar_dir).joinpath(f'{data_id}_eval_res.pkl').resolve()
+    inputs = (tuple(str(x) for x in imgs),
+              tuple(EvaluationCache.make_key(lbl, pred) for lbl, pred in zip(lbls, preds)))
+    try:
+        if _saved_evaluations.get(path) == (inputs, path.stat().st_mtime_ns):
+            return
+    except OSError:
+        pass
+
+    os.makedirs(path.parent, exist_ok=True)
+    export = {idx: {'id': result['id'], 'img': io.imread(str(imgs[idx])),
+                    **{k: v for k, v in result.items() if k != 'id'}}
+              for idx, result in eval_results.items()}
+    with open(path, 'wb') as f:
+        pickle.dump(export, f)
+    _saved_evaluations[path] = (inputs, path.stat().st_mtime_ns)
+
+
+# results reused by the performance tab for plots, exports and single images
+evaluation_cache = EvaluationCache()
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import numpy as np
+from cellpose import dynamics
+
+from .lru_cache import LRUCache
+
+
+def compute_masks_from_flows(dP, cellprob, diameter=None, cellprob_threshold=0.0,
+                             flow_threshold=0.4, min_size=15, device=None):
+    """
+    Reconstruct a label mask from the flows predicted by Cellpose, i.e. only
+    run the dynamics step of CellposeModel.eval without the network.
+
+    Parameters
+    ----------
+    dP : numpy.ndarray
+        Flow field of shape (2, Ly, Lx) as returned in flows[1] by model.eval.
+    cellprob : numpy.ndarray
+        Cell probability of shape (Ly, Lx) as returned in flows[2].
+    diameter : float, optional
+        Diameter used for the prediction. Sets the number of dynamics
+        iterations as in model.eval.
+    cellprob_threshold : float
+        Threshold on the cell probability.
+    flow_threshold : float
+        Maximum allowed flow error per mask.
+    min_size : int
+        Minimum number of pixels per mask.
+    device : torch.device, optional
+        Device on which to run the dynamics, by default the cpu.
+
+    Returns
+    -------
+    masks : numpy.ndarray
+        Label mask of shape (Ly, Lx).
+    """
+
+    # same number of iterations as model.eval for a given diameter
+    niter = int(200 / (30. / diameter)) if diameter else 200
+    kwargs = {} if device is None else {'device': device}
+    masks = dynamics.resize_and_compute_masks(
+        np.asarray(dP), np.asarray(cellprob), niter=niter,
+        cellprob_threshold=cellprob_threshold, flow_threshold=flow_threshold,
+        min_size=min_size, **kwargs)
+    return masks.squeeze()
+
+
+class FlowCache(LRUCache):
+    """LRU cache of the flows predicted for single images.
+
+    Flows are identified by the image file (resolved path and modification
+    time), the model weights (resolved path, modification time and size) and
+    the diameter, which are all the inputs of the network. Masks for other
+    thresholds or minimum sizes can then be recomputed from the cached flows
+    without running the model.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of images for which flows are kept in memory.
+    """
+
+    def __init__(self, max_size=4):
+        super().__init__(max_size)
+
+    @staticmethod
+    def make_key(image_path, model_path, diameter):
+        """Returns the cache key of the flows of image_path predicted by the
+        model in model_path at diameter."""
+
+        image_path = Path(image_path).resolve()
+        model_path = Path(model_path).resolve()
+        model_stat = model_path.stat()
+        return (str(image_path), image_path.stat().st_mtime_ns,
+                str(model_path), model_stat.st_mtime_ns, model_stat.st_size, diameter)
+
+    def put(self, key, flows, styles=None):
+        """Caches the flows (as returned by model.eval for one image) and
+        styles for key. Cached values are (flows, styles) tuples."""
+
+        super().put(key, (flows, styles))
+
+
+# flows of the last images segmented one at a time
+flow_cache = FlowCache()
@@ -0,0 +1,105 @@
+import os
+from bisect import bisect_left
+from fnmatch import fnmatch
+from pathlib import Path
+
+from natsort import natsorted
+
+from .lru_cache import LRUCache
+
+
+class FolderIndex:
+    """Sorted index of the names of the files of a folder.
+
+    Files whose name starts with a given prefix are found by bisection,
+    without listing the folder again, and are then filtered with a glob
+    pattern. The index records the modification time of the folder when it
+    was built, so that it can be rebuilt when files are added or removed.
+
+    Parameters
+    ----------
+    folder: str or Path
+        Folder to index.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        # the time is read before listing so that changes during the
+        # listing invalidate the index
+        self.mtime = self.folder.stat().st_mtime_ns
+        entries = []
+        with os.scandir(self.folder) as folder_entries:
+            for entry in folder_entries:
+                if entry.name[0] == '.':
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                entries.append((os.path.normcase(entry.name), entry.name))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+
+    def is_current(self):
+        """Returns True if the folder was not modified since it was indexed."""
+
+        try:
+            return self.folder.stat().st_mtime_ns == self.mtime
+        except OSError:
+            return False
+
+    def find(self, prefix, pattern='*'):
+        """Returns the naturally sorted names of the files whose name starts
+        with prefix and matches the glob pattern."""
+
+        prefix = os.path.normcase(prefix)
+        start = bisect_left(self.keys, prefix)
+        matches = []
+        for ind in range(start, len(self.keys)):
+            if not self.keys[ind].startswith(prefix):
+                break
+            if fnmatch(self.names[ind], pattern):
+                matches.append(self.names[ind])
+        return natsorted(matches)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class FolderIndexCache:
+    """LRU cache of folder indexes, rebuilt when their folder is modified.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of folders for which indexes are kept.
+    """
+
+    def __init__(self, max_size=64):
+        self._indexes = LRUCache(max_size)
+
+    def get(self, folder):
+        """Returns the current index of folder, building it if necessary."""
+
+        folder = Path(folder).resolve()
+        index = self._indexes.get(folder)
+        if index is not None and index.is_current():
+            return index
+        index = FolderIndex(folder)
+        self._indexes.put(folder, index)
+        return index
+
+    def invalidate(self, folder):
+        """Forces the index of folder to be rebuilt on next access, e.g. when
+        files were changed within the time resolution of the file system."""
+
+        self._indexes.pop(Path(folder).resolve())
+
+    def clear(self):
+        self._indexes.clear()
+
+
+# indexes of the folders searched by find_match_in_folder
+folder_index_cache = FolderIndexCache()
@@ -1,24 +1,242 @@
 import os
+import time
+from heapq import merge
 from pathlib import Path
-from qtpy.QtWidgets import QListWidget
-from qtpy.QtCore import Qt
-from natsort import natsorted
+from qtpy.QtWidgets import QListView, QAbstractItemView
+from qtpy.QtCore import (Qt, QAbstractListModel, QModelIndex, Signal,
+                         QFileSystemWatcher, QTimer)
+from natsort import natsort_keygen
+from napari.qt.threading import thread_worker
 from cellpose import version
 # after imagegrains v2: from imagegrains import __cp_version__
 
-class FolderList(QListWidget):
+from .utils import wait_for_worker
+
+natural_key = natsort_keygen()
+
+
+def keep_file(name, file_extensions=None, models=False):
+    """
+    Returns True if a file name should be listed.
+
+    Hidden files are never listed. Files with a numeric extension (model
+    weights like model.170223) are listed if no file_extensions are given,
+    other files if their extension is in file_extensions. With models=True
+    and Cellpose > 3, only files without extension are listed.
+    """
+
+    if name[0] == '.':
+        return False
+    suffix = Path(name).suffix
+    if models and int(str(version).split(".")[0]) >3: #replace with: if __cp_version__ >3
+        return not suffix[1:]
+    if suffix[1:].isdigit():
+        return file_extensions is None
+    return file_extensions is not None and suffix in file_extensions
+
+
+def scan_folder(path, file_extensions=None, models=False, batch_size=1000):
+    """
+    Scan a folder with os.scandir and yield the listed files (see keep_file)
+    as naturally sorted lists of (sort key, name). The first batch contains
+    batch_size files and each following batch twice as many, so that large
+    folders are merged into the list in few steps.
+    """
+
+    batch = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not keep_file(entry.name, file_extensions, models):
+                continue
+            try:
+                # uses the file type returned with the directory entry
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            batch.append((natural_key(entry.name), entry.name))
+            if len(batch) >= batch_size:
+                yield sorted(batch)
+                batch = []
+                batch_size *= 2
+    if batch:
+        yield sorted(batch)
+
+
+def diff_folder(path, names, file_extensions=None, models=False):
+    """
+    Compare the files listed in a folder (see keep_file) with names. Only
+    entries that are not in names are checked to be files.
+
+    Returns
+    -------
+    added : list
+        Naturally sorted list of (sort key, name) of new files.
+    removed : list
+        Names that are not in the folder anymore.
+    """
+
+    added = []
+    present = set()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not keep_file(entry.name, file_extensions, models):
+                continue
+            if entry.name in names:
+                present.add(entry.name)
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            added.append((natural_key(entry.name), entry.name))
+    removed = [name for name in names if name not in present]
+    return sorted(added), removed
+
+
+def _continue_scan(scanner):
+    yield from scanner
+
+
+def _diff_readable_folder(path, names, file_extensions=None, models=False):
+    """Runs diff_folder, returns None if the folder cannot be read anymore,
+    e.g. because it was deleted or renamed."""
+
+    try:
+        return diff_folder(path, names, file_extensions, models)
+    except OSError:
+        return None
+
+
+scan_folder_worker = thread_worker(_continue_scan)
+diff_folder_worker = thread_worker(_diff_readable_folder)
+
+
+class FolderListItem:
+    """Entry of a FolderList, mimics QListWidgetItem."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def text(self):
+        return self.name
+
+
+class FolderListModel(QAbstractListModel):
+    """Naturally sorted list of file names."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.names = []
+        self.keys = []
+
+    def rowCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.names):
+            return None
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return self.names[index.row()]
+        return None
+
+    def clear(self):
+        self.beginResetModel()
+        self.names = []
+        self.keys = []
+        self.endResetModel()
+
+    def add_entries(self, entries):
+        """Merges a sorted list of (sort key, name) into the list, keeping the
+        selection and current row of views on the same names."""
+
+        if len(entries) == 0:
+            return
+        start = len(self.names)
+        self.beginInsertRows(QModelIndex(), start, start + len(entries) - 1)
+        self.names.extend(name for _, name in entries)
+        self.endInsertRows()
+
+        # sort the appended rows into place
+        self.layoutAboutToBeChanged.emit()
+        old_names = self.names
+        merged = list(merge(zip(self.keys, old_names[:start]), entries))
+        self.keys = [key for key, _ in merged]
+        self.names = [name for _, name in merged]
+        old_indexes = self.persistentIndexList()
+        if old_indexes:
+            new_rows = {name: row for row, name in enumerate(self.names)}
+            new_indexes = [self.index(new_rows[old_names[index.row()]], 0) for index in old_indexes]
+            self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def remove_names(self, names):
+        """Removes names from the list. Views keep their selection on the
+        remaining names."""
+
+        rows = {name: row for row, name in enumerate(self.names)}
+        rows = sorted([rows[name] for name in names if name in rows], reverse=True)
+        # remove contiguous ranges of rows starting from the end
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.names[first:last + 1]
+            del self.keys[first:last + 1]
+            self.endRemoveRows()
+
+
+class FolderList(QListView):
+    """List of the files of a folder.
+
+    The folder is scanned with os.scandir, first on the UI thread for a short
+    time and then, for large folders, in a background thread. Entries are
+    added to the list model in batches and only visible rows are rendered.
+    The folder is then watched and added or removed files are applied to
+    the list as differences, keeping the current selection. The interface
+    mimics QListWidget.
+    """
     # be able to pass the Napari viewer name (viewer)
 
+    currentItemChanged = Signal(object, object)
+
     def __init__(self, viewer, parent=None, file_extensions=None):
         super().__init__(parent)
 
         self.viewer = viewer
         self.setAcceptDrops(True)
         self.setDragEnabled(True)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
 
         self.folder_path = None
 
         self.file_extensions = file_extensions
+        # time spent scanning on the UI thread before continuing in the background
+        self.sync_scan_time = 0.1
+        self.scan_worker = None
+        self._pending_row = None
+        self._pending_name = None
+        self.models = False
+
+        # changes of the folder are collected for refresh_delay ms before
+        # the list is updated, e.g. while a batch job writes files
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._on_directory_changed)
+        self.refresh_delay = 500
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_worker = None
+        self._refresh_pending = False
+
+        self.list_model = FolderListModel(self)
+        self.setModel(self.list_model)
+        self.selectionModel().currentChanged.connect(self._on_current_changed)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls:
@@ -37,58 +255,174 @@ class FolderList(QListWidget):
         if event.mimeData().hasUrls():
             event.setDropAction(Qt.CopyAction)
             event.accept()
-            
+
             for url in event.mimeData().urls():
                 file = str(url.toLocalFile())
                 if not Path(file).is_dir():
                     self.update_from_path(Path(file).parent)
-                    file_list = [self.item(x).text() for x in range(self.count())]
-                    self.setCurrentRow(file_list.index(Path(file).name))
+                    self.select_name(Path(file).name)
                 else:
                     self.update_from_path(Path(file))
 
-    def update_from_path(self, path):
+    def _on_current_changed(self, current, previous):
 
-        self.clear()
-        self.folder_path = path
-        files = os.listdir(self.folder_path)
-        files = natsorted(files)
-        for f in files:
-            if (f[0] != '.') and (self.folder_path.joinpath(f).is_file()):
-                if Path(f).suffix[1:].isdigit():
-                    if self.file_extensions == None:
-                        self.addItem(f)
-                else:
-                    if self.file_extensions != None and Path(f).suffix in self.file_extensions:
-                        self.addItem(f)
+        self.currentItemChanged.emit(self._item_at(current), self._item_at(previous))
+
+    def _item_at(self, index):
+
+        if not index.isValid() or index.row() >= self.list_model.rowCount():
+            return None
+        return FolderListItem(self.list_model.names[index.row()])
+
+    def currentItem(self):
+        return self._item_at(self.currentIndex())
+
+    def currentRow(self):
+        index = self.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def item(self, row):
+        return self._item_at(self.list_model.index(row, 0))
+
+    def count(self):
+        return self.list_model.rowCount()
+
+    def file_names(self):
+        """Returns the names of all listed files."""
+
+        return list(self.list_model.names)
 
+    def clear(self):
+        self._stop_scan()
+        self._stop_watching()
+        self.list_model.clear()
+
+    def setCurrentRow(self, row):
+        """Selects row. If the folder is still being scanned, the row is
+        selected once the scan is done."""
+
+        if self.scan_worker is not None:
+            self._pending_row, self._pending_name = row, None
+            return
+        if 0 <= row < self.count():
+            self.setCurrentIndex(self.list_model.index(row, 0))
+
+    def select_name(self, name):
+        """Selects the entry name, once the scan is done if it is running."""
+
+        if self.scan_worker is not None:
+            self._pending_row, self._pending_name = None, name
+            return
+        if name in self.list_model.names:
+            self.setCurrentRow(self.list_model.names.index(name))
+
+    def update_from_path(self, path):
+
+        self._scan(path, models=False)
 
     def update_models_from_path(self, path):
         #new function to allow model-weight files without extions and to filter models based on __cp_version__
+        self._scan(path, models=True)
+
+    def _scan(self, path, models):
+
         self.clear()
-        self.folder_path = path
-        files = os.listdir(self.folder_path)
-        files = natsorted(files)
-        # filter loadable models based on cellpose version
-        if int(str(version).split(".")[0]) >3: #replace with: if __cp_version__ >3
-            for f in files:
-                if (f[0] != '.') and (self.folder_path.joinpath(f).is_file()):
-                    if not Path(f).suffix[1:]:
-                        self.addItem(f)    
+        self.folder_path = Path(path)
+        self.models = models
+        self.watcher.addPath(str(self.folder_path))
+        scanner = scan_folder(self.folder_path, self.file_extensions, models=models)
+
+        # small folders are listed right away
+        start = time.perf_counter()
+        for batch in scanner:
+            self.list_model.add_entries(batch)
+            if time.perf_counter() - start > self.sync_scan_time:
+                break
         else:
-            for f in files:
-                if (f[0] != '.') and (self.folder_path.joinpath(f).is_file()):
-                    if Path(f).suffix[1:].isdigit():
-                        if self.file_extensions == None:
-                            self.addItem(f)
-                    else:
-                        if self.file_extensions != None and Path(f).suffix in self.file_extensions:
-                            self.addItem(f)    
-    
+            return
+
+        self.scan_worker = scan_folder_worker(scanner)
+        self.scan_worker.yielded.connect(self.list_model.add_entries)
+        self.scan_worker.finished.connect(self._on_scan_finished)
+        self.scan_worker.start()
+
+    def _on_scan_finished(self):
+
+        self.scan_worker = None
+        if self._refresh_pending:
+            self._refresh_pending = False
+            self.refresh()
+        if self._pending_name is not None:
+            self.select_name(self._pending_name)
+        elif self._pending_row is not None:
+            self.setCurrentRow(self._pending_row)
+        self._pending_row, self._pending_name = None, None
+
+    def _stop_scan(self):
+
+        if self.scan_worker is not None:
+            self.scan_worker.yielded.disconnect(self.list_model.add_entries)
+            self.scan_worker.finished.disconnect(self._on_scan_finished)
+            self.scan_worker.quit()
+            self.scan_worker = None
+        self._pending_row, self._pending_name = None, None
+
+    def _stop_watching(self):
+
+        if len(self.watcher.directories()) > 0:
+            self.watcher.removePaths(self.watcher.directories())
+        self.refresh_timer.stop()
+        self._refresh_pending = False
+        if self.refresh_worker is not None:
+            self.refresh_worker.returned.disconnect(self._on_refresh_returned)
+            self.refresh_worker.finished.disconnect(self._on_refresh_finished)
+            self.refresh_worker = None
+
+    def _on_directory_changed(self, path):
+
+        self.refresh_timer.start(self.refresh_delay)
+
+    def refresh(self):
+        """Applies the files added to or removed from the folder since it was
+        listed, without listing it again from scratch."""
+
+        if self.folder_path is None:
+            return
+        if self.scan_worker is not None or self.refresh_worker is not None:
+            self._refresh_pending = True
+            return
+
+        self.refresh_worker = diff_folder_worker(
+            self.folder_path, set(self.list_model.names), self.file_extensions, self.models)
+        self.refresh_worker.returned.connect(self._on_refresh_returned)
+        self.refresh_worker.finished.connect(self._on_refresh_finished)
+        self.refresh_worker.start()
+
+    def _on_refresh_returned(self, diff):
+
+        if diff is None:
+            # the folder is gone, its files are not listed anymore
+            self.list_model.remove_names(list(self.list_model.names))
+            return
+        added, removed = diff
+        self.list_model.remove_names(removed)
+        self.list_model.add_entries(added)
+
+    def _on_refresh_finished(self):
+
+        self.refresh_worker = None
+        if self._refresh_pending:
+            self._refresh_pending = False
+            self.refresh()
+
+    def wait_for_scan(self):
+        """Blocks until the folder scan has finished."""
+
+        wait_for_worker(self, 'scan_worker')
+
     def addFileEvent(self):
         pass
 
     def select_first_file(self):
-        
+
         self.setCurrentRow(0)
-    
\ No newline at end of file
@@ -0,0 +1,82 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from .utils import compact_mask
+
+
+def read_georeference(image_path):
+    """
+    Read the projection and geotransform of a (Geo)TIFF with GDAL.
+
+    Parameters
+    ----------
+    image_path : str or Path
+        Path to the raster.
+
+    Returns
+    -------
+    georef : tuple or None
+        (projection, geotransform) or None if the raster could not be read
+        or has no projection.
+    """
+
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    try:
+        dataset = gdal.Open(str(image_path))
+        projection = dataset.GetProjection()
+        geotransform = dataset.GetGeoTransform()
+        dataset = None
+    except RuntimeError:
+        return None
+    if not projection:
+        return None
+    return projection, geotransform
+
+
+def write_georeferenced_mask(output_path, mask, georef):
+    """
+    Write a label mask as compressed, tiled GeoTIFF with the projection and
+    geotransform embedded, so that the file does not need to be opened again
+    to be georeferenced. As for other predictions, the mask is relabeled
+    sequentially and stored with the smallest possible unsigned type.
+
+    Parameters
+    ----------
+    output_path : str or Path
+        Path of the GeoTIFF to create.
+    mask : numpy.ndarray
+        2D label mask.
+    georef : tuple
+        (projection, geotransform) as returned by read_georeference.
+    """
+
+    from osgeo import gdal, gdal_array
+    gdal.UseExceptions()
+
+    projection, geotransform = georef
+    mask = compact_mask(mask)
+    if mask.dtype == np.uint64:
+        # not supported by all GDAL versions
+        mask = mask.astype(np.uint32)
+    gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(mask.dtype)
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(
+        str(output_path), mask.shape[1], mask.shape[0], 1, gdal_type,
+        options=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=2'])
+    dataset.SetProjection(projection)
+    dataset.SetGeoTransform(geotransform)
+    dataset.GetRasterBand(1).WriteArray(mask)
+    dataset.FlushCache()
+    dataset = None
+
+
+def copy_world_file(image_path, output_path):
+    """Copy the .tfw world file of image_path next to output_path if it exists."""
+
+    src_tfw = Path(image_path).with_suffix('.tfw')
+    if src_tfw.exists():
+        shutil.copy(src_tfw, Path(output_path).with_suffix('.tfw'))
@@ -0,0 +1,172 @@
+import os
+import shutil
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from natsort import natsorted
+
+STORE_NAME = 'grains.parquet'
+SCALED_STORE_NAME = 'grains_re_scaled.parquet'
+PART_NAME = 'grains.parquet'
+
+
+class GrainTableStore:
+    """Columnar Parquet store holding the grain tables of a dataset.
+
+    The grain table of each image is a Parquet file in its own file_id
+    partition, so that tables are written or replaced per image without
+    rewriting the others. Any subset of images and columns of the dataset
+    is read in one go as an Arrow dataset: partitions are pruned by file_id,
+    row groups by the statistics of filtered columns and files are memory
+    mapped. Requires the optional pyarrow package.
+
+    Layout::
+
+        grains.parquet/
+            file_id={file_id}/grains.parquet
+
+    where file_id is the name of the grain file (csv) the table was read
+    from or written with, e.g. {mask_name}_grains. The grain files remain the
+    reference: a table is only current if it was written after its grain file
+    (see is_current).
+
+    Parameters
+    ----------
+    folder: str or Path
+        Folder in which the store is located. A path ending with .parquet is
+        used as store path directly.
+    scaled: bool
+        Use the store of grain tables scaled to physical units.
+    """
+
+    def __init__(self, folder, scaled=False):
+        try:
+            import pyarrow
+            import pyarrow.dataset
+            import pyarrow.fs
+            import pyarrow.parquet
+        except ModuleNotFoundError as e:
+            raise ModuleNotFoundError(
+                "The grain store requires pyarrow. Install it with 'pip install pyarrow'.") from e
+        self._pa = pyarrow
+
+        self.path = self.store_path(folder, scaled)
+
+    @staticmethod
+    def store_path(folder, scaled=False):
+        """Returns the path of the store of folder."""
+
+        folder = Path(folder)
+        if folder.suffix == '.parquet':
+            return folder
+        return folder.joinpath(SCALED_STORE_NAME if scaled else STORE_NAME)
+
+    @staticmethod
+    def exists(folder, scaled=False):
+        """Returns True if folder contains a grain store."""
+
+        return GrainTableStore.store_path(folder, scaled).is_dir()
+
+    def _part_path(self, file_id):
+        return self.path.joinpath(f'file_id={quote(str(file_id), safe="")}', PART_NAME)
+
+    def write_grains(self, file_id, grains):
+        """Stores the grain table (DataFrame) of one image, replacing the
+        previous table of that image."""
+
+        grains = grains.drop(columns=[x for x in grains.columns
+                                      if str(x) in ('', 'file_id') or str(x).startswith('Unnamed:')])
+        table = self._pa.Table.from_pandas(grains, preserve_index=False)
+        part_path = self._part_path(file_id)
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        # readers never see a partially written table
+        tmp_path = part_path.with_name(f'.{PART_NAME}.tmp')
+        self._pa.parquet.write_table(table, tmp_path)
+        os.replace(tmp_path, part_path)
+
+    def is_current(self, file_id, grain_file):
+        """Returns True if the table of file_id exists and was written after
+        the grain file was last modified."""
+
+        try:
+            return self._part_path(file_id).stat().st_mtime_ns >= Path(grain_file).stat().st_mtime_ns
+        except OSError:
+            return False
+
+    def remove(self, file_id):
+        """Removes the grain table of one image."""
+
+        shutil.rmtree(self._part_path(file_id).parent, ignore_errors=True)
+
+    def file_ids(self):
+        """Returns the naturally sorted ids of all stored grain tables."""
+
+        if not self.path.is_dir():
+            return []
+        file_ids = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.startswith('file_id=') and os.path.isfile(os.path.join(entry.path, PART_NAME)):
+                    file_ids.append(unquote(entry.name[len('file_id='):]))
+        return natsorted(file_ids)
+
+    def dataset(self, file_ids=None):
+        """Returns the stored tables of file_ids (by default all) as a
+        pyarrow dataset with a file_id partition column."""
+
+        pa = self._pa
+        if file_ids is None:
+            file_ids = self.file_ids()
+        paths = [str(self._part_path(x)) for x in file_ids]
+        partitioning = pa.dataset.partitioning(pa.schema([('file_id', pa.string())]), flavor='hive')
+        return pa.dataset.dataset(
+            paths, format='parquet', partitioning=partitioning,
+            partition_base_dir=str(self.path),
+            filesystem=pa.fs.LocalFileSystem(use_mmap=True))
+
+    def read(self, file_ids=None, columns=None, filters=None):
+        """
+        Reads the grain tables of several images into a single DataFrame.
+
+        Parameters
+        ----------
+        file_ids: list, optional
+            Images to read, by default all.
+        columns: list, optional
+            Columns to read, by default all. The file_id column is always read.
+        filters: list or pyarrow.dataset.Expression, optional
+            Grains to read, e.g. [('area', '>', 100)], in the filters format
+            of pyarrow.parquet.read_table. Row groups whose statistics exclude
+            the filter are not read.
+
+        Returns
+        -------
+        grains : pandas.DataFrame
+            Grains with a file_id column, in the order of file_ids and indexed
+            by grain within each image like separately read tables.
+        """
+
+        pa = self._pa
+        dataset = self.dataset(file_ids)
+        if columns is not None:
+            columns = [x for x in columns if x != 'file_id'] + ['file_id']
+        if filters is not None and not isinstance(filters, pa.dataset.Expression):
+            filters = pa.parquet.filters_to_expression(filters)
+        grains = dataset.to_table(columns=columns, filter=filters).to_pandas()
+
+        # file_id as last column like tables loaded from csv files
+        grains['file_id'] = grains.pop('file_id').astype(object)
+        grains.index = grains.groupby('file_id', sort=False).cumcount().to_numpy()
+        return grains
+
+
+def open_grain_store(folder, scaled=False):
+    """Returns the grain store of folder, or None if there is none or pyarrow
+    is not installed."""
+
+    if folder is None or not GrainTableStore.exists(folder, scaled):
+        return None
+    try:
+        return GrainTableStore(folder, scaled)
+    except ModuleNotFoundError:
+        return None
@@ -0,0 +1,196 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+from skimage import io
+
+from .lru_cache import LRUCache
+
+
+def read_layer_data(path):
+    """Reads a file with the napari reader plugins as viewer.open does.
+
+    Returns a list of (data, kwargs, layer_type) tuples, where kwargs holds
+    the layer attributes set by the reader, e.g. scale or metadata. Files that
+    no reader plugin accepts are decoded as a single image with scikit-image.
+    """
+
+    from napari.plugins.io import read_data_with_plugins
+
+    try:
+        layer_data, _ = read_data_with_plugins([str(path)], stack=False)
+    except ValueError:
+        layer_data = None
+    if not layer_data:
+        layer_data = [(np.asarray(io.imread(path)),)]
+
+    result = []
+    for item in layer_data:
+        data = item[0]
+        if isinstance(data, np.ndarray):
+            data.setflags(write=False)
+        result.append((data, dict(item[1]) if len(item) > 1 else {},
+                       item[2] if len(item) > 2 else 'image'))
+    return result
+
+
+def _entry_nbytes(entry):
+    """Returns the size of an array or of the data of layer data tuples."""
+
+    if isinstance(entry, np.ndarray):
+        return entry.nbytes
+    nbytes = 0
+    for data, _, _ in entry:
+        # multiscale data is a list of arrays
+        for level in (data if isinstance(data, (list, tuple)) else [data]):
+            nbytes += getattr(level, 'nbytes', 0)
+    return nbytes
+
+
+class ImageCache:
+    """Byte-budgeted LRU cache of decoded images and masks.
+
+    Arrays are identified by the resolved path and modification time of
+    their file, so that a file changed on disk is decoded again. Files can be
+    prefetched, i.e. decoded ahead of time in background threads, e.g. the
+    neighbors of the selected entry of an image list. Images to display are
+    read as layer data with the napari reader plugins (see read_layer_data),
+    masks and other arrays with scikit-image.
+
+    Parameters
+    ----------
+    max_bytes: int
+        Maximum total size of the cached arrays.
+    io_threads: int
+        Number of threads used to prefetch files.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, io_threads=2):
+        self._arrays = LRUCache(max_bytes, sizeof=_entry_nbytes)
+        # files being decoded, guarded by _lock
+        self._pending = {}
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=io_threads)
+
+    @staticmethod
+    def make_key(path, layer_data=False):
+        """Returns the cache key of the file in path, read as array or as
+        layer data."""
+
+        path = Path(path).resolve()
+        key = (str(path), path.stat().st_mtime_ns)
+        return key + ('layer_data',) if layer_data else key
+
+    def get(self, path):
+        """Returns the decoded array of the file in path. The file is only
+        decoded if it is not cached, waiting for it if it is being prefetched.
+        Returned arrays are shared and read-only, copy them to edit them."""
+
+        return self._get(self.make_key(path))
+
+    def get_layer_data(self, path):
+        """Returns the file in path read with the napari reader plugins as a
+        list of (data, kwargs, layer_type) tuples, see get and read_layer_data."""
+
+        return self._get(self.make_key(path, layer_data=True))
+
+    def _get(self, key):
+
+        with self._lock:
+            entry = self._arrays.get(key)
+            if entry is not None:
+                return entry
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        return self._load(key)
+
+    def prefetch(self, paths, layer_data=False):
+        """Decodes files in the background if they are not cached yet. paths
+        can contain paths or callables returning a path (or None), which are
+        also evaluated in the background, e.g. to look up a matching mask.
+        With layer_data, files are read as by get_layer_data."""
+
+        for path in paths:
+            if path is None:
+                continue
+            self._executor.submit(self._prefetch, path, layer_data)
+
+    def _prefetch(self, path, layer_data=False):
+
+        if callable(path):
+            path = path()
+            if path is None:
+                return
+        try:
+            key = self.make_key(path, layer_data)
+        except OSError:
+            return
+        with self._lock:
+            if key in self._arrays or key in self._pending:
+                return
+        # read errors are raised again when the file is requested
+        with suppress(OSError, ValueError):
+            self._load(key)
+
+    def _load(self, key):
+
+        future = Future()
+        with self._lock:
+            if key in self._pending:
+                future = None
+                pending = self._pending[key]
+            else:
+                self._pending[key] = future
+        if future is None:
+            return pending.result()
+
+        try:
+            if len(key) > 2:
+                entry = read_layer_data(key[0])
+            else:
+                entry = np.asarray(io.imread(key[0]))
+                entry.setflags(write=False)
+        except Exception as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            if key not in self._arrays:
+                self._arrays.put(key, entry)
+        future.set_result(entry)
+        return entry
+
+    def set_max_bytes(self, max_bytes):
+        """Changes the byte budget, evicting the least recently used arrays if
+        necessary."""
+
+        self._arrays.set_max_size(max_bytes)
+
+    def clear(self):
+        self._arrays.clear()
+
+    @property
+    def max_bytes(self):
+        return self._arrays.max_size
+
+    @property
+    def nbytes(self):
+        return self._arrays.size
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, path):
+        try:
+            return self.make_key(path) in self._arrays
+        except OSError:
+            return False
+
+
+# images of the lists of the processing and statistics widgets
+image_cache = ImageCache()
@@ -6,12 +6,15 @@ import napari
 from typing import TYPE_CHECKING
 
 from qtpy.QtWidgets import (QWidget, QVBoxLayout, QGroupBox,
-                            QHBoxLayout, QGridLayout, QLabel, QPushButton)
+                            QHBoxLayout, QGridLayout, QLabel, QPushButton,
+                            QProgressBar, QMessageBox)
 from magicgui.widgets import create_widget
-
-from imagegrains import data_loader
+from napari.qt.threading import thread_worker
+from cellpose import version
 
 from .imgr_proc_widget import ImageGrainProcWidget
+from .downloader import iter_demo_data_download
+from .utils import wait_for_worker
 
 class ImageGrainDemoWidget(QWidget):
     def __init__(self, viewer: "napari.viewer.Viewer"):
@@ -22,6 +25,8 @@ class ImageGrainDemoWidget(QWidget):
 
         # Mute dialog box notifications 
         self.supress_notifications = False
+        # background worker of the running download
+        self.download_worker = None
 
         self.main_layout = QVBoxLayout()
         self.setLayout(self.main_layout)
@@ -37,6 +42,11 @@ class ImageGrainDemoWidget(QWidget):
         self.demodata_group.glayout.addWidget(self.lbl_select_download_directory, 0, 0, 1, 1)
         self.demodata_group.glayout.addWidget(self.demodata_directory.native, 0, 1, 1, 1)
         self.demodata_group.glayout.addWidget(self.btn_download_demodata, 1, 0, 1, 2)
+        self.lbl_download_progress = QLabel("Download progress")
+        self.demodata_group.glayout.addWidget(self.lbl_download_progress, 2, 0, 1, 2)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setValue(0)
+        self.demodata_group.glayout.addWidget(self.progress_bar, 3, 0, 1, 2)
     
         self.add_connections()
 
@@ -48,15 +58,75 @@ class ImageGrainDemoWidget(QWidget):
     
 
     def _on_click_download_demodata(self):
-        """Downloads the demo data from Github"""
+        """Downloads the demo data from Github and the models from Zenodo. Files
+        are downloaded concurrently in a background thread, files already
+        present are skipped. The processing widget is opened once done."""
+
+        if self.download_worker is not None:
+            return
 
         self.custom_download_path = self.demodata_directory.value
 
         if self.custom_download_path == self.default_download_path:
             if not os.path.exists(self.default_download_path):
                 os.makedirs(self.default_download_path)
-        
-        data_loader.download_files(self.custom_download_path)
+
+        self.progress_bar.setValue(0)
+        self.download_worker = download_demo_data_worker(
+            tar_path=self.custom_download_path,
+            cp_version=int(str(version).split(".")[0]))
+        self.download_worker.yielded.connect(self._on_download_progress)
+        self.download_worker.returned.connect(self._on_download_returned)
+        self.download_worker.errored.connect(self._on_download_errored)
+        self.download_worker.finished.connect(self._on_download_finished)
+        self.btn_download_demodata.setEnabled(False)
+        self.download_worker.start()
+
+        return self.download_worker
+
+    def _on_download_progress(self, progress):
+        """Updates the progress bar with the aggregated progress of all files."""
+
+        self.lbl_download_progress.setText(f"Download progress ({progress.files_done}/{progress.files_total} files)")
+        if progress.total:
+            self.progress_bar.setValue(int(100 * progress.done / progress.total))
+
+    def _on_download_returned(self, failed):
+
+        if failed and not self.supress_notifications:
+            self.notify_user("Download incomplete", f"Could not download {len(failed)} file(s): "
+                             + ", ".join(url for url, _ in failed))
+        self.open_processing_widget()
+
+    def _on_download_errored(self, error):
+
+        if not self.supress_notifications:
+            self.notify_user("Download failed", f"Could not download demo data: {error}")
+
+    def _on_download_finished(self):
+
+        self.download_worker = None
+        self.btn_download_demodata.setEnabled(True)
+        self.progress_bar.setValue(100)
+
+    def wait_for_download(self):
+        """Blocks until the running download has finished."""
+
+        wait_for_worker(self, 'download_worker')
+
+    def notify_user(self, message_title, message):
+        """
+        Generates a pop up message box an notifies the user with a message.
+        """
+        msg_box = QMessageBox()
+        msg_box.setIcon(QMessageBox.Warning)
+        msg_box.setWindowTitle(str(message_title))
+        msg_box.setText(str(message))
+        msg_box.setStandardButtons(QMessageBox.Ok)
+        msg_box.exec_()
+
+    def open_processing_widget(self):
+        """Opens the processing widget on the downloaded demo data."""
 
         viewer = napari.current_viewer()
         self.widget = ImageGrainProcWidget(viewer=viewer)
@@ -79,6 +149,10 @@ class ImageGrainDemoWidget(QWidget):
 
 
 
+# demo data download running in a background thread
+download_demo_data_worker = thread_worker(iter_demo_data_download)
+
+
 class VHGroup():
     """Group box with specific layout.
 
@@ -4,30 +4,50 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 from typing import TYPE_CHECKING
 from pathlib import Path
 import webbrowser
-import shutil
+from collections import deque
+from contextlib import closing
+from functools import partial
+from threading import Event
+from warnings import warn
 import torch
 
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 from qtpy.QtWidgets import (QVBoxLayout, QTabWidget, QPushButton,
                             QWidget, QFileDialog,  QLineEdit, QGroupBox,
                             QHBoxLayout, QGridLayout, QLabel, QCheckBox,
-                            QProgressBar, QRadioButton, QMessageBox, QScrollArea)
+                            QProgressBar, QRadioButton, QMessageBox, QScrollArea,
+                            QSpinBox, QDoubleSpinBox)
 from superqt import QLabeledSlider
 from qtpy.QtWidgets import QSizePolicy
 from magicgui.widgets import create_widget
+from napari.qt.threading import thread_worker
+from napari.layers import Image
 
-from imagegrains.segmentation_helper import eval_set, predict_single_image #keep_tif_crs, map_preds_to_imgs
 from imagegrains import data_loader, plotting #after imagegrains v2: __cp_version__
 
-from cellpose import models, io, core, version
+from cellpose import io, core, version
 from napari_matplotlib.base import NapariMPLWidget
 
 import pandas as pd
 import numpy as np
-import requests
+import dask.array as da
+from dask import delayed
+import tifffile
 
 from .folder_list_widget import FolderList
-from .utils import find_match_in_folder, compute_average_ap
+from .access_single_image_widget import predict_images, predict_preview
+from .model_cache import model_cache
+from .flow_cache import flow_cache, compute_masks_from_flows
+from .image_cache import image_cache
+from .downloader import model_download_url, iter_model_download
+from .utils import (find_match_in_folder, compute_average_ap, save_mask, show_in_layer,
+                    show_layer_data, clear_other_layers, wait_for_worker)
+from .run_manifest import RunManifest, model_identity
+from .prediction_store import PredictionStore, open_prediction_store
+from .evaluation_cache import evaluation_cache, save_evaluation
+from .folder_index import folder_index_cache
+from .batch import (segment_folder, segment_folder_multiprocess,
+                    list_images, is_processed_image)
 
 if TYPE_CHECKING:
     import napari
@@ -39,11 +59,46 @@ class ImageGrainProcWidget(QWidget):
         self.viewer = viewer
 
         self.image_path = None
+        # layers displaying the selected image and its prediction, reused
+        # when the selection changes
+        self.image_layer = None
+        self.mask_layer = None
 
         # specifies whether current perf plot is for a dataset or a single image
         self.performance_plot_type = None
         self.mAP = None
 
+        # flows of the last single image prediction and its labels layer, used
+        # to recompute masks when thresholds change
+        self.single_flow_key = None
+        self.single_pred_layer = None
+
+        # background worker of the running model download
+        self.model_download_worker = None
+
+        # low resolution preview of the diameter slider
+        self.preview_worker = None
+        self.preview_pending = False
+        self.preview_layer = None
+
+        # background worker of the running folder segmentation
+        self.folder_worker = None
+        # set to stop the running folder segmentation after the current image
+        self.folder_stop = Event()
+        self.folder_paused = False
+        self.folder_store = None
+        self.folder_manifest = None
+        self.georef_failed = []
+        # display of folder segmentation results
+        self.folder_display = 'all'
+        self.folder_displayed_layers = deque()
+        self.folder_lazy_entries = []
+        # number of images decoded ahead and threads used to read them
+        self.read_ahead = 2
+        self.io_threads = 2
+        # margin in pixels read around each tile in tiled segmentation
+        self.tile_overlap = 256
+
         # Main widget and layout
         scroll = QScrollArea(self)
         scroll.setWidgetResizable(True)
@@ -91,13 +146,16 @@ class ImageGrainProcWidget(QWidget):
         # self.model_download_group.glayout.addWidget(self.local_directory_model_path_display,  1, 1, 1, 1)
         self.model_download_group.glayout.addWidget(self.local_directory_model_path_display.native,  1, 1, 1, 2)
         self.model_download_group.glayout.addWidget(self.btn_download_model, 2, 0, 1, 3)
+        self.model_download_progress = QProgressBar()
+        self.model_download_progress.setValue(0)
+        self.model_download_group.glayout.addWidget(self.model_download_progress, 3, 0, 1, 3)
 
         label_widget = QLabel('<a href="https://github.com/dmair1989/imagegrains/blob/main/notebooks/4_train_cellpose_model.ipynb">To train your own model check here</a>')
         label_widget.setTextFormat(Qt.RichText)
         label_widget.setTextInteractionFlags(Qt.TextBrowserInteraction)
         label_widget.setOpenExternalLinks(True)
         #label_widget.native.setStyleSheet("QLabel { color : blue; }")
-        self.model_download_group.glayout.addWidget(label_widget, 3, 0, 1, 3)
+        self.model_download_group.glayout.addWidget(label_widget, 4, 0, 1, 3)
 
 
         ### Elements "Model selection" ###
@@ -134,6 +192,34 @@ class ImageGrainProcWidget(QWidget):
         self.btn_run_segmentation_on_single_image.setToolTip("Run segmentation on current image")
         self.single_image_segmentation_group.glayout.addWidget(self.btn_run_segmentation_on_single_image)
 
+        ##### Mask reconstruction parameters
+        self.mask_param_group = VHGroup('', orientation='G')
+        self.mask_param_group.glayout.addWidget(QLabel("Cell prob. threshold"), 0, 0, 1, 1)
+        self.spinbox_cellprob_threshold = QDoubleSpinBox()
+        self.spinbox_cellprob_threshold.setToolTip("Pixels with a cell probability above the threshold are used for masks")
+        self.spinbox_cellprob_threshold.setRange(-6.0, 6.0)
+        self.spinbox_cellprob_threshold.setSingleStep(0.5)
+        self.spinbox_cellprob_threshold.setValue(0.0)
+        self.spinbox_cellprob_threshold.setKeyboardTracking(False)
+        self.mask_param_group.glayout.addWidget(self.spinbox_cellprob_threshold, 0, 1, 1, 1)
+        self.mask_param_group.glayout.addWidget(QLabel("Flow threshold"), 1, 0, 1, 1)
+        self.spinbox_flow_threshold = QDoubleSpinBox()
+        self.spinbox_flow_threshold.setToolTip("Maximum flow error of a mask. Increase to keep more masks")
+        self.spinbox_flow_threshold.setRange(0.0, 3.0)
+        self.spinbox_flow_threshold.setSingleStep(0.1)
+        self.spinbox_flow_threshold.setValue(0.4)
+        self.spinbox_flow_threshold.setKeyboardTracking(False)
+        self.mask_param_group.glayout.addWidget(self.spinbox_flow_threshold, 1, 1, 1, 1)
+        self.mask_param_group.glayout.addWidget(QLabel("Min. grain size"), 2, 0, 1, 1)
+        self.spinbox_min_size = QSpinBox()
+        self.spinbox_min_size.setToolTip("Masks with fewer pixels are removed")
+        self.spinbox_min_size.setRange(0, 100000)
+        self.spinbox_min_size.setValue(15)
+        self.spinbox_min_size.setSuffix(" px")
+        self.spinbox_min_size.setKeyboardTracking(False)
+        self.mask_param_group.glayout.addWidget(self.spinbox_min_size, 2, 1, 1, 1)
+        self.single_image_segmentation_group.glayout.addWidget(self.mask_param_group.gbox)
+
         ##### Save manually processed mask button
         self.btn_save_manually_processed_mask = QPushButton("Save manually processed mask")
         self.btn_save_manually_processed_mask.setToolTip("Save manually processed mask")
@@ -181,10 +267,52 @@ class ImageGrainProcWidget(QWidget):
         self.qls_expected_median_diameter.setVisible(False)
         self.segmentation_option_group.glayout.addWidget(self.qls_expected_median_diameter, 1, 2, 1, 1)
 
+        self.check_preview_diameter = QCheckBox('Preview diameter')
+        self.check_preview_diameter.setToolTip("Segment a low resolution copy of the current image when the diameter changes")
+        self.check_preview_diameter.setChecked(False)
+        self.check_preview_diameter.setVisible(False)
+        self.segmentation_option_group.glayout.addWidget(self.check_preview_diameter, 5, 0, 1, 1)
+        self.combobox_preview_region = create_widget(value='whole image',
+                                                     options={'choices': ['whole image', 'viewport']},
+                                                     widget_type='ComboBox')
+        self.combobox_preview_region.native.setToolTip("Region of the image used for the preview")
+        self.combobox_preview_region.native.setVisible(False)
+        self.segmentation_option_group.glayout.addWidget(self.combobox_preview_region.native, 5, 1, 1, 1)
+        self.spinbox_preview_size = QSpinBox()
+        self.spinbox_preview_size.setToolTip("Maximum size of the preview image, the region is subsampled to fit it")
+        self.spinbox_preview_size.setRange(128, 4096)
+        self.spinbox_preview_size.setSingleStep(128)
+        self.spinbox_preview_size.setValue(768)
+        self.spinbox_preview_size.setSuffix(" px")
+        self.spinbox_preview_size.setVisible(False)
+        self.segmentation_option_group.glayout.addWidget(self.spinbox_preview_size, 5, 2, 1, 1)
+        self.btn_confirm_preview = QPushButton("Run full resolution")
+        self.btn_confirm_preview.setToolTip("Segment the selected image at full resolution with the previewed diameter")
+        self.btn_confirm_preview.setVisible(False)
+        self.segmentation_option_group.glayout.addWidget(self.btn_confirm_preview, 6, 0, 1, 1)
+
+        # restarted at each slider change so that only the last value is previewed
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(400)
+
         self.check_use_georef = QCheckBox('Use georeferencing (requires GDAL)')
         self.check_use_georef .setChecked(False)
         self.segmentation_option_group.glayout.addWidget(self.check_use_georef, 2, 2, 1, 1)
 
+        self.check_tiled_segmentation = QCheckBox('Tiled segmentation of large .tif (requires GDAL)')
+        self.check_tiled_segmentation.setToolTip("Segment large GeoTIFFs tile by tile. Predictions are saved but not displayed.")
+        self.check_tiled_segmentation.setChecked(False)
+        self.segmentation_option_group.glayout.addWidget(self.check_tiled_segmentation, 4, 0, 1, 2)
+        self.spinbox_tile_size = QSpinBox()
+        self.spinbox_tile_size.setToolTip("Size of the tiles in pixels")
+        self.spinbox_tile_size.setRange(256, 16384)
+        self.spinbox_tile_size.setSingleStep(256)
+        self.spinbox_tile_size.setValue(2048)
+        self.spinbox_tile_size.setSuffix(" px")
+        self.spinbox_tile_size.setEnabled(False)
+        self.segmentation_option_group.glayout.addWidget(self.spinbox_tile_size, 4, 2, 1, 1)
+
 
         ### Elements "Run segmentation" ###
         self.folder_segmentation_group = VHGroup('Folder segmentation', orientation='G')
@@ -199,6 +327,69 @@ class ImageGrainProcWidget(QWidget):
         self.progress_bar.setValue(0)
         self.folder_segmentation_group.glayout.addWidget(self.progress_bar)
 
+        self.folder_segmentation_group.glayout.addWidget(QLabel("Display during folder segmentation"))
+        self.combobox_folder_display = create_widget(value='all',
+                                                     options={'choices': ['all', 'none', 'last N', 'lazy stack']},
+                                                     widget_type='ComboBox')
+        self.combobox_folder_display.native.setToolTip("all: keep every image and prediction, none: only save predictions, "
+                                                       "last N: keep the N most recent ones, lazy stack: browse saved results read from disk on demand")
+        self.folder_segmentation_group.glayout.addWidget(self.combobox_folder_display.native)
+        self.spinbox_display_last_n = QSpinBox()
+        self.spinbox_display_last_n.setToolTip("Number of images kept in the viewer")
+        self.spinbox_display_last_n.setRange(1, 100)
+        self.spinbox_display_last_n.setValue(5)
+        self.spinbox_display_last_n.setPrefix("N = ")
+        self.spinbox_display_last_n.setVisible(False)
+        self.folder_segmentation_group.glayout.addWidget(self.spinbox_display_last_n)
+
+        self.check_skip_segmented = QCheckBox('Skip up-to-date predictions')
+        self.check_skip_segmented.setToolTip("Only segment images that are new or changed since the predictions "
+                                             "in the target folder were saved with the same model and options")
+        self.check_skip_segmented.setChecked(False)
+        self.folder_segmentation_group.glayout.addWidget(self.check_skip_segmented)
+
+        self.check_save_zarr = QCheckBox('Also save to Zarr store (requires zarr)')
+        self.check_save_zarr.setToolTip("Write masks and flows to predictions.zarr in the prediction folder")
+        self.check_save_zarr.setChecked(False)
+        self.folder_segmentation_group.glayout.addWidget(self.check_save_zarr)
+
+        self.check_multiprocess = QCheckBox('Use multiple CPU processes')
+        self.check_multiprocess.setToolTip("Segment images in parallel processes when running on CPU. "
+                                           "The CPU cores are shared between the processes.")
+        self.check_multiprocess.setChecked(False)
+        self.folder_segmentation_group.glayout.addWidget(self.check_multiprocess)
+        self.spinbox_num_processes = QSpinBox()
+        self.spinbox_num_processes.setToolTip("Number of processes")
+        self.spinbox_num_processes.setRange(1, max(1, os.cpu_count() or 1))
+        self.spinbox_num_processes.setValue(min(2, max(1, os.cpu_count() or 1)))
+        self.spinbox_num_processes.setSuffix(" processes")
+        self.spinbox_num_processes.setEnabled(False)
+        self.folder_segmentation_group.glayout.addWidget(self.spinbox_num_processes)
+
+        self.check_batch_images = QCheckBox('Batch images of same size')
+        self.check_batch_images.setToolTip("Segment consecutive images of identical size together as one stacked array")
+        self.check_batch_images.setChecked(False)
+        self.folder_segmentation_group.glayout.addWidget(self.check_batch_images)
+        self.spinbox_batch_memory = QSpinBox()
+        self.spinbox_batch_memory.setToolTip("Maximum memory used by the images of one batch")
+        self.spinbox_batch_memory.setRange(100, 64000)
+        self.spinbox_batch_memory.setSingleStep(100)
+        self.spinbox_batch_memory.setValue(1000)
+        self.spinbox_batch_memory.setSuffix(" MB")
+        self.spinbox_batch_memory.setEnabled(False)
+        self.folder_segmentation_group.glayout.addWidget(self.spinbox_batch_memory)
+
+        self.folder_control_group = VHGroup('', orientation='H')
+        self.btn_pause_folder_segmentation = QPushButton("Pause")
+        self.btn_pause_folder_segmentation.setToolTip("Pause or resume folder segmentation after the current image")
+        self.btn_pause_folder_segmentation.setEnabled(False)
+        self.folder_control_group.glayout.addWidget(self.btn_pause_folder_segmentation)
+        self.btn_cancel_folder_segmentation = QPushButton("Cancel")
+        self.btn_cancel_folder_segmentation.setToolTip("Stop folder segmentation after the current image")
+        self.btn_cancel_folder_segmentation.setEnabled(False)
+        self.folder_control_group.glayout.addWidget(self.btn_cancel_folder_segmentation)
+        self.folder_segmentation_group.glayout.addWidget(self.folder_control_group.gbox)
+
 
 
         # performance tab
@@ -267,12 +458,24 @@ class ImageGrainProcWidget(QWidget):
         self.btn_run_segmentation_on_single_image.clicked.connect(self._on_click_segment_single_image)
         self.btn_save_manually_processed_mask.clicked.connect(self._on_click_save_manually_processed_mask)
         self.btn_run_segmentation_on_folder.clicked.connect(self._on_click_segment_image_folder)
+        self.btn_pause_folder_segmentation.clicked.connect(self._on_click_pause_folder_segmentation)
+        self.check_batch_images.toggled.connect(self.spinbox_batch_memory.setEnabled)
+        self.check_tiled_segmentation.toggled.connect(self.spinbox_tile_size.setEnabled)
+        self.check_multiprocess.toggled.connect(self.spinbox_num_processes.setEnabled)
+        self.combobox_folder_display.changed.connect(self._on_change_folder_display)
+        self.btn_cancel_folder_segmentation.clicked.connect(self._on_click_cancel_folder_segmentation)
         self.btn_compute_performance_single_image.clicked.connect(self._on_click_compute_performance_single_image)
         self.btn_compute_performance_folder.clicked.connect(self._on_click_compute_performance_folder)
         self.btn_save_average_precision.clicked.connect(self._on_save_average_precision)
         self.btn_save_performance_plot.clicked.connect(self._on_save_performance_plot)
         self.qls_expected_median_diameter.valueChanged.connect(self._on_slider_change)
         self.check_change_diameter.stateChanged.connect(self._on_check_toggle_visibility)
+        self.check_preview_diameter.toggled.connect(self._on_toggle_preview_diameter)
+        self.preview_timer.timeout.connect(self._run_preview_segmentation)
+        self.btn_confirm_preview.clicked.connect(self._on_click_confirm_preview)
+        self.spinbox_cellprob_threshold.valueChanged.connect(self._on_change_mask_params)
+        self.spinbox_flow_threshold.valueChanged.connect(self._on_change_mask_params)
+        self.spinbox_min_size.valueChanged.connect(self._on_change_mask_params)
 
 
     def _on_click_goto_zenodo(self):
@@ -291,53 +494,66 @@ class ImageGrainProcWidget(QWidget):
         if self.local_directory_model_path_display.value == "No local path":
              return False 
         
+        if self.model_download_worker is not None:
+            return False
+
         self.model_url_user = self.repo_model_path_display.text()
-        if "github.com" in self.model_url_user:
-            self.model_url_processed = self.model_url_user.replace("github.com", "raw.githubusercontent.com").replace("blob/", "")
-            self.model_name = (self.model_url_processed.split("/")[-1])
-            self.model_save_path = self.local_directory_model_path_display.value
-            content_in_bytes = requests.get(str(self.model_url_processed)).content
-            assert type(content_in_bytes) is bytes
-            with open(str(Path(self.model_save_path).joinpath(self.model_name)), 'wb') as f_out:
-                f_out.write(content_in_bytes)
-       
-        elif "zenodo.org" in self.model_url_user:
-            self.model_save_path = self.local_directory_model_path_display.value
-            self.model_url_processed = self.model_url_user
-            self.model_name = (self.model_url_processed.split("/")[-1].split("?")[0])
-            self.model_save_path = self.local_directory_model_path_display.value
-            content_in_bytes = requests.get(str(self.model_url_processed)).content
-            assert type(content_in_bytes) is bytes
-            with open(str(Path(self.model_save_path).joinpath(self.model_name)), 'wb') as f_out:
-                f_out.write(content_in_bytes)
-            
-            # if several models should be downloaded from zenodo at a time:
-            # self.model_file_extension = ".260325"
-            # try:
-            #     response = requests.get(self.model_url_processed)
-            #     response.raise_for_status()
-            # except requests.exceptions.RequestException as e:
-            #     print(f"{e}")
-
-            # data = response.json()
-            # files = data.get("files", [])
-
-            # for file in files:
-            #     self.model_name = file["key"]
-            #     self.model_actual_url = file["links"]["self"]
-            #     if self.model_file_extension is None or self.model_name.lower().endswith(self.model_file_extension.lower()):
-            #         try:
-            #             r = requests.get(self.model_actual_url, stream=True)
-            #             r.raise_for_status()
-
-            #             file_path = os.path.join(self.model_save_path, self.model_name)
-            #             with open(file_path, "wb") as f:
-            #                 for chunk in r.iter_content(chunk_size=8192): # file is downloaded in chunks of 8192 bytes (8kb)
-            #                     f.write(chunk)
-            #         except requests.exceptions.RequestException as e:
-            #             print(f"{e}")
+        try:
+            self.model_url_processed, model_name = model_download_url(self.model_url_user)
+        except ValueError as e:
+            self.notify_user("Message", str(e))
+            return False
+        # Zenodo record urls download all files of the record at once
+        if model_name is not None:
+            self.model_name = model_name
+        self.model_save_path = self.local_directory_model_path_display.value
+
+        # weights are streamed to disk in a background thread, verified and
+        # kept in the local download cache so that they are fetched only once
+        self.model_download_progress.setRange(0, 100)
+        self.model_download_progress.setValue(0)
+        self.model_download_worker = download_model_worker(
+            url=self.model_url_user, model_dir=self.model_save_path)
+        self.model_download_worker.yielded.connect(self._on_model_download_progress)
+        self.model_download_worker.returned.connect(self._on_model_download_returned)
+        self.model_download_worker.errored.connect(self._on_model_download_errored)
+        self.model_download_worker.finished.connect(self._on_model_download_finished)
+        self.btn_download_model.setEnabled(False)
+        self.model_download_worker.start()
+
+        return self.model_download_worker
+
+    def _on_model_download_progress(self, progress):
+        """Updates the download progress bar with (downloaded bytes, total bytes, ...)."""
+
+        done, total = progress[0], progress[1]
+        if total:
+            self.model_download_progress.setRange(0, 100)
+            self.model_download_progress.setValue(int(100 * done / total))
         else:
-            self.notify_user("Message", "So far, model to be downloaded needs to be on Zenodo or on Github.")
+            # unknown size, show busy indicator
+            self.model_download_progress.setRange(0, 0)
+
+    def _on_model_download_returned(self, failed):
+
+        if failed:
+            self.notify_user("Download failed", f"Could not download {len(failed)} file(s): "
+                             + ", ".join(url for url, _ in failed))
+
+    def _on_model_download_errored(self, error):
+
+        self.notify_user("Download failed", f"Could not download {self.model_url_user}: {error}")
+
+    def _on_model_download_finished(self):
+
+        self.model_download_worker = None
+        self.btn_download_model.setEnabled(True)
+        self.model_download_progress.setRange(0, 100)
+
+    def wait_for_model_download(self):
+        """Blocks until the running model download has finished."""
+
+        wait_for_worker(self, 'model_download_worker')
 
 
     def _on_click_select_image_folder(self):
@@ -362,9 +578,121 @@ class ImageGrainProcWidget(QWidget):
         """Reads the changed value of the expected median diameter slider"""
 
         self.expected_median_diameter = value
+        if self.check_preview_diameter.isChecked():
+            self.preview_timer.start()
+
+    def _on_toggle_preview_diameter(self, checked):
+        """Starts a preview of the current diameter or removes the preview."""
+
+        if checked:
+            self.preview_timer.start()
+        else:
+            self.preview_timer.stop()
+            self._remove_preview_layer()
+
+    def _remove_preview_layer(self):
+
+        if self.preview_layer is not None and self.preview_layer in self.viewer.layers:
+            self.viewer.layers.remove(self.preview_layer)
+        self.preview_layer = None
+
+    def _get_preview_region(self):
+        """Returns the image data of the preview region and its (row, column)
+        offset in the image, or None if no image is displayed."""
+
+        image_layers = [layer for layer in self.viewer.layers if isinstance(layer, Image)]
+        if self.image_path is None or len(image_layers) == 0:
+            return None
+        layer = image_layers[0]
+        data = layer.data[0] if layer.multiscale else layer.data
+        # only the displayed plane of a stack is read, e.g. of a lazy stack
+        point = layer.world_to_data(self.viewer.dims.point)
+        plane = tuple(min(max(int(round(point[i])), 0), data.shape[i] - 1)
+                      for i in range(layer.ndim - 2))
+        image = data[plane]
+        if self.combobox_preview_region.value != 'viewport':
+            return image, (0, 0)
+
+        # visible extent of the canvas (height, width) in image coordinates
+        zoom = self.viewer.camera.zoom
+        canvas_size = self.viewer.canvas.size
+        center = self.viewer.camera.center[-2:]
+        half_extent = [c / zoom / 2 for c in canvas_size]
+        start = [max(0, int(center[i] - half_extent[i])) for i in range(2)]
+        stop = [min(image.shape[i], int(center[i] + half_extent[i]) + 1) for i in range(2)]
+        if stop[0] <= start[0] or stop[1] <= start[1]:
+            return None
+        return image[start[0]:stop[0], start[1]:stop[1]], tuple(start)
+
+    def _run_preview_segmentation(self):
+        """Segments a subsampled copy of the preview region with the current
+        diameter in a background thread."""
+
+        if self.preview_worker is not None:
+            # segment again with the latest diameter once the running preview is done
+            self.preview_pending = True
+            return
+        region = self._get_preview_region()
+        if region is None or getattr(self, 'model_path', None) is None:
+            return
+        image, offset = region
+        step = max(1, int(np.ceil(max(image.shape[:2]) / self.spinbox_preview_size.value())))
+
+        # the model comes from the model cache, so it is only loaded for the first preview
+        model = self.initialize_model(notify_cpu=False)
+        if model is None:
+            self.check_preview_diameter.setChecked(False)
+            return
+        self.preview_worker = predict_preview_worker(
+            img=np.asarray(image), model=model, diameter=self.expected_median_diameter,
+            step=step, min_size=self.spinbox_min_size.value())
+        self.preview_worker.returned.connect(
+            lambda mask: self._on_preview_segmented(mask, step, offset))
+        self.preview_worker.errored.connect(self._on_preview_errored)
+        self.preview_worker.finished.connect(self._on_preview_finished)
+        self.preview_worker.start()
+
+    def _on_preview_segmented(self, mask, step, offset):
+        """Displays the preview mask scaled to the full resolution image."""
+
+        if not self.check_preview_diameter.isChecked():
+            return
+        if self.preview_layer is not None and self.preview_layer in self.viewer.layers:
+            self.preview_layer.data = mask
+            self.preview_layer.scale = (step, step)
+            self.preview_layer.translate = offset
+        else:
+            self.preview_layer = self.viewer.add_labels(
+                mask, name='diameter preview', scale=(step, step), translate=offset, opacity=0.5)
+
+    def _on_preview_errored(self, error):
+        """Stops the preview and reports the error of the preview segmentation."""
+
+        self.preview_pending = False
+        self.check_preview_diameter.setChecked(False)
+        self.notify_user("Preview Error", f"The diameter preview failed: {error}")
+
+    def _on_preview_finished(self):
+
+        self.preview_worker = None
+        if self.preview_pending:
+            self.preview_pending = False
+            self.preview_timer.start()
+
+    def _on_click_confirm_preview(self):
+        """Removes the preview and segments the image at full resolution."""
+
+        self.preview_timer.stop()
+        self.preview_pending = False
+        self._remove_preview_layer()
+        self._on_click_segment_single_image()
     
-    def initialize_model(self):
-        """Initializes the Cellpose model with more explicit exception handling"""
+    def initialize_model(self, notify_cpu=True):
+        """Initializes the Cellpose model with more explicit exception handling.
+        Models are taken from the process-wide model cache and only loaded from
+        disk if the weights were not loaded on the same device before. With
+        notify_cpu=False, the user is not told that the model runs on the CPU,
+        e.g. for the repeated preview segmentations."""
 
         if self.check_use_gpu.isChecked():
             if int(str(version).split(".")[0]) >3:
@@ -394,12 +722,13 @@ class ImageGrainProcWidget(QWidget):
             use_gpu = False
         try:
             model_path = self.model_path
-            model = models.CellposeModel(gpu=use_gpu, pretrained_model=str(model_path))
+            model = model_cache.get(model_path, gpu=use_gpu)
         except AttributeError:
             self.notify_user("Selection Required", "No model selected. Please select a model from the model list.")
             return
         except torch.cuda.OutOfMemoryError:
             #GPU memory can still be blocked for a long time, which will crash napari at end of call
+            model_cache.evict()
             torch.cuda.empty_cache()
             self.notify_user("OutOfMemoryError", "CUDA out of memory. Trying segmentation on CPU.")
             self.check_use_gpu.setChecked(False)
@@ -408,7 +737,7 @@ class ImageGrainProcWidget(QWidget):
             self.notify_user("Unexpected Error", "Could not load selected model. Try switching off the GPU option or re-installing the cellpose package.")
             return
 
-        if use_gpu == False:
+        if use_gpu == False and notify_cpu:
             if self.supress_notifications == False and int(str(version).split(".")[0]) >3:
                 self.notify_user("No GPU","Running Segmentation on CPU - Processing will be very slow!")
         return model
@@ -425,7 +754,11 @@ class ImageGrainProcWidget(QWidget):
             return
         image_path = self.image_path
 
-        model = self.initialize_model()
+        try:
+            flow_key = flow_cache.make_key(image_path, self.model_path, self.expected_median_diameter)
+        except AttributeError:
+            self.notify_user("Selection Required", "No model selected. Please select a model from the model list.")
+            return
 
         MODEL_ID = Path(self.model_name).stem
         img_id = Path(self.image_name).stem
@@ -439,13 +772,65 @@ class ImageGrainProcWidget(QWidget):
         else:
             TAR_DIR = self.pred_directory.value
 
-        self.mask_l, self.flow_l, self.styles_l = predict_single_image(
-            image_path=image_path, 
-            model=model, diameter=self.expected_median_diameter, mute=True,
-            return_results=True, save_masks=SAVE_MASKS,
-            tar_dir=TAR_DIR, model_id=MODEL_ID)
+        # the network only runs if the image was not predicted with the same
+        # model and diameter before, otherwise masks are rebuilt from the flows
+        cached = flow_cache.get(flow_key)
+        if cached is None:
+            model = self.initialize_model()
+            if model is None:
+                return
+            # thresholds are passed to model.eval explicitly as the config of
+            # imagegrains' predict_single_image is applied with exec
+            self.mask_l, self.flow_l, self.styles_l = predict_images(
+                imgs=[io.imread(str(image_path))], img_ids=[img_id],
+                model=model, diameter=self.expected_median_diameter,
+                min_size=self.spinbox_min_size.value(),
+                cellprob_threshold=self.spinbox_cellprob_threshold.value(),
+                flow_threshold=self.spinbox_flow_threshold.value(),
+                save_masks=False, model_id=MODEL_ID)
+            flow_cache.put(flow_key, self.flow_l[0], self.styles_l[0])
+        else:
+            flows, styles = cached
+            self.flow_l, self.styles_l = [flows], [styles]
+            self.mask_l = [self._compute_masks_from_cached_flows(flows)]
+
+        # save compact, compressed mask
+        if SAVE_MASKS:
+            pred_folder = Path(TAR_DIR) if TAR_DIR else Path(image_path).parent.joinpath('predictions')
+            os.makedirs(pred_folder, exist_ok=True)
+            save_mask(pred_folder.joinpath(f"{img_id}_{MODEL_ID}_pred.tif"), self.mask_l[0])
+            # the folder mtime may not change within its resolution
+            folder_index_cache.invalidate(pred_folder)
+
+        layer_name = f"{img_id}_{MODEL_ID}_pred"
+        if layer_name in self.viewer.layers:
+            self.viewer.layers[layer_name].data = self.mask_l[0]
+            self.single_pred_layer = self.viewer.layers[layer_name]
+        else:
+            self.single_pred_layer = self.viewer.add_labels(self.mask_l[0], name=layer_name)
+        self.single_flow_key = flow_key
+
+    def _compute_masks_from_cached_flows(self, flows):
+        """Rebuilds the mask of an image from its flows with the current
+        threshold and minimum size settings."""
 
-        self.viewer.add_labels(self.mask_l[0], name=f"{img_id}_{MODEL_ID}_pred")
+        return compute_masks_from_flows(
+            dP=flows[1], cellprob=flows[2], diameter=self.expected_median_diameter,
+            cellprob_threshold=self.spinbox_cellprob_threshold.value(),
+            flow_threshold=self.spinbox_flow_threshold.value(),
+            min_size=self.spinbox_min_size.value())
+
+    def _on_change_mask_params(self, value=None):
+        """Updates the prediction of the last segmented image in place when
+        thresholds or minimum size change, without running the model again."""
+
+        if self.single_flow_key is None or self.single_pred_layer not in self.viewer.layers:
+            return
+        cached = flow_cache.get(self.single_flow_key)
+        if cached is None:
+            return
+        self.mask_l = [self._compute_masks_from_cached_flows(cached[0])]
+        self.single_pred_layer.data = self.mask_l[0]
         
     
     def notify_user(self, message_title, message):
@@ -475,11 +860,25 @@ class ImageGrainProcWidget(QWidget):
     def _on_click_segment_image_folder(self):
         """
         Segments all images with a selected extension (.jpg, .png, .tif) from a folder.
-        Displays original images and their segmentation masks in the napari viewer.
-        Masks can be saved in a selected folder.
+        Segmentation runs in a background worker so that napari stays responsive.
+        Original images and their segmentation masks are displayed in the napari
+        viewer as soon as they are available. Masks can be saved in a selected folder.
         """
 
-        model = self.initialize_model()
+        if self.folder_worker is not None:
+            return self.folder_worker
+
+        # with multiple CPU processes, the model is loaded by each process
+        use_processes = (self.check_multiprocess.isChecked() and not self.check_use_gpu.isChecked()
+                         and not self.check_tiled_segmentation.isChecked())
+        if use_processes:
+            if getattr(self, 'model_path', None) is None:
+                self.notify_user("Selection Required", "No model selected. Please select a model from the model list.")
+                return
+        else:
+            model = self.initialize_model()
+            if model is None:
+                return
         
         # single image:
         path_images_in_folder = self.image_folder
@@ -502,63 +901,274 @@ class ImageGrainProcWidget(QWidget):
         if self.radio_segment_tiffs.isChecked():
              self.img_extension = [".tif",".tiff"]
 
-        self.img_list = []
-        for image_in_folder in os.listdir(path_images_in_folder):
-            for img_ext in self.img_extension:
-                if image_in_folder.endswith(img_ext):
-                    self.img_list.append(image_in_folder)
+        self.img_list = list_images(path_images_in_folder, self.img_extension)
+
+        # stop before the first already processed image
+        for idx, img in enumerate(self.img_list):
+            if is_processed_image(img):
+                self.notify_user("Caution !", "You have processed images (masks, or predictions or flows or composites) in your image folder!")
+                self.img_list = self.img_list[:idx]
+                break
 
+        use_georef = False
         if self.check_use_georef.isChecked():
             try: 
                 from osgeo import gdal
                 gdal.UseExceptions()
+                use_georef = ".tif" in self.img_extension or ".tiff" in self.img_extension
             except ModuleNotFoundError:
                 if self.supress_notifications == False:
                     self.notify_user("Caution !", "GDAL not installed. Please install GDAL to keep CRS info for GeoTIFF files.")
                 pass
 
-        for idx, img in enumerate(self.img_list):
-            if ("mask" in img) or ("pred" in img) or ("flow" in img) or ("composite" in img):
-                self.notify_user("Caution !", "You have processed images (masks, or predictions or flows or composites) in your image folder!")
-                break
-            else:
-                self.mask_l, self.flow_l, self.styles_l = predict_single_image(
-                    image_path=path_images_in_folder.joinpath(img), 
-                    model=model,
-                    mute=True, 
-                    return_results=True,
-                    save_masks=SAVE_MASKS,
-                    tar_dir=TAR_DIR,
-                    model_id=MODEL_ID,
-                    diameter=self.expected_median_diameter)
-                self.viewer.open(path_images_in_folder.joinpath(img))
-                self.viewer.add_labels(self.mask_l, name=f"{Path(img).stem}_{MODEL_ID}_pred")
-                self.progress_bar.setValue(int((idx + 1) / len(self.img_list) * 100))
-
-                if self.check_use_georef.isChecked() and (".tif" in self.img_extension or ".tiff" in self.img_extension):
-                    try:
-                        self.src_tfw = path_images_in_folder.joinpath(f"{Path(img).stem}.tfw")
-                        self.tar_tfw = path_images_in_folder.joinpath(f"{Path(img).stem}_{MODEL_ID}_pred.tfw")
-                        shutil.copy(self.src_tfw, self.tar_tfw)
-                        self.img_georef_path = path_images_in_folder.joinpath(img)
-                        self.pred_georef_path = path_images_in_folder.joinpath(f"{Path(img).stem}_{MODEL_ID}_pred.tif")
-                        self.dataset_georef = gdal.Open(self.img_georef_path)
-                        projection   = self.dataset_georef.GetProjection()
-                        geotransform = self.dataset_georef.GetGeoTransform()
-                        #update metadata
-                        self.dataset_pred_georef = gdal.Open(self.pred_georef_path, gdal.GA_Update)    
-                        self.dataset_pred_georef.SetProjection(projection)
-                        self.dataset_pred_georef.SetGeoTransform(geotransform)             
-                        #close raster files
-                        self.dataset_georef = None
-                        self.dataset_pred_georef = None 
-                    except:
-                        if self.supress_notifications == False:
-                            self.notify_user("Caution !", "Georeference of tif/tiff files incomplete. Predictions might not be correctly referenced.")
-                        pass
+        tile_size = None
+        if self.check_tiled_segmentation.isChecked():
+            if not (".tif" in self.img_extension or ".tiff" in self.img_extension):
+                self.notify_user("Caution !", "Tiled segmentation is only available for .tif files.")
+                return
+            try:
+                from osgeo import gdal
+            except ModuleNotFoundError:
+                self.notify_user("Caution !", "GDAL not installed. Please install GDAL to use tiled segmentation.")
+                return
+            tile_size = self.spinbox_tile_size.value()
+            # predictions are written with their georeference
+            use_georef = False
+
+        memory_budget = None
+        if self.check_batch_images.isChecked():
+            memory_budget = self.spinbox_batch_memory.value() * 1024 ** 2
+
+        self.folder_display = self.combobox_folder_display.value
+        if self.folder_display == 'lazy stack' and not SAVE_MASKS:
+            self.notify_user("Caution !", "The lazy stack display reads predictions from disk. Please check 'Save prediction(s)'.")
+            return
+        self.folder_displayed_layers = deque()
+        self.folder_lazy_entries = []
+
+        self.georef_failed = []
+        self.folder_model_id = MODEL_ID
+        self.folder_tar_dir = Path(TAR_DIR) if TAR_DIR else path_images_in_folder.joinpath('predictions')
+        self.progress_bar.setValue(0)
+
+        # saved predictions are recorded in a manifest, which allows to only
+        # segment new or modified images in later runs
+        manifest = None
+        model_info = model_identity(self.model_path)
+        eval_params = {'diameter': self.expected_median_diameter, 'min_size': 15,
+                       'tile_size': tile_size, 'tile_overlap': self.tile_overlap if tile_size else None}
+        if SAVE_MASKS or tile_size:
+            manifest = RunManifest(self.folder_tar_dir)
+            self.folder_manifest = manifest
+        if manifest is not None and self.check_skip_segmented.isChecked():
+            num_images = len(self.img_list)
+            self.img_list = [img for img in self.img_list if not manifest.is_current(
+                path_images_in_folder.joinpath(img), model_info, eval_params)]
+            self.lbl_segmentation_progress.setText(
+                f"Segmentation progress ({num_images - len(self.img_list)} up-to-date images skipped)")
+        else:
+            self.lbl_segmentation_progress.setText("Segmentation progress")
+
+        self.folder_store = None
+        if self.check_save_zarr.isChecked() and not tile_size:
+            try:
+                self.folder_store = PredictionStore(self.folder_tar_dir)
+            except ModuleNotFoundError:
+                self.notify_user("Caution !", "zarr not installed. Please install zarr to save predictions to a Zarr store.")
+                return
+
+        if use_processes:
+            num_processes = self.spinbox_num_processes.value()
+            results = segment_folder_multiprocess(
+                model_path=self.model_path,
+                image_folder=path_images_in_folder,
+                img_list=self.img_list,
+                save_masks=SAVE_MASKS,
+                tar_dir=TAR_DIR,
+                model_id=MODEL_ID,
+                diameter=self.expected_median_diameter,
+                use_georef=use_georef,
+                num_processes=num_processes,
+                torch_threads=max(1, (os.cpu_count() or 1) // num_processes),
+                manifest=manifest,
+                model_info=model_info,
+                eval_params=eval_params,
+                store=self.folder_store,
+                read_images=self.folder_display != 'none')
+        else:
+            results = segment_folder(
+                model=model,
+                image_folder=path_images_in_folder,
+                img_list=self.img_list,
+                save_masks=SAVE_MASKS,
+                tar_dir=TAR_DIR,
+                model_id=MODEL_ID,
+                diameter=self.expected_median_diameter,
+                use_georef=use_georef,
+                memory_budget=memory_budget,
+                read_ahead=self.read_ahead,
+                io_threads=self.io_threads,
+                tile_size=tile_size,
+                tile_overlap=self.tile_overlap,
+                manifest=manifest,
+                model_info=model_info,
+                eval_params=eval_params,
+                store=self.folder_store)
+        self.folder_stop = Event()
+        self.folder_worker = folder_results_worker(results, self.folder_stop)
+        self.folder_worker.yielded.connect(self._on_folder_image_segmented)
+        self.folder_worker.paused.connect(self._on_folder_segmentation_paused)
+        self.folder_worker.resumed.connect(self._on_folder_segmentation_paused)
+        self.folder_worker.errored.connect(self._on_folder_segmentation_errored)
+        self.folder_worker.finished.connect(self._on_folder_segmentation_finished)
+        self._toggle_folder_segmentation_buttons(running=True)
+        self.folder_worker.start()
+
+        return self.folder_worker
+
+    def _on_folder_image_segmented(self, result):
+        """Displays the image and prediction streamed back by the folder worker."""
+
+        # tiled segmentation of large rasters only writes results to disk
+        if result.image is not None:
+            self.mask_l, self.flow_l, self.styles_l = result.masks, result.flows, result.styles
+            image_name = Path(result.image_path).stem
+            if self.folder_display == 'lazy stack':
+                self._update_lazy_stack(result.image_path, result.image, self.mask_l[0])
+            elif self.folder_display != 'none':
+                # reuse the image decoded for segmentation instead of reading it again
+                image_layer = self.viewer.add_image(result.image, name=image_name)
+                mask_layer = self.viewer.add_labels(self.mask_l[0], name=f"{image_name}_{self.folder_model_id}_pred")
+                if self.folder_display == 'last N':
+                    self._keep_last_folder_layers(image_layer, mask_layer)
+        self.progress_bar.setValue(int((result.idx + 1) / len(self.img_list) * 100))
+        if not result.georef_ok:
+            self.georef_failed.append(result.image_path)
+
+    def _keep_last_folder_layers(self, image_layer, mask_layer):
+        """Adds a new image/prediction layer pair and removes the oldest pairs
+        so that only the last N are kept in the viewer."""
+
+        self.folder_displayed_layers.append((image_layer, mask_layer))
+        while len(self.folder_displayed_layers) > self.spinbox_display_last_n.value():
+            for layer in self.folder_displayed_layers.popleft():
+                if layer in self.viewer.layers:
+                    self.viewer.layers.remove(layer)
+
+    def _update_lazy_stack(self, image_path, image, mask):
+        """Adds a segmented image to the lazily loaded image and prediction stacks.
+        Only the shape and type of the arrays are kept in memory, the data is
+        read from disk when a plane is displayed. Images whose shape differs
+        from the first image of the run are not added to the stack."""
+
+        if self.folder_lazy_entries and self.folder_lazy_entries[0][2] != image.shape:
+            warn(f'{Path(image_path).name} is not shown in the folder stack as its shape '
+                 f'{image.shape} differs from {self.folder_lazy_entries[0][2]}.', stacklevel=2)
+            return
+        # saved predictions are compacted, the type is read from the file header
+        pred_path = self.folder_tar_dir.joinpath(f"{Path(image_path).stem}_{self.folder_model_id}_pred.tif")
+        with tifffile.TiffFile(pred_path) as tif:
+            mask_dtype = tif.series[0].dtype
+        entry = (image_path, pred_path, image.shape, image.dtype, mask.shape, mask_dtype)
+        self.folder_lazy_entries.append(entry)
+
+        image_stack = da.stack([
+            da.from_delayed(delayed(io.imread)(str(x[0])), shape=x[2], dtype=x[3])
+            for x in self.folder_lazy_entries])
+        mask_stack = da.stack([
+            da.from_delayed(delayed(io.imread)(str(x[1])), shape=x[4], dtype=x[5])
+            for x in self.folder_lazy_entries])
+
+        if 'folder images' in self.viewer.layers and 'folder predictions' in self.viewer.layers:
+            self.viewer.layers['folder images'].data = image_stack
+            self.viewer.layers['folder predictions'].data = mask_stack
+        else:
+            self.viewer.add_image(image_stack, name='folder images')
+            self.viewer.add_labels(mask_stack, name='folder predictions')
+        self.viewer.dims.set_current_step(0, len(self.folder_lazy_entries) - 1)
+
+    def _on_change_folder_display(self, value=None):
+        """Shows the N spinbox only for the 'last N' display mode."""
+
+        self.spinbox_display_last_n.setVisible(self.combobox_folder_display.value == 'last N')
+
+    def _on_folder_segmentation_errored(self, error):
+        """Reports an exception raised in the folder worker."""
+
+        if not self.supress_notifications:
+            self.notify_user("Unexpected Error", f"Folder segmentation stopped: {error}")
+
+    def _on_folder_segmentation_finished(self):
+        """Resets the folder segmentation state once the worker is done or cancelled."""
 
-        self.progress_bar.setValue(100)  # Ensure it's fully completed
+        if not self.folder_stop.is_set():
+            self.progress_bar.setValue(100)  # Ensure it's fully completed
+        self.folder_worker = None
+        # predictions written within the mtime resolution of the folder would
+        # not be found by an index built during the run
+        folder_index_cache.invalidate(self.folder_tar_dir)
+        if self.folder_store is not None:
+            self.folder_store.consolidate()
+            self.folder_store = None
+        if self.folder_manifest is not None:
+            self.folder_manifest.save()
+            self.folder_manifest = None
+        self._toggle_folder_segmentation_buttons(running=False)
 
+        if self.georef_failed and not self.supress_notifications:
+            self.notify_user("Caution !", "Georeference of tif/tiff files incomplete. Predictions might not be correctly referenced.")
+
+    def _on_click_pause_folder_segmentation(self):
+        """Pauses or resumes the running folder segmentation."""
+
+        if self.folder_worker is None:
+            return
+        # the label follows the requested state, as is_paused only changes
+        # once the worker has reached the next image
+        self.folder_paused = not self.folder_paused
+        if self.folder_paused:
+            self.folder_worker.pause()
+            self.btn_pause_folder_segmentation.setText("Resume")
+        else:
+            self.folder_worker.resume()
+            self.btn_pause_folder_segmentation.setText("Pause")
+
+    def _on_click_cancel_folder_segmentation(self):
+        """Cancels the running folder segmentation after the current image."""
+
+        if self.folder_worker is None:
+            return
+        # the worker is not quit: it stops by itself, so that the segmentation
+        # generator is closed in the worker thread and not on the GUI thread
+        self.folder_stop.set()
+        self.folder_worker.resume()
+
+    def _on_folder_segmentation_paused(self):
+        """Applies the pause state requested while the worker was pausing or
+        resuming. A cancelled worker is resumed so that it can stop."""
+
+        if self.folder_worker is None:
+            return
+        paused = self.folder_paused and not self.folder_stop.is_set()
+        if self.folder_worker.is_paused and not paused:
+            self.folder_worker.resume()
+        elif not self.folder_worker.is_paused and paused:
+            self.folder_worker.pause()
+
+    def _toggle_folder_segmentation_buttons(self, running):
+        """Enables the run button or the pause/cancel buttons of the folder segmentation."""
+
+        self.btn_run_segmentation_on_folder.setEnabled(not running)
+        self.btn_pause_folder_segmentation.setEnabled(running)
+        self.btn_cancel_folder_segmentation.setEnabled(running)
+        self.folder_paused = False
+        self.btn_pause_folder_segmentation.setText("Pause")
+
+    def wait_for_folder_segmentation(self):
+        """Blocks until the running folder segmentation has finished and
+        all its results are displayed."""
+
+        wait_for_worker(self, 'folder_worker')
 
     def _on_select_image(self, current_item, previous_item):
         '''
@@ -571,13 +1181,27 @@ class ImageGrainProcWidget(QWidget):
         success = self.open_image()
 
         if self.check_load_saved_prediction_mask.isChecked():
+            # predictions in a Zarr store are read chunk-wise on display
+            store = open_prediction_store(self.pred_directory.value)
+            pred_id = store.find(self.image_name, model_str='', data_str='pred') if store is not None else None
+            if pred_id is not None:
+                self.mask_layer = show_in_layer(
+                    self.viewer, self.mask_layer, store.mask(pred_id), pred_id, layer_type='labels')
+                return self.image_path
+
             relevant_prediction_path = find_match_in_folder(
                 folder=self.pred_directory.value,
                 image_name=self.image_name,
                 model_str='', data_str='pred', data_format='tif')
             if relevant_prediction_path is None:
+                self._remove_mask_layer()
                 return False
-            success = self.viewer.open(relevant_prediction_path, layer_type="labels")
+            self.mask_layer = show_in_layer(
+                self.viewer, self.mask_layer, image_cache.get(relevant_prediction_path).copy(),
+                Path(relevant_prediction_path).stem, layer_type='labels')
+            success = True
+        else:
+            self._remove_mask_layer()
 
         if not success:
             return False
@@ -602,18 +1226,50 @@ class ImageGrainProcWidget(QWidget):
     def open_image(self):
         '''Opens a selected image in napari.'''
 
-        # clear existing layers.
-        while len(self.viewer.layers) > 0:
-             self.viewer.layers.clear()
+        # clear existing layers except the current image and mask layers
+        # which are reused to display the new selection
+        clear_other_layers(self.viewer, keep=[self.image_layer, self.mask_layer])
 
         # if file list is empty stop here
         if self.image_list.currentItem() is None:
+            self.viewer.layers.clear()
+            self.image_layer, self.mask_layer = None, None
             return False
         
-        # open image
+        # open image with the napari reader plugins, read images are cached
+        # and the neighbors of the selected image are read ahead for fast browsing
         self.image_name = self.image_list.currentItem().text()
         self.image_path = self.image_list.folder_path.joinpath(self.image_name)
-        self.viewer.open(self.image_path)
+        self.image_layer = show_layer_data(
+            self.viewer, self.image_layer, image_cache.get_layer_data(self.image_path),
+            Path(self.image_name).stem)
+        self._prefetch_neighbors()
+
+    def _remove_mask_layer(self):
+        """Removes the current mask layer, e.g. when the selected image has
+        no saved prediction."""
+
+        if self.mask_layer is not None and self.mask_layer in self.viewer.layers:
+            self.viewer.layers.remove(self.mask_layer)
+        self.mask_layer = None
+
+    def _prefetch_neighbors(self):
+        """Decodes the previous and next images of the list, and their
+        predictions if they are loaded, in the background."""
+
+        row = self.image_list.currentRow()
+        image_paths, prediction_paths = [], []
+        for neighbor in [row + 1, row - 1]:
+            item = self.image_list.item(neighbor)
+            if item is None:
+                continue
+            image_paths.append(self.image_list.folder_path.joinpath(item.text()))
+            if self.check_load_saved_prediction_mask.isChecked():
+                prediction_paths.append(partial(
+                    find_match_in_folder, folder=self.pred_directory.value, image_name=item.text(),
+                    model_str='', data_str='pred', data_format='tif'))
+        image_cache.prefetch(image_paths, layer_data=True)
+        image_cache.prefetch(prediction_paths)
 
 
     def _on_click_compute_performance_folder(self):
@@ -628,7 +1284,10 @@ class ImageGrainProcWidget(QWidget):
             label_str=self.qtext_mask_str.text(),
             pred_str=self.qtext_pred_str.text()
             )
-        evals = eval_set(imgs=imgs, lbls=lbls, preds=preds, save_results=True, tar_dir=self.perf_pred_directory.value)
+        # images evaluated before with the same labels and predictions are
+        # not evaluated again
+        evals = evaluation_cache.evaluate(imgs=imgs, lbls=lbls, preds=preds)
+        save_evaluation(evals, imgs, lbls, preds, tar_dir=self.perf_pred_directory.value)
         # compute mAP
         mAP = 0
         for key, val in evals.items():
@@ -670,7 +1329,7 @@ class ImageGrainProcWidget(QWidget):
             format='tif',
             filter_str=imgs[0].stem + "*" + self.qtext_pred_str.text())
 
-        evals = eval_set(imgs=imgs, lbls=lbls, preds=preds, save_results=False)
+        evals = evaluation_cache.evaluate(imgs=imgs, lbls=lbls, preds=preds)
         self.mAP = np.mean(evals[0]['ap'])
         self.mpl_widget.canvas.figure
         self.axes.clear()
@@ -728,7 +1387,7 @@ class ImageGrainProcWidget(QWidget):
             label_str=self.qtext_mask_str.text(),
             pred_str=self.qtext_pred_str.text()
             )
-        evals = eval_set(imgs=imgs, lbls=lbls, preds=preds, save_results=False)
+        evals = evaluation_cache.evaluate(imgs=imgs, lbls=lbls, preds=preds)
         avg_l, std_l, std_ul, std_ll = compute_average_ap(evals)
         ap_stats_df = pd.DataFrame(
             {'avg': avg_l,
@@ -755,7 +1414,34 @@ class ImageGrainProcWidget(QWidget):
             self.qls_expected_median_diameter.setVisible(True)
         else:
             self.qls_expected_median_diameter.setVisible(False)
+            self.check_preview_diameter.setChecked(False)
+        for widget in [self.check_preview_diameter, self.combobox_preview_region.native,
+                       self.spinbox_preview_size, self.btn_confirm_preview]:
+            widget.setVisible(self.check_change_diameter.isChecked())
+
+
+
+def _iter_until_stopped(results, stop_event):
+    """Yields from the results generator until stop_event is set. The
+    generator is closed here, in the worker thread, as a quit worker would
+    leave it to the garbage collector, which may run its cleanup (e.g. waiting
+    for the pending reads or processes) on the GUI thread."""
+
+    with closing(results):
+        for result in results:
+            yield result
+            if stop_event.is_set():
+                return
+
+
+# folder segmentation running in a background thread
+folder_results_worker = thread_worker(_iter_until_stopped)
+# model download running in a background thread
+download_model_worker = thread_worker(iter_model_download)
+
 
+# diameter preview running in a background thread
+predict_preview_worker = thread_worker(predict_preview)
 
 
 class VHGroup():
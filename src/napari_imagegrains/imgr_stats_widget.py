@@ -1,5 +1,7 @@
 from typing import TYPE_CHECKING
 from pathlib import Path
+from glob import glob
+from functools import partial
 from warnings import warn
 
 from magicgui.widgets import create_widget, Table
@@ -9,6 +11,7 @@ from qtpy.QtWidgets import (QPushButton, QWidget, QVBoxLayout, QTabWidget,
                             QCheckBox, QMessageBox, QAbstractItemView)
 import pandas as pd
 import seaborn as sns
+from natsort import natsorted
 import numpy as np
 import matplotlib.pyplot as plt
 from napari_matplotlib.base import NapariMPLWidget
@@ -16,7 +19,11 @@ from napari_matplotlib.base import NapariMPLWidget
 from .imgr_proc_widget import VHGroup
 from .folder_list_widget import FolderList
 from .utils import (find_match_in_folder, find_matching_data_index,
-                    read_complete_grain_files)
+                    read_complete_grain_files, read_grain_dataset, show_in_layer, show_layer_data,
+                    clear_other_layers, DataNameIndex)
+from .prediction_store import PredictionStore, open_prediction_store
+from .grain_store import GrainTableStore, open_grain_store
+from .image_cache import image_cache
 from imagegrains import grainsizing, data_loader, plotting
 from imagegrains.grainsizing import scale_grains
 
@@ -34,6 +41,10 @@ class ImageGrainStatsWidget(QWidget):
         
         # name of current image
         self.image_name = None
+        # layers displaying the current image and mask, reused when the
+        # selection changes
+        self.image_layer = None
+        self.mask_layer = None
         # df for current image
         self.props_df_image = None
         # df for all images
@@ -43,6 +54,11 @@ class ImageGrainStatsWidget(QWidget):
         # list of list of skimage.measure._regionprops.RegionProperties for all images
         self.props_dataset = None
         self.file_ids = None
+        # indexes of file_ids and of the file_id of props_df_dataset with the
+        # rows of each file_id, for fast lookups when browsing images
+        self.file_id_index = None
+        self.dataset_file_index = None
+        self.dataset_file_rows = None
         # displayble table
         self.results_table = Table()
 
@@ -258,6 +274,9 @@ class ImageGrainStatsWidget(QWidget):
         self.props_image = None
         self.props_dataset = None
         self.file_ids = None
+        self.file_id_index = None
+        self.dataset_file_index = None
+        self.dataset_file_rows = None
         self.results_table.clear()
 
         return self.mask_folder
@@ -266,23 +285,70 @@ class ImageGrainStatsWidget(QWidget):
         
         self.plot_type = 'multi'
         composite_name = self.qtext_model_str.text() + self.qtext_mask_str.text()
-        self.props_df_dataset, self.props_dataset, self.file_ids = grainsizing.grains_in_dataset(
-            data_dir=self.mask_folder, 
-            mask_str=composite_name,
-            tar_dir=self.mask_folder,
-            return_results=True)
-        
-        if self.check_scale.isChecked():
-            for ind in range(len(self.props_df_dataset)):
-                scale = self.spinbox_scale.value()
-                self.props_df_dataset[ind] = scale_grains(
-                    self.props_df_dataset[ind], resolution=scale, 
-                    tar_dir=self.mask_folder, gsd_path=self.file_ids[ind]+'_grains',
+        scaled = self.check_scale.isChecked()
+
+        # masks are listed as by grainsizing.grains_in_dataset but measured one
+        # at a time, so that the table of each image is stored as soon as it
+        # is computed and an interrupted run keeps the tables already written
+        mask_files = natsorted(glob(f'{Path(self.mask_folder)}/*{composite_name}*.tif'))
+        if not mask_files:
+            mask_files = natsorted(glob(f'{Path(self.mask_folder)}/predictions/*{composite_name}*.tif'))
+
+        # keep grain tables next to the masks of a Zarr store
+        store = None
+        if PredictionStore.exists(self.mask_folder):
+            try:
+                store = PredictionStore(self.mask_folder)
+            except ModuleNotFoundError:
+                pass
+        # keep grain tables in a columnar store to load the dataset in one read.
+        # Tables are identified like the grain files they are written after
+        try:
+            grain_store = GrainTableStore(self.mask_folder, scaled=scaled)
+        except ModuleNotFoundError:
+            grain_store = None
+        suffix = '_grains_re_scaled' if scaled else '_grains'
+
+        self.props_df_dataset, self.props_dataset, self.file_ids = [], [], []
+        try:
+            for mask_file in mask_files:
+                props_df, props, file_ids = grainsizing.grains_in_dataset(
+                    inp_list=[mask_file],
+                    set_id=str(self.mask_folder),
+                    tar_dir=self.mask_folder,
                     return_results=True)
-        
+                # files that are no grain masks are skipped
+                if not file_ids:
+                    continue
+                file_id, props_df = file_ids[0], props_df[0]
+                if scaled:
+                    props_df = scale_grains(
+                        props_df, resolution=self.spinbox_scale.value(),
+                        tar_dir=self.mask_folder, gsd_path=file_id + '_grains',
+                        return_results=True)
+                if store is not None:
+                    store.write_grains(file_id, props_df)
+                if grain_store is not None:
+                    grain_store.write_grains(file_id + suffix, props_df)
+                self.props_df_dataset.append(props_df)
+                self.props_dataset.append(props[0])
+                self.file_ids.append(file_id)
+        finally:
+            if store is not None:
+                store.consolidate()
+        self.file_id_index = DataNameIndex(self.file_ids)
+
+        # tables of masks that are gone are removed
+        if grain_store is not None:
+            store_ids = {file_id + suffix for file_id in self.file_ids}
+            for file_id in set(grain_store.file_ids()).difference(store_ids):
+                if composite_name in file_id:
+                    grain_store.remove(file_id)
+
         for ind, x in enumerate(self.props_df_dataset):
             x['file_id'] = self.file_ids[ind]
         self.props_df_dataset = pd.concat(self.props_df_dataset)
+        self._index_dataset()
         
         self._update_combobox_props(self.props_df_dataset.drop(columns='file_id').columns)
         self._update_combobox_props_for_size(self.props_df_dataset.drop(columns='file_id').columns)
@@ -358,23 +424,53 @@ class ImageGrainStatsWidget(QWidget):
 
         return grain_files
 
+    def get_grain_store_ids(self, grain_files):
+        """Find the tables of the grain store of the mask folder holding the
+        grain files. Tables are only used if every grain file has a table
+        written after it, otherwise no ids are returned and the grain files
+        should be read. Returns the store (None if there is none) and the ids
+        of the tables, which are the names of the grain files."""
+
+        grain_store = open_grain_store(self.mask_folder, scaled=self.check_scale.isChecked())
+        if grain_store is None or len(grain_files) == 0:
+            return grain_store, []
+        file_ids = [Path(x).stem for x in grain_files]
+        if not all(grain_store.is_current(file_id, x) for file_id, x in zip(file_ids, grain_files)):
+            return grain_store, []
+        return grain_store, file_ids
+
+    def read_grain_store(self, grain_files, columns=None):
+        """Read the tables of the grain store holding the grain files (see
+        get_grain_store_ids) in one go. Returns None if there are none."""
+
+        grain_store, file_ids = self.get_grain_store_ids(grain_files)
+        if len(file_ids) == 0:
+            return None
+        return grain_store.read(file_ids=file_ids, columns=columns)
+
     def _on_load_grainsize_dataset(self, event=None):
         
         self.plot_type = 'multi'
         self.grain_files = self.get_grain_files()
         
-        self.props_df_dataset = read_complete_grain_files(grain_file_list=self.grain_files)
-        
-        for ind, x in enumerate(self.props_df_dataset):
-            x['file_id'] = Path(self.grain_files[ind]).stem
-        self.props_df_dataset = pd.concat(self.props_df_dataset)
-        if 'Unnamed: 0' in self.props_df_dataset.columns:
-            self.props_df_dataset.drop(columns='Unnamed: 0', inplace=True)
+        # the grain store is read in one go, otherwise files are read
+        # concurrently into a single dataframe with a file_id column
+        self.props_df_dataset = self.read_grain_store(self.grain_files)
+        if self.props_df_dataset is None:
+            self.props_df_dataset = read_grain_dataset(self.grain_files)
+        self._index_dataset()
         
         self._update_combobox_props(self.props_df_dataset.drop(columns='file_id').columns)
         self._update_combobox_props_for_size(self.props_df_dataset.drop(columns='file_id').columns)
         self._on_select_prop_to_plot()
 
+    def _index_dataset(self):
+        """Index the file_id of props_df_dataset and the positions of the rows
+        of each file_id."""
+
+        self.dataset_file_rows = self.props_df_dataset.groupby('file_id', sort=False).indices
+        self.dataset_file_index = DataNameIndex(list(self.dataset_file_rows.keys()))
+
     def _on_load_grainsize_image(self, event=None):
         
         self.plot_type = 'single'
@@ -386,12 +482,16 @@ class ImageGrainStatsWidget(QWidget):
         else:
             self.grain_files = [x for x in self.grain_files if 're_scaled' not in Path(x).stem]
         
-        if len(grain_files) == 0:
+        grain_store, file_ids = self.get_grain_store_ids(
+            [x for x in self.get_grain_files() if Path(self.image_name).stem in x])
+        if len(file_ids) == 1:
+            self.props_df_image = grain_store.read(file_ids=file_ids).drop(columns='file_id')
+        elif len(grain_files) == 0:
             raise ValueError(f'No grain file found for image {self.image_name}')
         elif len(grain_files) > 1:
             raise ValueError(f'Multiple grain files found for image {self.image_name}')
-        
-        self.props_df_image = read_complete_grain_files(grain_file_list=grain_files)[0]
+        else:
+            self.props_df_image = read_complete_grain_files(grain_file_list=grain_files)[0]
         self.mask_layer.properties = self.props_df_image
         self.create_table_widget(self.props_df_image)
 
@@ -427,11 +527,22 @@ class ImageGrainStatsWidget(QWidget):
             self.results_table.clear()
             self.axes.clear()
             if self.props_df_dataset is not None:
-                ref_files = self.props_df_dataset['file_id'].unique()
-                index = find_matching_data_index(self.image_path, ref_files)
-                self.props_df_image = self.props_df_dataset[self.props_df_dataset['file_id'] == ref_files[index[0]]]
+                index = find_matching_data_index(self.image_path, self.dataset_file_index)
+                file_id = self.dataset_file_index.names[index[0]]
+                self.props_df_image = self.props_df_dataset.iloc[self.dataset_file_rows[file_id]]
                 self.create_table_widget(self.props_df_image)
 
+            # masks in a Zarr store are read chunk-wise on display
+            store = open_prediction_store(self.mask_folder)
+            if store is not None:
+                pred_id = store.find(self.image_name, model_str=self.qtext_model_str.text(),
+                                     data_str=self.qtext_mask_str.text())
+                if pred_id is not None:
+                    self.mask_path = None
+                    self.mask_layer = show_in_layer(
+                        self.viewer, self.mask_layer, store.mask(pred_id), pred_id, layer_type='labels')
+                    return self.image_path
+
             # find mask corresponding to image
             self.mask_path = None
             self.mask_path = find_match_in_folder(
@@ -446,12 +557,14 @@ class ImageGrainStatsWidget(QWidget):
         
     def open_image(self):
 
-        # clear existing layers.
-        while len(self.viewer.layers) > 0:
-             self.viewer.layers.clear()
+        # clear existing layers except the current image and mask layers
+        # which are reused to display the new selection
+        clear_other_layers(self.viewer, keep=[self.image_layer, self.mask_layer])
 
         # if file list is empty stop here
         if self.image_list.currentItem() is None:
+            self.viewer.layers.clear()
+            self.image_layer, self.mask_layer = None, None
             return False
         
         # open image
@@ -461,14 +574,43 @@ class ImageGrainStatsWidget(QWidget):
         self.props_df_image = None
         self.props_image = None
 
-        self.viewer.open(self.image_path)
+        # images are read with the napari reader plugins and cached, the
+        # neighbors of the selected image are read ahead for fast browsing
+        self.image_layer = show_layer_data(
+            self.viewer, self.image_layer, image_cache.get_layer_data(self.image_path),
+            Path(self.image_name).stem)
+        self._prefetch_neighbors()
         return True
 
+    def _prefetch_neighbors(self):
+        """Decodes the previous and next images of the list and their masks
+        in the background."""
+
+        row = self.image_list.currentRow()
+        image_paths, mask_paths = [], []
+        for neighbor in [row + 1, row - 1]:
+            item = self.image_list.item(neighbor)
+            if item is None:
+                continue
+            image_paths.append(self.image_list.folder_path.joinpath(item.text()))
+            if getattr(self, 'mask_folder', None) is not None:
+                mask_paths.append(partial(
+                    find_match_in_folder, self.mask_folder, item.text(),
+                    model_str=self.qtext_model_str.text(), data_str=self.qtext_mask_str.text(),
+                    data_format='tif'))
+        image_cache.prefetch(image_paths, layer_data=True)
+        image_cache.prefetch(mask_paths)
+
     def open_mask(self):
 
         if self.mask_path is None:
+            if self.mask_layer is not None and self.mask_layer in self.viewer.layers:
+                self.viewer.layers.remove(self.mask_layer)
+            self.mask_layer = None
             return False
-        self.mask_layer = self.viewer.open(self.mask_path, layer_type='labels')[0]
+        self.mask_layer = show_in_layer(
+            self.viewer, self.mask_layer, image_cache.get(self.mask_path).copy(),
+            Path(self.mask_path).stem, layer_type='labels')
 
 
     def _on_display_fit(self):
@@ -481,7 +623,7 @@ class ImageGrainStatsWidget(QWidget):
             current_props = self.props_image
         else:
             model_str = self.qtext_model_str.text() if self.qtext_model_str.text() != "" else None
-            match_index = find_matching_data_index(self.image_path, self.file_ids, key_string=model_str)
+            match_index = find_matching_data_index(self.image_path, self.file_id_index, key_string=model_str)
             if len(match_index) == 0:
                 raise ValueError(f'No mask found for current image {self.image_path}')
             elif len(match_index) > 1:
@@ -528,11 +670,11 @@ class ImageGrainStatsWidget(QWidget):
 
         column = self.combobox_props_for_size.value
         self.grain_files = self.get_grain_files()
-        if len(self.grain_files) == 0:
+        gsd_l, id_l = self._compute_gsds(column)
+        if len(gsd_l) == 0:
             #warn(f'No grain files found for {self.mask_folder.name}. Please run the grain size analysis for the full folder first.')
             self.notify_user("Analysis required", "No grain files found. Please run the grain size analysis for the full folder first in the Properties tab.")
             return
-        gsd_l, id_l = grainsizing.gsd_for_set(gsds=self.grain_files, column=column)
 
         self.grainsize_axes.clear()
         colors = plt.cm.tab10(np.linspace(0, 1, len(gsd_l)))
@@ -548,6 +690,21 @@ class ImageGrainStatsWidget(QWidget):
         self.grainsize_axes.legend()
         self.grainsize_plot.canvas.figure.canvas.draw()
 
+    def _compute_gsds(self, column):
+        """Compute the grain size distributions of column for the grain files
+        in self.grain_files. Only column is read from the grain store if it
+        holds the grain files, otherwise the grain files are read."""
+
+        grain_store, file_ids = self.get_grain_store_ids(self.grain_files)
+        if len(file_ids) == 0:
+            return grainsizing.gsd_for_set(gsds=self.grain_files, column=column)
+
+        grains = grain_store.read(file_ids=file_ids, columns=[column])
+        grains = dict(list(grains.groupby('file_id', sort=False)[column]))
+        # images without grains have no rows in the store
+        gsd_l = [grainsizing.do_gsd(grains.get(x, pd.Series(dtype=float))) for x in file_ids]
+        return gsd_l, file_ids
+
     def _on_plot_gsd_image(self):
 
         if self.image_name is None:
@@ -557,7 +714,7 @@ class ImageGrainStatsWidget(QWidget):
         column = self.combobox_props_for_size.value
         self.grain_files = self.get_grain_files()
         self.grain_files = [x for x in self.grain_files if Path(self.image_name).stem in x]
-        gsd_l, id_l = grainsizing.gsd_for_set(gsds=self.grain_files, column=column)
+        gsd_l, id_l = self._compute_gsds(column)
 
         idx = 0
 
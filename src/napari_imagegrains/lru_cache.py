@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts its least recently used entries.
+
+    Entries are evicted once their total size exceeds max_size. By default
+    each entry has a size of 1, so that max_size is a number of entries;
+    sizeof can give another measure, e.g. the number of bytes of an array.
+    Entries larger than max_size are not cached.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum total size of the cached entries.
+    sizeof: callable, optional
+        Function returning the size of a cached value.
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    def _entry_size(self, value):
+        return 1 if self._sizeof is None else self._sizeof(value)
+
+    def get(self, key, default=None):
+        """Returns the value cached for key, or default, and marks it as
+        most recently used."""
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        """Caches value for key, evicting the least recently used entries if
+        necessary."""
+
+        size = self._entry_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entry_size(self._entries.pop(key))
+            if size > self.max_size:
+                return
+            self._entries[key] = value
+            self._size += size
+            self._trim()
+
+    def pop(self, key, default=None):
+        """Removes key from the cache and returns its value, or default."""
+
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries.pop(key)
+            self._size -= self._entry_size(value)
+            return value
+
+    def set_max_size(self, max_size):
+        """Changes the maximum size, evicting the least recently used entries
+        if necessary."""
+
+        with self._lock:
+            self.max_size = max_size
+            self._trim()
+
+    def _trim(self):
+
+        while self._size > max(self.max_size, 0) and len(self._entries) > 0:
+            _, value = self._entries.popitem(last=False)
+            self._size -= self._entry_size(value)
+
+    def remove_if(self, predicate):
+        """Removes the entries whose key satisfies predicate."""
+
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._size -= self._entry_size(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
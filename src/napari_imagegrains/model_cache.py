@@ -0,0 +1,69 @@
+from pathlib import Path
+
+from cellpose import models
+
+from .lru_cache import LRUCache
+
+
+class ModelCache:
+    """Process-wide LRU cache of loaded Cellpose models.
+
+    Models are identified by their weight file (resolved path, modification
+    time and size) and the device they are loaded on, so that a weight file
+    overwritten on disk is loaded again.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of models kept in memory.
+    """
+
+    def __init__(self, max_size=2):
+        self._models = LRUCache(max_size)
+
+    @staticmethod
+    def make_key(model_path, gpu=False):
+        """Returns the cache key of the weights in model_path loaded on
+        the gpu or cpu."""
+
+        model_path = Path(model_path).resolve()
+        stat = model_path.stat()
+        device = 'gpu' if gpu else 'cpu'
+        return (str(model_path), stat.st_mtime_ns, stat.st_size, device)
+
+    def get(self, model_path, gpu=False):
+        """Returns the model for model_path, loading it only if it is not
+        cached yet."""
+
+        key = self.make_key(model_path, gpu)
+        model = self._models.get(key)
+        if model is None:
+            model = models.CellposeModel(gpu=gpu, pretrained_model=str(model_path))
+            self._models.put(key, model)
+        return model
+
+    def set_max_size(self, max_size):
+        """Changes the maximum number of cached models, evicting the least
+        recently used ones if necessary."""
+
+        self._models.set_max_size(max_size)
+
+    def evict(self, model_path=None):
+        """Removes all models loaded from model_path from the cache. If
+        model_path is None the whole cache is cleared."""
+
+        if model_path is None:
+            self._models.clear()
+            return
+        model_path = str(Path(model_path).resolve())
+        self._models.remove_if(lambda key: key[0] == model_path)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, model_key):
+        return model_key in self._models
+
+
+# models shared by the widgets and headless runs of the process
+model_cache = ModelCache()
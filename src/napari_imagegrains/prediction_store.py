@@ -0,0 +1,205 @@
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+from natsort import natsorted
+
+STORE_NAME = 'predictions.zarr'
+
+
+def _write_array(group, name, data, chunks=True):
+    """Creates or replaces an array in a zarr group (zarr v2 and v3)."""
+
+    if hasattr(group, 'create_array'):
+        return group.create_array(name, data=data, chunks=chunks, overwrite=True)
+    return group.create_dataset(name, data=data, chunks=chunks, overwrite=True)
+
+
+class PredictionStore:
+    """Chunked Zarr store holding the predictions of a dataset.
+
+    Masks, optional flows and grain tables of all images are kept under one
+    root, with a consolidated metadata index, so that the mask of any image
+    is accessed by reading its chunks instead of globbing a folder and
+    decoding a complete file. Requires the optional zarr package.
+
+    Layout::
+
+        predictions.zarr/
+            masks/{pred_id}              label mask
+            flows/{pred_id}/dP           flow field
+            flows/{pred_id}/cellprob     cell probability
+            grains/{pred_id}/{column}    grain table, one array per column
+
+    where pred_id follows the file naming {image_id}_{model_id}_pred. The
+    index of stored predictions is kept in memory while writing and saved
+    with the consolidated metadata by consolidate().
+
+    Parameters
+    ----------
+    folder: str or Path
+        Folder in which the store is located. A path ending with .zarr is
+        used as store path directly.
+    mode: str
+        'a' to read and write, 'r' to only read.
+    chunk_size: int
+        Size of the 2D chunks of masks and flows.
+    """
+
+    def __init__(self, folder, mode='a', chunk_size=1024):
+        try:
+            import zarr
+        except ModuleNotFoundError as e:
+            raise ModuleNotFoundError(
+                "The prediction store requires zarr. Install it with 'pip install zarr'.") from e
+        self._zarr = zarr
+
+        folder = Path(folder)
+        self.path = folder if folder.suffix == '.zarr' else folder.joinpath(STORE_NAME)
+        self.mode = mode
+        self.chunk_size = chunk_size
+        if mode == 'r':
+            try:
+                self.root = zarr.open_consolidated(str(self.path), mode='r')
+            except (KeyError, ValueError, FileNotFoundError):
+                self.root = zarr.open_group(str(self.path), mode='r')
+        else:
+            self.root = zarr.open_group(str(self.path), mode=mode)
+        self.index = dict(self.root.attrs.get('index', {}))
+
+    @staticmethod
+    def exists(folder):
+        """Returns True if folder contains a prediction store."""
+
+        folder = Path(folder)
+        path = folder if folder.suffix == '.zarr' else folder.joinpath(STORE_NAME)
+        return path.is_dir()
+
+    def _chunks(self, shape):
+        return tuple(min(self.chunk_size, x) for x in shape[:2]) + tuple(shape[2:])
+
+    def _update_index(self, pred_id, **entries):
+        self.index.setdefault(pred_id, {}).update(entries)
+
+    def write_prediction(self, pred_id, mask, flows=None):
+        """Stores the mask and optionally the flows (as returned by Cellpose)
+        of one image."""
+
+        mask = np.asarray(mask)
+        masks_group = self.root.require_group('masks')
+        _write_array(masks_group, pred_id, mask, chunks=self._chunks(mask.shape))
+        has_flows = False
+        if flows is not None and len(flows) > 2:
+            flows_group = self.root.require_group('flows').require_group(pred_id)
+            dP = np.asarray(flows[1])
+            cellprob = np.asarray(flows[2])
+            _write_array(flows_group, 'dP', dP, chunks=(dP.shape[0],) + self._chunks(dP.shape[1:]))
+            _write_array(flows_group, 'cellprob', cellprob, chunks=self._chunks(cellprob.shape))
+            has_flows = True
+        self._update_index(pred_id, shape=list(mask.shape), dtype=str(mask.dtype),
+                           flows=has_flows)
+
+    def write_grains(self, pred_id, grains):
+        """Stores the grain table (DataFrame) of one image column by column."""
+
+        grains_group = self.root.require_group('grains').require_group(pred_id)
+        columns = []
+        for col in grains.columns:
+            values = grains[col].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            _write_array(grains_group, str(col), values)
+            columns.append(str(col))
+        grains_group.attrs['columns'] = columns
+        self._update_index(pred_id, grains=True)
+
+    def pred_ids(self):
+        """Returns the ids of all stored predictions."""
+
+        return list(self.index.keys())
+
+    def find(self, image_name, model_str='', data_str='pred'):
+        """Returns the id of the stored prediction matching an image name as
+        find_match_in_folder does for files, or None."""
+
+        stem = Path(image_name).stem
+        matches = natsorted([x for x in self.index if x.startswith(stem)
+                             and model_str in x and data_str in x])
+        if len(matches) == 0:
+            return None
+        return matches[0]
+
+    def mask(self, pred_id):
+        """Returns the stored mask array. Data is only read when it is indexed,
+        chunk by chunk."""
+
+        return self.root['masks'][pred_id]
+
+    def read_mask(self, pred_id, region=None):
+        """Reads a mask or a region of it given as tuple of slices."""
+
+        if region is None:
+            return self.mask(pred_id)[...]
+        return self.mask(pred_id)[region]
+
+    def read_flows(self, pred_id):
+        """Reads the stored flows of an image as (dP, cellprob)."""
+
+        flows_group = self.root['flows'][pred_id]
+        return flows_group['dP'][...], flows_group['cellprob'][...]
+
+    def read_grains(self, pred_id, columns=None):
+        """Reads the grain table of an image, optionally only some columns."""
+
+        grains_group = self.root['grains'][pred_id]
+        if columns is None:
+            columns = grains_group.attrs['columns']
+        return pd.DataFrame({col: grains_group[col][...] for col in columns})
+
+    def consolidate(self):
+        """Writes the index of stored predictions and the consolidated
+        metadata of the store. Must be called once writing is done."""
+
+        self.root.attrs['index'] = self.index
+        self._zarr.consolidate_metadata(str(self.path))
+
+
+def _store_signature(path):
+    """Returns the modification times of the root metadata files of a store
+    (zarr v2 and v3), which change whenever the store is consolidated."""
+
+    signature = []
+    for name in ['zarr.json', '.zmetadata', '.zattrs']:
+        try:
+            signature.append(path.joinpath(name).stat().st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+_read_stores = {}
+_read_stores_lock = Lock()
+
+
+def open_prediction_store(folder):
+    """Returns the prediction store of folder opened for reading, or None if
+    there is none or zarr is not installed. The store is only opened again
+    when it was consolidated since it was last opened."""
+
+    if folder is None or not PredictionStore.exists(folder):
+        return None
+    folder = Path(folder)
+    path = (folder if folder.suffix == '.zarr' else folder.joinpath(STORE_NAME)).resolve()
+    signature = _store_signature(path)
+    with _read_stores_lock:
+        cached = _read_stores.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        store = PredictionStore(path, mode='r')
+    except ModuleNotFoundError:
+        return None
+    with _read_stores_lock:
+        _read_stores[path] = (signature, store)
+    return store
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_NAME = 'segmentation_manifest.jsonl'
+
+
+def file_hash(path, chunk_size=1024 ** 2):
+    """Returns the sha1 hex digest of a file read in chunks."""
+
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def model_identity(model_path):
+    """Returns a dictionary identifying model weights by path, size and
+    modification time."""
+
+    model_path = Path(model_path).resolve()
+    stat = model_path.stat()
+    return {'path': model_path.as_posix(), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+class RunManifest:
+    """Record of the images segmented into a prediction folder.
+
+    For each input image the manifest stores its size and modification time
+    (and optionally a hash of its content), the identity of the model, the
+    evaluation parameters and the name of the prediction file. It is kept as
+    JSON Lines next to the predictions and used to only process new or
+    modified images when a folder is segmented again. Records are appended
+    one line per image, later lines replacing earlier ones, so that a run
+    never rewrites the whole manifest; save() compacts it.
+
+    Parameters
+    ----------
+    folder: str or Path
+        Folder containing the predictions.
+    hash_content: bool
+        Also record the sha1 hash of the images, so that images that were
+        touched but not modified are still up to date. Requires reading every
+        image completely.
+    """
+
+    def __init__(self, folder, hash_content=False):
+        self.folder = Path(folder)
+        self.path = self.folder.joinpath(MANIFEST_NAME)
+        self.hash_content = hash_content
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry.pop('image')] = entry
+                    except (ValueError, KeyError, AttributeError):
+                        # e.g. last line of an interrupted run
+                        continue
+        except OSError:
+            self.entries = {}
+
+    def is_current(self, image_path, model, params):
+        """Returns True if image_path was already segmented with the same model
+        and parameters, has not changed since and its prediction still exists."""
+
+        image_path = Path(image_path)
+        entry = self.entries.get(image_path.name)
+        if entry is None:
+            return False
+        if entry['model'] != model or entry['params'] != params:
+            return False
+        if not self.folder.joinpath(entry['output']).exists():
+            return False
+
+        stat = image_path.stat()
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        # file was touched, only the content matters
+        if not self.hash_content or entry.get('hash') is None:
+            return False
+        if file_hash(image_path) != entry['hash']:
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def record(self, image_path, output_name, model, params):
+        """Adds or updates the entry of image_path and appends it to the
+        manifest file."""
+
+        image_path = Path(image_path)
+        stat = image_path.stat()
+        entry = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': file_hash(image_path) if self.hash_content else None,
+            'model': model,
+            'params': params,
+            'output': output_name,
+        }
+        self.entries[image_path.name] = entry
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'image': image_path.name, **entry}) + '\n')
+
+    def save(self):
+        """Rewrites the manifest with one line per image. The file is replaced
+        atomically so that an interrupted run never leaves a truncated
+        manifest. Should be called once a run is over."""
+
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.path.with_suffix('.jsonl.tmp')
+        with open(tmp_path, 'w') as f:
+            for name, entry in self.entries.items():
+                f.write(json.dumps({'image': name, **entry}) + '\n')
+        os.replace(tmp_path, self.path)
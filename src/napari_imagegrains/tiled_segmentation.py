@@ -0,0 +1,159 @@
+import os
+from pathlib import Path
+
+import numpy as np
+from cellpose import version
+from skimage.measure import regionprops
+
+
+def iter_tiles(width, height, tile_size, overlap):
+    """
+    Split a raster in a grid of non-overlapping core regions of size tile_size
+    and yield for each one the core and the window expanded by overlap on each
+    side (clipped to the raster).
+
+    Parameters
+    ----------
+    width : int
+        Raster width.
+    height : int
+        Raster height.
+    tile_size : int
+        Size of the core regions.
+    overlap : int
+        Margin added around each core region.
+
+    Yields
+    ------
+    core : tuple
+        (x0, y0, x1, y1) of the core region.
+    window : tuple
+        (x0, y0, x1, y1) of the window read for segmentation.
+    """
+
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            y1 = min(y0 + tile_size, height)
+            window = (max(x0 - overlap, 0), max(y0 - overlap, 0),
+                      min(x1 + overlap, width), min(y1 + overlap, height))
+            yield (x0, y0, x1, y1), window
+
+
+def labels_in_core(masks, core, window):
+    """
+    Returns the labels of the grains segmented in window whose centroid falls
+    in the core region, so that a grain on the seam of two tiles is kept by
+    exactly one of them.
+
+    Parameters
+    ----------
+    masks : numpy.ndarray
+        Labels of the window.
+    core : tuple
+        (x0, y0, x1, y1) of the core region in raster coordinates.
+    window : tuple
+        (x0, y0, x1, y1) of the window in raster coordinates.
+
+    Returns
+    -------
+    labels : list
+        Labels of masks kept for the core region.
+    """
+
+    cx0, cy0, cx1, cy1 = core
+    wx0, wy0 = window[:2]
+    keep = []
+    for region in regionprops(masks):
+        cy, cx = region.centroid
+        if (cx0 <= cx + wx0 < cx1) and (cy0 <= cy + wy0 < cy1):
+            keep.append(region.label)
+    return keep
+
+
+def segment_geotiff_tiled(image_path, model, output_path, tile_size=2048,
+                          overlap=256, diameter=None, min_size=15):
+    """
+    Segment a large (Geo)TIFF tile by tile without loading it into memory.
+    Each tile is read with an overlap margin and segmented separately. A grain
+    is kept only by the tile whose core region contains its centroid, so that
+    grains on tile seams are not duplicated, and label IDs are made unique
+    across tiles. The labels are written window by window to a tiled,
+    compressed GeoTIFF that keeps the projection and geotransform of the input.
+    The overlap should be larger than the largest expected grain.
+
+    Parameters
+    ----------
+    image_path : str or Path
+        Path to the input raster.
+    model : cellpose.models.CellposeModel
+        Model used for segmentation.
+    output_path : str or Path
+        Path of the label raster to create.
+    tile_size : int, optional
+        Size of the core region of each tile. The default is 2048.
+    overlap : int, optional
+        Margin read around each tile. The default is 256.
+    diameter : float, optional
+        Expected grain diameter. The default is None.
+    min_size : int, optional
+        Minimum size of the grains. The default is 15.
+
+    Returns
+    -------
+    num_labels : int
+        Number of grains in the label raster.
+    """
+
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    channels = [0, 0]
+    if int(str(version).split(".")[0]) >3:
+        channels = None
+
+    src = gdal.Open(str(image_path))
+    width, height = src.RasterXSize, src.RasterYSize
+    num_bands = min(src.RasterCount, 3)
+
+    os.makedirs(Path(output_path).parent, exist_ok=True)
+    driver = gdal.GetDriverByName('GTiff')
+    dst = driver.Create(
+        str(output_path), width, height, 1, gdal.GDT_UInt32,
+        options=['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    dst.SetProjection(src.GetProjection())
+    dst.SetGeoTransform(src.GetGeoTransform())
+    dst_band = dst.GetRasterBand(1)
+    dst_band.SetNoDataValue(0)
+
+    next_label = 1
+    for core, (wx0, wy0, wx1, wy1) in iter_tiles(width, height, tile_size, overlap):
+        win_w, win_h = wx1 - wx0, wy1 - wy0
+        bands = [src.GetRasterBand(b + 1).ReadAsArray(wx0, wy0, win_w, win_h) for b in range(num_bands)]
+        tile = bands[0] if num_bands == 1 else np.stack(bands, axis=-1)
+        if not np.any(tile):
+            continue
+
+        masks, _, _ = model.eval(tile, diameter=diameter, min_size=min_size, channels=channels)
+
+        # keep grains whose centroid falls in the core region of the tile
+        keep = labels_in_core(masks, core, (wx0, wy0, wx1, wy1))
+        if len(keep) == 0:
+            continue
+
+        lut = np.zeros(masks.max() + 1, dtype=np.uint32)
+        lut[keep] = np.arange(next_label, next_label + len(keep), dtype=np.uint32)
+        next_label += len(keep)
+        new_labels = lut[masks]
+
+        # never overwrite grains already written by a neighbouring tile
+        current = dst_band.ReadAsArray(wx0, wy0, win_w, win_h)
+        to_write = (new_labels > 0) & (current == 0)
+        current[to_write] = new_labels[to_write]
+        dst_band.WriteArray(current, wx0, wy0)
+
+    dst_band.FlushCache()
+    dst = None
+    src = None
+
+    return next_label - 1
@@ -1,9 +1,18 @@
 from pathlib import Path
-from glob import glob
-from natsort import natsorted
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from warnings import warn
 import pandas as pd
 import numpy as np
+from PIL import Image
+import tifffile
+from skimage.segmentation import relabel_sequential
+
+from .folder_index import folder_index_cache
+
+# layer attributes set by readers that can be changed on an existing layer
+REUSABLE_LAYER_KWARGS = {'scale', 'translate', 'metadata'}
 
 
 def find_matching_data_index(reference_path, data_name_list, key_string=None):
@@ -20,25 +29,82 @@ def find_matching_data_index(reference_path, data_name_list, key_string=None):
     ----------
     reference_path : str or Path
         Path to the reference image.
-    image_name_list : list
-        List of image names.
+    data_name_list : list or DataNameIndex
+        List of data names. For repeated lookups in the same list, pass
+        a DataNameIndex of the list to avoid scanning all names.
     key_string : str, optional
         Specific string that should be contained in the data_name_list items. 
         The default is None.
     """
     
     reference_name = Path(reference_path).stem
+    if isinstance(data_name_list, DataNameIndex):
+        return data_name_list.find(reference_name, key_string=key_string)
+
     match_index = [i for i in range(len(data_name_list)) if reference_name in data_name_list[i]]
     if key_string:
         match_index = [i for i in match_index if key_string in data_name_list[i]]
 
     return match_index
 
+class DataNameIndex:
+    """
+    Index of a list of data names (e.g. the file_id of grain tables) to find
+    the names containing a given string without scanning all names.
+
+    Each name is indexed by its substrings of length ngram. Names
+    containing a string are looked up among the names sharing all the
+    ngrams of that string, and then checked.
+
+    Parameters
+    ----------
+    data_name_list : list
+        List of data names.
+    ngram : int
+        Length of the indexed substrings.
+    """
+
+    def __init__(self, data_name_list, ngram=3):
+        self.names = [str(name) for name in data_name_list]
+        self.ngram = ngram
+        self._postings = {}
+        for ind, name in enumerate(self.names):
+            for gram in {name[i:i+ngram] for i in range(len(name) - ngram + 1)}:
+                self._postings.setdefault(gram, set()).add(ind)
+
+    def find(self, name, key_string=None):
+        """
+        Returns the sorted indices of the names containing name and, if
+        given, key_string. Same result as find_matching_data_index on the
+        list of names.
+        """
+
+        strings = [name] + ([key_string] if key_string else [])
+        grams = {s[i:i+self.ngram] for s in strings for i in range(len(s) - self.ngram + 1)}
+        if len(grams) == 0:
+            # strings shorter than ngram cannot be looked up
+            candidates = range(len(self.names))
+        else:
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates &= posting
+            candidates = sorted(candidates)
+
+        return [i for i in candidates if all(s in self.names[i] for s in strings)]
+
+    def __len__(self):
+        return len(self.names)
+
 def find_match_in_folder(folder, image_name, model_str, data_str, data_format):
     """
     Find the matching data in a folder given an image name, data specific string and format.
     It is epxected that data is of the form image_name+data_str+data_format.
     Typical usage: find the matching mask in a folder of masks matching the image name.
+    Folder contents are indexed once and only listed again when the folder
+    is modified, so that repeated lookups don't scan the folder.
 
     Parameters
     ----------
@@ -60,7 +126,12 @@ def find_match_in_folder(folder, image_name, model_str, data_str, data_format):
     
     """
 
-    mask_list = natsorted(glob(f'{folder}/{Path(image_name).stem}*{model_str}*{data_str}*.{data_format}'))
+    try:
+        folder_index = folder_index_cache.get(folder)
+        mask_list = [f'{folder}/{name}' for name in folder_index.find(
+            Path(image_name).stem, f'{Path(image_name).stem}*{model_str}*{data_str}*.{data_format}')]
+    except OSError:
+        mask_list = []
     if len(mask_list) == 0:
         # raise warning that no image is found with warning. import warning if necessary
         warn(f'No mask found in {folder} matching {Path(image_name).stem}*{model_str}*{data_str}*.{data_format}')
@@ -73,14 +144,223 @@ def find_match_in_folder(folder, image_name, model_str, data_str, data_format):
     
     return mask
 
-def read_complete_grain_files(grain_file_list):
+
+def group_images_by_size(image_paths, memory_budget):
+    """
+    Group consecutive images of identical size and number of channels into
+    batches whose estimated memory footprint (as float32 arrays) stays below
+    memory_budget. Images keep their order so that results can be shown as
+    they come. Image sizes are read from the file headers without decoding
+    the images. Images whose size cannot be determined are put in their own
+    batch.
+
+    Parameters
+    ----------
+    image_paths : list
+        List of image paths.
+    memory_budget : int
+        Maximum memory in bytes of the images of one batch. A batch always
+        contains at least one image.
+
+    Returns
+    -------
+    batches : list
+        List of lists of image paths.
+    """
+
+    batches = []
+    batch_size = None
+    for image_path in image_paths:
+        try:
+            with Image.open(image_path) as im:
+                width, height = im.size
+                size = (width, height, len(im.getbands()))
+        except (OSError, Image.DecompressionBombError):
+            batches.append([image_path])
+            batch_size = None
+            continue
+        batch_len = max(1, int(memory_budget // (size[0] * size[1] * size[2] * 4)))
+        if size == batch_size and len(batches[-1]) < batch_len:
+            batches[-1].append(image_path)
+        else:
+            batches.append([image_path])
+            batch_size = size
+
+    return batches
+
+
+def prefetch_images(batches, reader, read_ahead=2, io_threads=2):
+    """
+    Decode batches of images ahead of time on a pool of I/O threads. While
+    the caller processes the current batch, the next read_ahead batches are
+    already being read, so that disk access overlaps with computation.
+
+    Parameters
+    ----------
+    batches : list
+        List of lists of image paths.
+    reader : callable
+        Function reading an image path and returning an array.
+    read_ahead : int, optional
+        Number of batches decoded in advance. The default is 2.
+    io_threads : int, optional
+        Number of threads used for reading. The default is 2.
+
+    Yields
+    ------
+    batch : list
+        List of image paths of the batch.
+    images : list
+        List of decoded images of the batch.
+    """
+
+    batch_iter = iter(batches)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=io_threads)
+
+    def submit_next():
+        batch = next(batch_iter, None)
+        if batch is not None:
+            pending.append((batch, [executor.submit(reader, str(x)) for x in batch]))
+
+    try:
+        for _ in range(max(read_ahead, 1)):
+            submit_next()
+        while pending:
+            batch, futures = pending.popleft()
+            submit_next()
+            yield batch, [f.result() for f in futures]
+    finally:
+        # when the generator is closed early, the reads ahead are dropped
+        # rather than waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def compact_mask(mask):
+    """
+    Relabel a mask sequentially and cast it to the smallest unsigned integer
+    type that holds all labels.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Label mask.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Relabeled mask of type uint8, uint16, uint32 or uint64.
+    """
+
+    mask = np.asarray(mask)
+    if mask.size == 0:
+        # relabel_sequential fails on empty arrays
+        return mask.astype(np.uint8)
+    mask, _, _ = relabel_sequential(mask)
+    max_label = int(mask.max())
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if max_label <= np.iinfo(dtype).max:
+            return mask.astype(dtype, copy=False)
+
+def save_mask(mask_path, mask, compression='zlib'):
+    """
+    Save a label mask as compact, compressed and tiled TIFF. The mask is
+    relabeled sequentially and stored with the smallest possible unsigned
+    type. The files can be read by any TIFF reader (tifffile, skimage,
+    napari, cellpose).
+
+    Parameters
+    ----------
+    mask_path : str or Path
+        Path of the TIFF file.
+    mask : numpy.ndarray
+        Label mask.
+    compression : str, optional
+        TIFF compression, e.g. 'zlib' (deflate) or 'zstd' (requires
+        imagecodecs). The default is 'zlib'.
+    """
+
+    mask = compact_mask(mask)
+    tile = (256, 256) if mask.ndim == 2 else None
+    tifffile.imwrite(mask_path, mask, compression=compression,
+                     predictor=True, tile=tile)
+
+@lru_cache(maxsize=None)
+def _pyarrow_csv():
+    """Returns the pyarrow.csv module if pyarrow is installed, else None."""
+
+    try:
+        from pyarrow import csv
+        return csv
+    except ModuleNotFoundError:
+        return None
+
+def _read_grain_file(grain_file, columns=None, column_types=None):
+
+    csv = _pyarrow_csv()
+    if csv is None:
+        return pd.read_csv(grain_file, usecols=columns)
+    if column_types is not None:
+        try:
+            return csv.read_csv(grain_file, convert_options=csv.ConvertOptions(
+                include_columns=columns, column_types=column_types)).to_pandas()
+        except ValueError:
+            # columns whose type differs from the reference file are inferred
+            pass
+    return csv.read_csv(grain_file, convert_options=csv.ConvertOptions(
+        include_columns=columns)).to_pandas()
+
+def _read_grain_files(grain_file_list, columns=None, io_threads=8):
+    """Read grain files concurrently. With pyarrow, the column types of the
+    first non-empty file are used for all other files instead of inferring
+    them for each file. Returns a list with None for files that could not
+    be read."""
+
+    grains = [None] * len(grain_file_list)
+
+    def read(ind, column_types=None):
+        try:
+            grains[ind] = _read_grain_file(grain_file_list[ind], columns=columns, column_types=column_types)
+        except (OSError, ValueError, KeyError) as e:
+            warn(f'Could not read {grain_file_list[ind]} with error {e}', stacklevel=2)
+
+    column_types = None
+    first = -1
+    if _pyarrow_csv() is not None:
+        import pyarrow as pa
+        for first in range(len(grain_file_list)):
+            read(first)
+            if grains[first] is not None and len(grains[first]) > 0:
+                schema = pa.Schema.from_pandas(grains[first], preserve_index=False)
+                column_types = {field.name: field.type for field in schema}
+                break
+
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        list(executor.map(lambda ind: read(ind, column_types), range(first + 1, len(grain_file_list))))
+
+    return grains
+
+def _drop_index_column(grains):
+    """Removes the unnamed index column written by pandas, which pandas reads
+    as 'Unnamed: 0' and pyarrow as ''."""
+
+    index_columns = [x for x in grains.columns if str(x) == '' or str(x).startswith('Unnamed:')]
+    return grains.drop(columns=index_columns) if index_columns else grains
+
+def read_complete_grain_files(grain_file_list, columns=None, io_threads=8):
     """
     Read the complete grain files and return a list of dictionaries containing the data.
+    Files are read concurrently, with the pyarrow CSV reader if it is installed.
+    The unnamed index column written by pandas is left out.
 
     Parameters
     ----------
     grain_file_list : list
         List of grain file paths.
+    columns : list, optional
+        Columns to read. By default all columns are read.
+    io_threads : int
+        Number of threads reading files.
 
     Returns
     -------
@@ -88,12 +368,52 @@ def read_complete_grain_files(grain_file_list):
         List of pandas dataframes containing the data.
     """
     
-    grains = []
-    for grain_file in grain_file_list:
-        try:
-            grains.append(pd.read_csv(grain_file))
-        except Exception as e:
-            warn(f'Could not read {grain_file} with error {e}')
+    grains = _read_grain_files(list(grain_file_list), columns=columns, io_threads=io_threads)
+
+    return [_drop_index_column(x) for x in grains if x is not None]
+
+def read_grain_dataset(grain_file_list, file_ids=None, columns=None, io_threads=8):
+    """
+    Read the grain files of a dataset into a single dataframe with a file_id
+    column. Files are read concurrently (see read_complete_grain_files) and
+    concatenated once, without first adding the file_id to each dataframe.
+
+    Parameters
+    ----------
+    grain_file_list : list
+        List of grain file paths.
+    file_ids : list, optional
+        Identifier of each file, by default the file name without extension.
+    columns : list, optional
+        Columns to read. By default all columns except the unnamed index
+        column written by pandas.
+    io_threads : int
+        Number of threads reading files.
+
+    Returns
+    -------
+    grains : pandas.DataFrame
+        Grains of all files, indexed by grain within each file as with
+        pd.concat.
+    """
+
+    grain_file_list = list(grain_file_list)
+    if file_ids is None:
+        file_ids = [Path(x).stem for x in grain_file_list]
+
+    grains = _read_grain_files(grain_file_list, columns=columns, io_threads=io_threads)
+    file_ids = [file_id for file_id, x in zip(file_ids, grains) if x is not None]
+    grains = [x for x in grains if x is not None]
+    if len(grains) == 0:
+        return pd.DataFrame(columns=list(columns or []) + ['file_id'])
+
+    # frames are concatenated once, without copying them to add the file_id.
+    # Empty files are left out as their columns have no type
+    lengths = [len(x) for x in grains]
+    grains = pd.concat([x for x in grains if len(x) > 0] or grains[:1])
+    if columns is None:
+        grains = _drop_index_column(grains)
+    grains['file_id'] = np.repeat(np.array(file_ids, dtype=object), lengths)
 
     return grains
 
@@ -104,4 +424,123 @@ def compute_average_ap(evals):
     std_l = np.std(all_ap, axis=0)
     std_ul = avg_l + std_l
     std_ll = avg_l - std_l
-    return avg_l, std_l, std_ul, std_ll
\ No newline at end of file
+    return avg_l, std_l, std_ul, std_ll
+
+
+def show_in_layer(viewer, layer, data, name, layer_type='image', layer_kwargs=None):
+    """
+    Display data in an existing layer by swapping its data, name and metadata
+    in place, which avoids re-creating the layer and its visual. User display
+    settings like contrast limits, gamma and colormap are kept. A new layer
+    is added if layer is None, not in the viewer anymore or incompatible
+    with data (dimensions, RGB or data type).
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        Viewer in which data is displayed.
+    layer : napari.layers.Image or napari.layers.Labels or None
+        Layer to reuse.
+    data : array
+        Data to display.
+    name : str
+        Name of the layer.
+    layer_type : str
+        'image' or 'labels'.
+    layer_kwargs : dict, optional
+        Layer attributes returned by a napari reader with the data of an
+        image. The layer is only reused if they are limited to scale,
+        translate and metadata, which are then set on the layer.
+
+    Returns
+    -------
+    layer : napari.layers.Image or napari.layers.Labels
+        Layer displaying data.
+    """
+
+    layer_kwargs = {k: v for k, v in (layer_kwargs or {}).items() if k != 'name'}
+    reusable = layer is not None and layer in viewer.layers and layer.data.ndim == data.ndim
+    reusable = reusable and set(layer_kwargs).issubset(REUSABLE_LAYER_KWARGS)
+    if reusable and layer_type == 'image':
+        is_rgb = data.ndim == 3 and data.shape[-1] in (3, 4)
+        reusable = layer.rgb == is_rgb and layer.data.dtype == data.dtype
+    if not reusable:
+        if layer is not None and layer in viewer.layers:
+            viewer.layers.remove(layer)
+        if layer_type == 'labels':
+            return viewer.add_labels(data, name=name, **layer_kwargs)
+        return viewer.add_image(data, name=name, **layer_kwargs)
+
+    layer.data = data
+    layer.name = name
+    layer.metadata = layer_kwargs.get('metadata', {})
+    layer.scale = layer_kwargs.get('scale', [1] * layer.ndim)
+    layer.translate = layer_kwargs.get('translate', [0] * layer.ndim)
+    if layer_type == 'labels':
+        layer.properties = {}
+    else:
+        # keep the contrast limits set by the user within the range of the new data
+        contrast_limits = layer.contrast_limits
+        layer.reset_contrast_limits_range()
+        layer.contrast_limits = contrast_limits
+    return layer
+
+
+def show_layer_data(viewer, layer, layer_data, name):
+    """
+    Display the layer data of a file read with the napari reader plugins (see
+    image_cache.read_layer_data) as viewer.open does. A single image layer is
+    displayed in layer if possible (see show_in_layer), other layer data
+    replaces layer with new layers.
+
+    Parameters
+    ----------
+    viewer : napari.Viewer
+        Viewer in which data is displayed.
+    layer : napari.layers.Image or None
+        Layer to reuse.
+    layer_data : list
+        List of (data, kwargs, layer_type) tuples.
+    name : str
+        Name of the layer(s) unless set by the reader.
+
+    Returns
+    -------
+    layer : napari.layers.Layer
+        First layer displaying layer_data.
+    """
+
+    # napari is imported here so that the headless batch module does not load it
+    from napari.layers import Layer
+
+    if len(layer_data) == 1 and layer_data[0][2] == 'image':
+        data, kwargs, _ = layer_data[0]
+        return show_in_layer(viewer, layer, data, kwargs.get('name', name), layer_kwargs=kwargs)
+
+    if layer is not None and layer in viewer.layers:
+        viewer.layers.remove(layer)
+    layers = [viewer.add_layer(Layer.create(data, {'name': name, **kwargs}, layer_type))
+              for data, kwargs, layer_type in layer_data]
+    return layers[0]
+
+
+def clear_other_layers(viewer, keep):
+    """Removes all layers of viewer except the layers in keep, None entries
+    of keep are ignored."""
+
+    keep = [layer for layer in keep if layer is not None]
+    for layer in [layer for layer in viewer.layers if layer not in keep]:
+        viewer.layers.remove(layer)
+
+
+def wait_for_worker(owner, attribute):
+    """Processes Qt events until the background worker stored in the given
+    attribute of owner is done, i.e. reset to None by its finished handler.
+    Used by the wait_for_* methods of the widgets, which are mostly useful
+    for scripting and tests."""
+
+    from qtpy.QtCore import QEventLoop
+    from qtpy.QtWidgets import QApplication
+
+    while getattr(owner, attribute) is not None:
+        QApplication.processEvents(QEventLoop.AllEvents, 50)